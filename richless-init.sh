@@ -35,11 +35,6 @@ less() {
             esac
         done
 
-        # Save piped input to temp file
-        local tmpfile
-        tmpfile=$(mktemp "${TMPDIR:-/tmp}/richless.XXXXXX") || return 1
-        cat > "$tmpfile"
-
         # Collect non --md/--m arguments for less
         local clean_args=""
         for arg in "$@"; do
@@ -53,32 +48,13 @@ less() {
             esac
         done
 
-        # Check if we should render as markdown
+        # richless reads the pipe itself: it detects Markdown, structured data
+        # or source from the first bytes and renders the rest as it arrives
         if [ $force_markdown -eq 1 ]; then
-            richless --md "$tmpfile" | command less -R ${clean_args}
+            richless --md - | command less -R ${clean_args}
         else
-            # Check for YAML/JSON first - these should use syntax highlighting, not markdown
-            first_line=$(head -1 "$tmpfile" 2>/dev/null)
-            if printf '%s\n' "$first_line" | grep -qE '^---$|^%YAML|^[[:space:]]*[{[]'; then
-                # Looks like YAML or JSON - use syntax highlighting
-                richless "$tmpfile" | command less -R ${clean_args}
-            # Check for YAML with comments: first non-comment line has key: pattern
-            elif grep -m1 -vE '^[[:space:]]*#|^[[:space:]]*$' "$tmpfile" 2>/dev/null | grep -qE '^[a-zA-Z_][a-zA-Z0-9_-]*:'; then
-                # Looks like YAML with comments - use syntax highlighting
-                richless "$tmpfile" | command less -R ${clean_args}
-            # Auto-detect: check if piped content looks like markdown
-            # Use stricter patterns to avoid false positives (e.g., TOML comments matching ^# )
-            elif grep -qE '^\* |^- |^[0-9]+\. |^\[.*\]\(.*\)|^```|\*\*.*\*\*|^>|^\||^-{3,}|^={3,}' "$tmpfile" 2>/dev/null && \
-                 grep -qE '^#{1,6} ' "$tmpfile" 2>/dev/null; then
-                richless --md "$tmpfile" | command less -R ${clean_args}
-            else
-                # Fall through to richless for content-based syntax detection
-                richless "$tmpfile" | command less -R ${clean_args}
-            fi
+            richless - | command less -R ${clean_args}
         fi
-
-        # Clean up temp file
-        rm -f "$tmpfile"
     else
         # No pipe - check for --md flag among arguments (must be exact match, not substring)
         local force_markdown=0
@@ -109,12 +85,44 @@ less() {
                 esac
             done
 
-            # Render each file with markdown
+            local unsafe_filename=0
             for file in ${files}; do
-                if [ -n "$file" ]; then
-                    richless --md "$file" | command less -R ${opts}
-                fi
+                case "$file" in
+                    *[!A-Za-z0-9_./-]*) unsafe_filename=1; break ;;
+                esac
             done
+
+            # Render all files in one background richless process, so a
+            # single less gets them all (:n/:p) while the later ones render
+            local batch_dir=""
+            if [ "$unsafe_filename" -eq 0 ] && [ -n "$files" ]; then
+                batch_dir=$(richless --batch --md ${files}) || batch_dir=""
+            fi
+
+            if [ -n "$batch_dir" ]; then
+                RICHLESS_BATCH_DIR="$batch_dir" LESSOPEN="|richless --md %s" \
+                    command less -R ${opts} ${files}
+                # Stop the renderer (and its workers, in its process group)
+                # if files are still rendering, so it does not write into
+                # the directory as it is removed
+                local batch_pid
+                batch_pid=$(sed -n 's/.*"pid": *\([0-9][0-9]*\).*/\1/p' "$batch_dir/manifest.json" 2>/dev/null)
+                if [ -n "$batch_pid" ] && kill -TERM "-$batch_pid" 2>/dev/null; then
+                    local tries=0
+                    while kill -0 "$batch_pid" 2>/dev/null && [ "$tries" -lt 50 ]; do
+                        sleep 0.1
+                        tries=$((tries + 1))
+                    done
+                fi
+                rm -rf "$batch_dir"
+            else
+                # Render each file with markdown
+                for file in ${files}; do
+                    if [ -n "$file" ]; then
+                        richless --md "$file" | command less -R ${opts}
+                    fi
+                done
+            fi
         else
             # Normal less operation - let LESSOPEN handle it
             local unsafe_filename=0
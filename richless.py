@@ -7,18 +7,230 @@ Markdown files and syntax highlighting code using the rich library.
 """
 
 import argparse
+import builtins
+import codecs
+import errno
+import json
 import os
 import re
 import shutil
+import signal
+import stat
 import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections.abc import Iterable, Iterator
+from itertools import chain, groupby, islice
 from pathlib import Path
-from pygments.lexers import get_lexer_by_name, ClassNotFound
-from rich.console import Console
-from rich.markdown import Markdown
-from rich.syntax import Syntax
+from typing import TYPE_CHECKING, Any, BinaryIO, TextIO
+
+# rich and Pygments are imported inside the functions that use them, so
+# plain-text passthrough and fallbacks only ever load the standard library.
+# So are the heavier standard modules only some paths need (csv, hashlib,
+# socket, tempfile, threading and others).
+if TYPE_CHECKING:
+    import socket
+
+    from pygments.lexer import Lexer
 
 MIN_SYNTAX_WIDTH = 80
 MAX_SYNTAX_WIDTH = 16384
+WIDE_LINE_RE = re.compile(rf'(?:^|(?<=\r))[^\n\r]{{{MIN_SYNTAX_WIDTH},}}', re.MULTILINE)
+# Lines too wide to highlight at a bounded cost. They are passed through raw
+# and the lexer restarts after them.
+OVERSIZED_LINE_RE = re.compile(rf'^[^\n]{{{MAX_SYNTAX_WIDTH},}}', re.MULTILINE)
+
+SYNTAX_THEME = "monokai"
+TAB_SIZE = 4
+
+# Syntax output is streamed in batches of lines. The first batch is about one
+# screen so less can show something right away; later batches are larger to
+# keep per-batch overhead low.
+STREAM_FIRST_BATCH_LINES = 100
+STREAM_BATCH_LINES = 2000
+
+# Markdown is rendered in runs of whole top-level blocks, the first about one
+# screen long and later ones this many source lines long
+MARKDOWN_BATCH_LINES = 500
+# Blocks after which rich does (paragraph) or does not (rule) put a blank
+# line before the next block
+MARKDOWN_STATE_BLOCKS = {True: 'x\n\n', False: '---\n\n'}
+MARKDOWN_REFERENCE_RE = re.compile(r'^ {0,3}\[[^\]]+\]:', re.MULTILINE)
+MARKDOWN_LIST_ITEM_RE = re.compile(r'(?:[-+*]|[0-9]{1,9}[.)])(?:[ \t]|$)')
+# Only top-level fences and HTML blocks can hold unindented lines; one inside
+# a list item ends at the first unindented line after a blank line anyway
+MARKDOWN_FENCE_RE = re.compile(r' {0,3}(`{3,}|~{3,})')
+# HTML blocks that may contain blank lines, with what ends them
+MARKDOWN_HTML_BLOCKS = [
+    (re.compile(r' {0,3}<(?:pre|script|style|textarea)(?:\s|>|$)', re.IGNORECASE),
+     re.compile(r'</(?:pre|script|style|textarea)>', re.IGNORECASE)),
+    (re.compile(r' {0,3}<!--'), re.compile('-->')),
+    (re.compile(r' {0,3}<\?'), re.compile(r'\?>')),
+    (re.compile(r' {0,3}<!\[CDATA\['), re.compile(r'\]\]>')),
+    (re.compile(r' {0,3}<![A-Za-z]'), re.compile('>')),
+]
+
+# Inputs at least this many characters long are highlighted in parallel by a
+# pool of worker processes (RICHLESS_WORKERS, default: one per CPU).
+PARALLEL_MIN_CHARS = 1024 * 1024
+PARALLEL_CHUNK_LINES = 5000
+# Lines lexed past the end of a chunk to check that the next chunk, which a
+# worker lexes from the lexer's initial state, starts in the state this chunk
+# ends in
+PARALLEL_RESYNC_LINES = 3
+# Lexers whose state does not carry from line to line, so any line can start
+# a chunk. Other lexers start chunks at a top-level line after a blank line.
+LINE_SAFE_LEXERS = {'json'}
+# While waiting on workers, richless checks this often whether less has quit
+# (closed the output), to stop rendering instead of finishing unseen work
+OUTPUT_POLL_SECONDS = 0.02
+
+# Extensions that are shown as plain text, whatever the content looks like
+PLAIN_TEXT_EXTENSIONS = {'txt', 'text'}
+# Tables are rendered with aligned columns (render_table()) rather than a
+# lexer: Zeek TSV logs, found by their header, and CSV and TSV, found by
+# extension or by lines that split into the same number of fields
+TABLE_FORMATS = {'zeek', 'csv', 'tsv'}
+TABLE_EXTENSIONS = {'csv': 'csv', 'tsv': 'tsv'}
+# Content detection calls input a table only on strong evidence: this many
+# non-blank lines of this many fields each, a header with no numbers over
+# at least one column of numbers, and no space after a separator (as prose
+# and log messages have)
+TABLE_DETECT_ROWS = 3
+TABLE_DETECT_FIELDS = 3
+TABLE_NUMBER_RE = re.compile(r'[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?$')
+# Extensions richless maps to a lexer itself, ahead of Pygments' aliases and
+# filename patterns
+LEXER_EXTENSION_OVERRIDES = {
+    'jsonl': 'json',  # JSON Lines uses JSON syntax
+}
+
+# Content detection looks only at the start of the input, so its cost does
+# not grow with the file: this many characters, and of them the first
+# DETECT_LINES lines for line-based signatures
+DETECT_WINDOW_CHARS = 64 * 1024
+DETECT_LINES = 20
+# Leading bytes of binary formats that can pass for UTF-8 text
+MAGIC_SIGNATURES = [
+    ('png', re.compile(rb'\x89PNG\r\n\x1a\n')),
+    ('gif', re.compile(rb'GIF8[79]a')),
+    ('pdf', re.compile(rb'%PDF-')),
+    ('zip', re.compile(rb'PK\x03\x04')),
+    ('gzip', re.compile(rb'\x1f\x8b')),
+    ('bzip2', re.compile(rb'BZh[1-9]1AY&SY')),
+    ('xz', re.compile(rb'\xfd7zXZ\x00')),
+    ('zstd', re.compile(rb'\x28\xb5\x2f\xfd')),
+    ('elf', re.compile(rb'\x7fELF')),
+]
+# Of those, the formats the stdlib can decompress as a stream; they are
+# rendered by what they hold
+COMPRESSED_FORMATS = {'gzip', 'bzip2', 'xz'}
+# Interpreters named on a #! line, checked in order
+SHEBANG_SIGNATURES = [
+    (re.compile(r'python'), 'python'),
+    (re.compile(r'bash|/sh'), 'bash'),
+    (re.compile(r'node'), 'javascript'),
+    (re.compile(r'ruby'), 'ruby'),
+    (re.compile(r'perl'), 'perl'),
+]
+TOML_HEADER_RE = re.compile(r'\[{1,2}[a-zA-Z_][a-zA-Z0-9_.-]*\]{1,2}\s*$')
+# Signatures of the first line (leading whitespace stripped), checked in order
+FIRST_LINE_SIGNATURES = [
+    (re.compile(r'#separator '), 'zeek'),
+    (re.compile(r'---$|%YAML'), 'yaml'),
+    (re.compile(r'\{'), 'json'),
+    # A [ that does not open a TOML table header
+    (re.compile(r'\[(?!\[?[a-zA-Z_][a-zA-Z0-9_.-]*\]{1,2}\s*$)'), 'json'),
+    (re.compile(r'<\?xml|<!DOCTYPE'), 'xml'),
+]
+# Signatures of the first line that is not blank or a # comment
+CONTENT_LINE_SIGNATURES = [
+    (TOML_HEADER_RE, 'toml'),
+    (re.compile(r'[a-zA-Z_][a-zA-Z0-9_-]*\s*=\s*'), 'toml'),
+    (re.compile(r'[a-zA-Z_][a-zA-Z0-9_-]*:\s*'), 'yaml'),
+]
+# Input with no extension is Markdown if it has a heading and at least one
+# other Markdown construct (TOML and shell comments look like headings)
+MARKDOWN_HEADING_RE = re.compile(r'^#{1,6} ', re.MULTILINE)
+MARKDOWN_HINT_RE = re.compile(
+    r'^(?:\* |- |[0-9]+\. |\[.*\]\(.*\)|```|>|\||-{3,}|={3,})|\*\*.*\*\*', re.MULTILINE)
+
+# rich renders Pygments' text lexer in Monokai's foreground color on the
+# default background. Plain text reproduces that output, with its SGR
+# sequences minimized, without loading rich or Pygments.
+PLAIN_TEXT_SGR = '\x1b[38;2;248;248;242m'
+SGR_RESET = '\x1b[0m'
+# Control characters rich strips from rendered text (bell, backspace,
+# vertical tab, form feed)
+STRIPPED_CONTROL_CODES = dict.fromkeys([7, 8, 11, 12])
+
+# Highlighting stops after this many seconds (RICHLESS_BUDGET_SECONDS) and
+# the rest of the file is written raw. RICHLESS_BUDGET_MB limits how much of
+# a file is highlighted in the same way.
+DEFAULT_BUDGET_SECONDS = 10
+# Size of the slices raw output is written in
+RAW_WRITE_CHARS = 1024 * 1024
+
+# Leading bytes of a file checked for NUL bytes and invalid UTF-8 before
+# anything is decoded. Files that fail are left for less to show natively.
+BINARY_SNIFF_BYTES = 8192
+
+# Piped input (richless -) is sniffed from its first PIPE_SNIFF_BYTES, or
+# from what has arrived when the producer pauses for PIPE_SNIFF_WAIT seconds,
+# and the rest of the pipe is rendered as it arrives
+PIPE_SNIFF_BYTES = DETECT_WINDOW_CHARS
+PIPE_SNIFF_WAIT = 0.2
+PIPE_READ_BYTES = 64 * 1024
+# A piece of piped input that may start inside a multi-line construct is
+# lexed again following the text before it, from the last line where lexing
+# likely starts afresh (see find_chunk_starts()) and up to this many
+# characters. At most PIPE_RELEX_FACTOR times the input is lexed again in
+# all, however often the producer pauses
+PIPE_RELEX_MAX_CHARS = 64 * 1024
+PIPE_RELEX_FACTOR = 4
+# A line with no indentation after a blank line
+PIPE_LEXING_START_RE = re.compile(r'\n[^\S\n]*\n(?=\S)')
+
+# Rendered-output cache (opt-in with RICHLESS_CACHE=1)
+DEFAULT_CACHE_MAX_MB = 256
+# Temp files older than this are leftovers from killed writers
+STALE_CACHE_TEMP_SECONDS = 3600
+# Running total of the cache's size, in its directory, so a write only walks
+# the cache tree to evict entries once the total goes over the bound
+CACHE_SIZE_FILE = '.size'
+
+# Render server (richless --server)
+DEFAULT_SERVER_IDLE_TIMEOUT = 600
+# How long a client waits for the server to accept a request before
+# rendering in-process instead
+SERVER_CONNECT_TIMEOUT = 5
+
+# Batch rendering (richless --batch): how often a richless started by less
+# checks whether the batch has finished rendering its file
+BATCH_POLL_SECONDS = 0.02
+
+# Tree export (richless --render-tree): suffix of the rendered files, and the
+# manifest of what each was rendered from
+TREE_OUTPUT_SUFFIX = '.ansi'
+TREE_MANIFEST = '.richless-tree.json'
+
+# Git change markers (opt-in with RICHLESS_GIT_GUTTER=1), in a column in
+# front of each line of highlighted source, by the kind of change git's
+# index has against the file. Lines after the first write wait up to
+# GIT_GUTTER_WAIT_SECONDS for the diff before going out unmarked.
+GIT_GUTTER_MARKERS = {
+    'added': '\x1b[38;2;166;226;46m+\x1b[0m ',
+    'modified': '\x1b[38;2;230;219;116m~\x1b[0m ',
+    'removed-above': '\x1b[38;2;249;38;114m\u203e\x1b[0m ',
+    'removed-below': '\x1b[38;2;249;38;114m_\x1b[0m ',
+}
+GIT_GUTTER_BLANK = '  '
+GIT_GUTTER_WAIT_SECONDS = 2.0
+# Files larger than this get no markers: diffing them takes seconds of CPU
+# that highlighting, in the same process, would have to share
+GIT_GUTTER_MAX_BYTES = 1024 * 1024
 
 
 def is_markdown_file(filepath: str) -> bool:
@@ -27,76 +239,83 @@ def is_markdown_file(filepath: str) -> bool:
     return ext in ['.md', '.markdown']
 
 
-def detect_syntax_from_content(content: str) -> str:
-    """Detect file type from content when extension is unknown."""
-    if not content:
-        return "text"
-
-    lines = content.split('\n', 20)  # Check first 20 lines
-    first_line = lines[0].strip() if lines else ''
-
-    # YAML detection: starts with --- or %YAML
-    if first_line == '---' or first_line.startswith('%YAML'):
-        return "yaml"
+def detect_format(head: str | bytes, markdown: bool = True) -> str:
+    """Detect the format of content from its start, for input with no usable extension.
 
-    # JSON detection: starts with { or [
-    # But exclude TOML section headers like [section] or [[array]]
-    if first_line.startswith('{'):
-        return "json"
-    if first_line.startswith('[') and not re.match(r'^\[{1,2}[a-zA-Z_][a-zA-Z0-9_.-]*\]{1,2}\s*$', first_line):
-        return "json"
-
-    # Shebang detection
+    Returns 'binary', 'markdown' (only if `markdown` is set), a Pygments
+    lexer name, or 'text'. Only the first DETECT_WINDOW_CHARS are looked
+    at, against precompiled signatures: magic bytes, the first line
+    (YAML/JSON/XML openings, Zeek log headers and shebangs), the first
+    line that is not a comment (TOML/YAML), Markdown constructs anywhere in
+    the window, then lines that split into even columns (CSV/TSV).
+    """
+    if isinstance(head, bytes):
+        if is_binary(head[:BINARY_SNIFF_BYTES]):
+            return 'binary'
+        head = head[:DETECT_WINDOW_CHARS].decode('utf-8', errors='replace')
+    head = head[:DETECT_WINDOW_CHARS]
+    lines = head.split('\n', DETECT_LINES)[:DETECT_LINES]
+    first_line = lines[0].strip()
+    for pattern, fmt in FIRST_LINE_SIGNATURES:
+        if pattern.match(first_line):
+            return fmt
     if first_line.startswith('#!'):
-        if 'python' in first_line:
-            return "python"
-        elif 'bash' in first_line or '/sh' in first_line:
-            return "bash"
-        elif 'node' in first_line:
-            return "javascript"
-        elif 'ruby' in first_line:
-            return "ruby"
-        elif 'perl' in first_line:
-            return "perl"
-
-    # XML/HTML detection
-    if first_line.startswith('<?xml') or first_line.startswith('<!DOCTYPE'):
-        return "xml"
-
-    # TOML detection: look for key = value patterns or [section] headers
-    toml_score = 0
+        for pattern, fmt in SHEBANG_SIGNATURES:
+            if pattern.search(first_line):
+                return fmt
+
     for line in lines:
         stripped = line.strip()
-        if not stripped or stripped.startswith('#'):
-            continue
-        # TOML section header: [section] or [[array]]
-        if re.match(r'^\[{1,2}[a-zA-Z_][a-zA-Z0-9_.-]*\]{1,2}\s*$', stripped):
-            return "toml"
-        # TOML key = value (with equals sign, not colon)
-        if re.match(r'^[a-zA-Z_][a-zA-Z0-9_-]*\s*=\s*', stripped):
-            toml_score += 1
-            if toml_score >= 2:
-                return "toml"
-            continue
-        break
+        if stripped and not stripped.startswith('#'):
+            for pattern, fmt in CONTENT_LINE_SIGNATURES:
+                if pattern.match(stripped):
+                    return fmt
+            break
 
-    if toml_score > 0:
-        return "toml"
+    if markdown and MARKDOWN_HEADING_RE.search(head) and MARKDOWN_HINT_RE.search(head):
+        return 'markdown'
+    # Only whole lines: the last piece of the split may be cut short
+    return detect_table(head.split('\n', DETECT_LINES)[:-1]) or 'text'
+
+
+def detect_table(lines: list[str]) -> str | None:
+    """Name the table format of some lines, 'tsv' or 'csv', or return None if they are not a table.
+
+    The non-blank lines (at least TABLE_DETECT_ROWS) must all split into
+    the same number of fields, at least TABLE_DETECT_FIELDS, none of them
+    starting with a space after the separator. The first line (the header)
+    must have no empty or numeric field, and at least one column must hold
+    only numbers below it.
+    """
+    rows = [line.rstrip('\r') for line in lines if line.strip()]
+    if len(rows) < TABLE_DETECT_ROWS:
+        return None
+    if all('\t' in row for row in rows):
+        fmt, fields = 'tsv', [row.split('\t') for row in rows]
+    elif all(',' in row for row in rows):
+        import csv
+
+        try:
+            fmt, fields = 'csv', list(csv.reader(rows))
+        except csv.Error:
+            return None
+    else:
+        return None
+    header, *data = fields
+    if len(header) < TABLE_DETECT_FIELDS or any(len(row) != len(header) for row in data):
+        return None
+    if any(field[:1].isspace() for row in fields for field in row[1:]):
+        return None
+    if any(not field.strip() or TABLE_NUMBER_RE.match(field) for field in header):
+        return None
+    if not any(all(TABLE_NUMBER_RE.match(row[i]) for row in data) for i in range(len(header))):
+        return None
+    return fmt
 
-    # YAML detection: look for key: value patterns (possibly after # comments)
-    # Skip comment lines and look for YAML structure
-    for line in lines:
-        stripped = line.strip()
-        # Skip empty lines and comments
-        if not stripped or stripped.startswith('#'):
-            continue
-        # Check for YAML key: value pattern (word followed by colon)
-        if re.match(r'^[a-zA-Z_][a-zA-Z0-9_-]*:\s*', stripped):
-            return "yaml"
-        # If first non-comment line doesn't look like YAML, stop checking
-        break
 
-    return "text"
+def detect_syntax_from_content(content: str) -> str:
+    """Detect the lexer for source content when the extension is unknown."""
+    return detect_format(content, markdown=False)
 
 
 def get_terminal_width() -> int:
@@ -110,126 +329,3335 @@ def get_terminal_width() -> int:
     return shutil.get_terminal_size().columns
 
 
-def render_markdown(content: str) -> None:
-    """Render Markdown content using rich."""
-    width = get_terminal_width()
-    console = Console(force_terminal=True, color_system="truecolor", width=width)
-    md = Markdown(content)
-    console.print(md)
+def render_markdown(content: str, file: TextIO | None = None, width: int | None = None,
+                    block_cache_dir: Path | None = None) -> int:
+    """Render Markdown content using rich, writing out top-level blocks as they render.
+
+    The document is split into runs of whole top-level blocks (headings,
+    paragraphs, lists, tables, fences) that are parsed and printed one at a
+    time, so the first screen reaches less long before the rest is laid out.
+    Output matches printing one ``Markdown`` for the whole document, with
+    its SGR sequences minimized.
+
+    With a block_cache_dir, every top-level block is rendered on its own and
+    its output is kept there, so re-rendering an edited document only
+    renders the blocks that changed. The caller bounds its size, as part of
+    the whole cache. Returns the number of bytes of new block entries.
+    """
+    from rich.console import Console
+
+    width = width or get_terminal_width()
+    console = Console(file=file, force_terminal=True, color_system="truecolor", width=width)
+    new_line = None
+    lead_outputs = {}
+    if block_cache_dir is None:
+        for chunk in iter_markdown_chunks(content):
+            output, new_line = render_markdown_run(console, chunk, new_line, lead_outputs)
+            console.file.write(output)
+            console.file.flush()
+        return 0
+
+    identity = [width, SYNTAX_THEME, get_version()]
+    added = 0
+    for block in iter_markdown_chunks(content, per_block=True):
+        cache_path = block_cache_dir / markdown_block_key(block, new_line, identity)
+        entry = read_cache_entry(cache_path)
+        if entry is None:
+            output, after = render_markdown_run(console, block, new_line, lead_outputs)
+            # The entry starts with the spacing state the block leaves behind
+            entry = {None: '-', True: '1', False: '0'}[after] + output
+            write_cache_entry(cache_path, entry)
+            added += len(entry.encode())
+        console.file.write(entry[1:])
+        console.file.flush()
+        new_line = {'-': None, '1': True, '0': False}[entry[0]]
+    return added
+
+
+def render_markdown_run(console, chunk: str, new_line: bool | None,
+                        lead_outputs: dict[str, str]) -> tuple[str, bool | None]:
+    """Render a run of top-level blocks, given the state the previous run left.
+
+    new_line is whether rich would put a blank line before the next block
+    (None at the start of the document). Returns the run's output, through
+    minimize_sgr(), and the state after it.
+    """
+    from rich.markdown import Markdown
+
+    # Whether rich puts a blank line before a block can depend on the block
+    # before it. Lead with a short block that leaves rich in the state the
+    # previous run ended in, then drop what it rendered.
+    lead = '' if new_line is None else MARKDOWN_STATE_BLOCKS[new_line]
+    if lead not in lead_outputs:
+        with console.capture() as capture:
+            console.print(Markdown(lead))
+        lead_outputs[lead] = capture.get()
+    md = Markdown(lead + chunk)
+    with console.capture() as capture:
+        console.print(md)
+    if md.parsed:
+        new_line = ends_with_new_line(md)
+    return minimize_sgr(capture.get()[len(lead_outputs[lead]):]), new_line
+
+
+def markdown_block_key(block: str, new_line: bool | None, identity: list) -> str:
+    """Build the block cache key for a Markdown block rendered after state new_line.
+
+    identity holds what the output also depends on: width, theme and version.
+    """
+    import hashlib
+
+    return hashlib.sha256(json.dumps([block, new_line, *identity]).encode()).hexdigest()
+
+
+def iter_markdown_chunks(content: str, per_block: bool = False) -> Iterator[str]:
+    """Split Markdown into runs of top-level blocks, about a batch of lines each.
+
+    A run may end only before a line that starts a new top-level block for
+    certain: an unindented line after a blank line, outside fenced code and
+    HTML blocks, that is not a list item (which could continue a list).
+    Documents with link reference definitions are not split, since a
+    reference can be used anywhere in the document. With per_block, runs
+    end at every such line.
+    """
+    if MARKDOWN_REFERENCE_RE.search(content):
+        yield content
+        return
+    lines = content.split('\n')
+    start = 0
+    limit = 1 if per_block else STREAM_FIRST_BATCH_LINES
+    closing = None  # What ends the fence or HTML block we are in
+    for i, line in enumerate(lines):
+        if closing is not None:
+            if closing.search(line):
+                closing = None
+            continue
+        if (i - start >= limit and line[:1].strip() and not lines[i - 1].strip()
+                and not MARKDOWN_LIST_ITEM_RE.match(line)):
+            yield '\n'.join(lines[start:i]) + '\n'
+            start = i
+            limit = 1 if per_block else MARKDOWN_BATCH_LINES
+        closing = get_markdown_block_closing(line)
+    yield '\n'.join(lines[start:])
+
+
+def get_markdown_block_closing(line: str) -> 're.Pattern | None':
+    """Return the pattern that closes a fence or HTML block opened by line, if any."""
+    fence = MARKDOWN_FENCE_RE.match(line)
+    if fence:
+        marker = fence.group(1)
+        return re.compile(rf'^ {{0,3}}{re.escape(marker[0])}{{{len(marker)},}}\s*$')
+    for opening, closing in MARKDOWN_HTML_BLOCKS:
+        match = opening.match(line)
+        # The block can end on its opening line
+        if match and not closing.search(line, match.end()):
+            return closing
+    return None
+
+
+def ends_with_new_line(md) -> bool:
+    """Check whether rich puts a blank line after the last block of a Markdown."""
+    from rich.markdown import UnknownElement
+
+    last = md.parsed[-1]
+    token_type = last.type[:-len('_close')] + '_open' if last.nesting == -1 else last.type
+    return (md.elements.get(token_type) or UnknownElement).new_line
 
 
 def get_syntax_width_and_overflow(content: str) -> tuple[int, bool]:
     """Calculate safe syntax render width and whether content exceeds safety cap."""
-    max_line_length = max((len(line) for line in content.splitlines()), default=MIN_SYNTAX_WIDTH)
+    # Only lines wider than the minimum width matter; measure them in place
+    # rather than splitting a possibly huge input into a list of lines
+    max_line_length = max((match.end() - match.start() for match in WIDE_LINE_RE.finditer(content)),
+                          default=MIN_SYNTAX_WIDTH if not content else 0)
     desired_width = max(max_line_length + 1, MIN_SYNTAX_WIDTH)
     width = min(desired_width, MAX_SYNTAX_WIDTH)
     return width, desired_width > MAX_SYNTAX_WIDTH
 
 
-def render_syntax(filepath: str, content: str) -> None:
+def render_syntax(filepath: str, content: str, file: TextIO | None = None,
+                  budget: 'RenderBudget | None' = None) -> None:
     """Render code with syntax highlighting using rich."""
-    # Determine lexer from file extension
-    path = Path(filepath)
-    ext = path.suffix.lstrip('.')
+    # A file that is one over-wide line (a minified bundle, say) is shown raw
+    # without loading Pygments, unless it is minified JSON, which is
+    # pretty-printed. Over-wide lines in longer files are passed through raw
+    # one by one while the rest is highlighted.
+    if content.find('\n') in (-1, len(content) - 1) and get_syntax_width_and_overflow(content)[1]:
+        if is_minified_json(content) and get_lexer_name(filepath, content[:DETECT_WINDOW_CHARS]) == 'json':
+            texts = (content[i:i + RAW_WRITE_CHARS] for i in range(0, len(content), RAW_WRITE_CHARS))
+            render_minified_json(texts, file or sys.stdout, budget or RenderBudget.from_env())
+            return
+        print(content, end='', file=file)
+        return
+
+    lexer_name = get_lexer_name(filepath, content)
+    if lexer_name == "text":
+        render_plain_text(content, file=file)
+        return
+    if lexer_name in TABLE_FORMATS:
+        texts = ((content[i:i + RAW_WRITE_CHARS], False) for i in range(0, len(content), RAW_WRITE_CHARS))
+        render_table(texts, lexer_name, file or sys.stdout, budget or RenderBudget.from_env())
+        return
+
+    stream_syntax(content, lexer_name, file=file, budget=budget)
+
+
+def get_lexer_name(filepath: str, head: str) -> str:
+    """Pick the lexer for a file from its name, or from its start (`head`) if that fails."""
+    with timed_stage('lexer'):
+        lexer_name = find_lexer_for_filename(Path(filepath).name, head)
+    if lexer_name:
+        return lexer_name
+    # No lexer for this name; try content detection
+    with timed_stage('detect'):
+        return detect_syntax_from_content(head)
 
-    # Map non-standard extensions to their lexer names
-    ext_map = {
-        'jsonl': 'json',  # JSON Lines uses JSON syntax
+
+def detect_file(file_arg: str, force_markdown: bool) -> str:
+    """Name the format richless would render a file (or "-" for stdin) as.
+
+    Only the start of the input is read. Returns 'markdown', 'binary',
+    'text' or a Pygments lexer name; for compressed input, the format of
+    what it holds.
+    """
+    filepath = file_arg.strip()
+    if filepath in ('-', '/dev/stdin'):
+        fd = sys.stdin.fileno()
+        head, ended = read_pipe_sample(fd)
+        compression = detect_compression(head)
+        if compression:
+            head, _chunks = read_stream_sample(
+                iter_decompressed(iter_pipe_bytes(head, fd, ended), compression))
+        fmt = detect_format(head)
+    else:
+        with open(filepath, 'rb') as f:
+            head = f.read(DETECT_WINDOW_CHARS)
+            compression = detect_compression(head)
+            if compression:
+                # Detect what is inside, by its name and its start
+                f.seek(0)
+                head, _chunks = read_stream_sample(iter_decompressed(iter_file_bytes(f), compression))
+                filepath = os.path.splitext(filepath)[0]
+        if is_binary(head[:BINARY_SNIFF_BYTES]):
+            return 'binary'
+        fmt = 'markdown' if is_markdown_file(filepath) else get_lexer_name(
+            filepath, head.decode('utf-8', errors='replace'))
+    return 'markdown' if force_markdown and fmt != 'binary' else fmt
+
+
+def render_plain_text(content: str, file: TextIO | None = None) -> None:
+    """Render plain text the way stream_syntax() would, using only the stdlib."""
+    file = file or sys.stdout
+    ends_on_nl = content.endswith('\n')
+    code = normalize_code(content).translate(STRIPPED_CONTROL_CODES)
+    if code.endswith('\n'):
+        code = code[:-1]
+    for batch in iter_line_batches(code.split('\n')):
+        file.write(format_plain_lines(batch))
+        file.flush()
+    if ends_on_nl:
+        file.write('\n')
+        file.flush()
+
+
+def normalize_code(text: str) -> str:
+    """Expand tabs and turn every line ending into \\n, as highlighting does."""
+    return text.expandtabs(TAB_SIZE).replace('\r\n', '\n').replace('\r', '\n')
+
+
+def format_plain_lines(lines: Iterable[str]) -> str:
+    """Format lines of plain text (control codes already stripped) in the text lexer's color."""
+    # A color on blank lines would not show
+    return ''.join(f'{line}\n' if not line or line.isspace() else f'{PLAIN_TEXT_SGR}{line}{SGR_RESET}\n'
+                   for line in lines)
+
+
+_lexer_indexes: dict[str, dict[str, Any]] = {}
+
+
+def get_lexer_index() -> dict[str, Any]:
+    """Return the index of Pygments' lexers by alias and filename.
+
+    There is one index per installed Pygments version. It is built from
+    Pygments' lexer mapping without importing any lexer module and, when
+    caching is on, kept in the cache directory so later runs only load it.
+    """
+    import pygments
+
+    version = pygments.__version__
+    index = _lexer_indexes.get(version)
+    if index is None:
+        cache_dir = get_cache_dir()
+        index_path = cache_dir / 'lexers' / f'{version}.json' if cache_dir else None
+        cached = read_cache_entry(index_path) if index_path else None
+        try:
+            index = json.loads(cached) if cached else None
+        except ValueError:
+            index = None
+        if index is None or index.get('pygments') != version:
+            index = build_lexer_index(version)
+            if index_path:
+                # Indexes of other Pygments versions are never used again
+                if index_path.parent.is_dir():
+                    for old in index_path.parent.glob('*.json'):
+                        _unlink_quietly(str(old))
+                write_cache_entry(index_path, json.dumps(index))
+        _lexer_indexes[version] = index
+    return index
+
+
+def build_lexer_index(version: str) -> dict[str, Any]:
+    """Index Pygments' built-in lexers by alias, exact filename, extension and filename pattern.
+
+    Lexers are recorded by class name, with the module that defines them
+    and the alias richless renders them by. Aliases are lowercase, and an
+    alias claimed by several lexers goes to the first, as in Pygments.
+    """
+    from pygments.lexers._mapping import LEXERS
+
+    lexers: dict[str, list[str]] = {}
+    aliases: dict[str, str] = {}
+    names: dict[str, list[str]] = {}
+    extensions: dict[str, list[str]] = {}
+    patterns: list[list[str]] = []
+    for class_name, (module, _name, class_aliases, filenames, _mimetypes) in LEXERS.items():
+        if not class_aliases:
+            # Nothing to name it by
+            continue
+        lexers[class_name] = [module, class_aliases[0]]
+        for alias in class_aliases:
+            aliases.setdefault(alias.lower(), class_name)
+        for pattern in filenames:
+            if not any(c in pattern for c in '*?['):
+                names.setdefault(pattern, []).append(class_name)
+            elif pattern.startswith('*.') and not any(c in pattern[2:] for c in '*?['):
+                extensions.setdefault(pattern[2:], []).append(class_name)
+            else:
+                patterns.append([pattern, class_name])
+    for ext, alias in LEXER_EXTENSION_OVERRIDES.items():
+        aliases[ext] = aliases[alias]
+    return {
+        'pygments': version,
+        'lexers': lexers,
+        'aliases': aliases,
+        'names': names,
+        'extensions': extensions,
+        'patterns': patterns,
     }
-    if ext in ext_map:
-        ext = ext_map[ext]
 
-    # If no recognizable extension, try to detect from content
-    # Temp files from shell wrapper are named richless.XXXXXX (random suffix)
-    if not ext or (path.stem == 'richless' and re.match(r'^\.[a-zA-Z0-9]{6}$', path.suffix)):
-        ext = detect_syntax_from_content(content)
-    elif ext:
-        # Verify Pygments recognizes this extension; if not, try content detection
+
+def find_lexer_for_filename(filename: str, head: str) -> str | None:
+    """Return the name of the lexer for a file name, or None if no lexer claims it.
+
+    Plain-text extensions are 'text' and table extensions name their
+    table format, without loading the index.
+    Otherwise an exact filename comes first, then the extension as a lexer
+    alias (`.py` is `py`), then Pygments' filename patterns.
+    When several lexers claim a name, the one whose analyse_text() rates
+    `head` highest wins, then the one of highest priority, as in Pygments'
+    guess_lexer_for_filename().
+    """
+    from fnmatch import fnmatchcase
+
+    ext = filename.rpartition('.')[2] if '.' in filename.lstrip('.') else ''
+    if ext.lower() in PLAIN_TEXT_EXTENSIONS:
+        return 'text'
+    if ext.lower() in TABLE_EXTENSIONS:
+        return TABLE_EXTENSIONS[ext.lower()]
+    index = get_lexer_index()
+    candidates = index['names'].get(filename, [])
+    if not candidates:
+        if not ext:
+            return None
+        class_name = index['aliases'].get(ext.lower())
+        if class_name:
+            return index['lexers'][class_name][1]
+        # Longest extension first, so `*.tar.gz` beats `*.gz`
+        parts = filename.split('.')
+        for i in range(1, len(parts)):
+            candidates = index['extensions'].get('.'.join(parts[i:]))
+            if candidates:
+                break
+        else:
+            candidates = [class_name for pattern, class_name in index['patterns']
+                          if fnmatchcase(filename, pattern)]
+    if not candidates:
+        return None
+    if len(candidates) > 1:
+        classes = {name: load_lexer_class(index, name) for name in candidates}
+        candidates = sorted(candidates, key=lambda name: (
+            classes[name].analyse_text(head), classes[name].priority, name))
+    return index['lexers'][candidates[-1]][1]
+
+
+def load_lexer_class(index: dict[str, Any], class_name: str) -> type['Lexer']:
+    """Import a lexer class from the module the index records for it."""
+    from importlib import import_module
+
+    return getattr(import_module(index['lexers'][class_name][0]), class_name)
+
+
+def iter_token_lines(code: str, lexer: 'Lexer') -> Iterator[list[tuple] | str]:
+    """Yield the Pygments tokens of each line in turn.
+
+    A single lexer pass runs over the input, so lexer state (open strings,
+    comments, nesting) carries across lines and batches. Lines of
+    MAX_SYNTAX_WIDTH characters or more are not lexed: they are yielded
+    as plain strings, and lexing starts afresh after them.
+    """
+    start = 0
+    for match in OVERSIZED_LINE_RE.finditer(code):
+        if match.start() > start:
+            yield from iter_lexed_lines(code[start:match.start()], lexer)
+        yield match.group()
+        start = match.end() + 1
+    if start < len(code):
+        yield from iter_lexed_lines(code[start:], lexer)
+
+
+def iter_lexed_lines(code: str, lexer: 'Lexer') -> Iterator[list[tuple]]:
+    """Lex code in one pass and split the tokens into lines."""
+    line = []
+    for token_type, value in lexer.get_tokens(code):
+        while value:
+            part, newline, value = value.partition('\n')
+            if part:
+                line.append((token_type, part))
+            if newline:
+                yield line
+                line = []
+    if line:
+        yield line
+
+
+def iter_line_batches(lines: Iterable, first_size: int = STREAM_FIRST_BATCH_LINES,
+                      size: int = STREAM_BATCH_LINES) -> Iterator[list]:
+    """Group lines into batches: a small first batch, then larger ones."""
+    batch = []
+    limit = first_size
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= limit:
+            yield batch
+            batch = []
+            limit = size
+    if batch:
+        yield batch
+
+
+def stream_syntax(content: str, lexer_name: str, file: TextIO | None = None,
+                  budget: 'RenderBudget | None' = None) -> None:
+    """Highlight content and write it out batch by batch.
+
+    Output matches printing a single ``Syntax`` object (no line numbers,
+    default background), but the first lines reach the pager as soon as they
+    are rendered instead of after the whole file has been laid out.
+
+    The direct ANSI engine is used unless RICHLESS_ENGINE=rich selects the
+    rich rendering pipeline. With the ANSI engine, once the render budget
+    runs out the rest of the content is written raw.
+    """
+    file = file or sys.stdout
+    budget = budget or RenderBudget.from_env()
+    ends_on_nl = content.endswith('\n')
+    code = (content if ends_on_nl else content + '\n').expandtabs(TAB_SIZE)
+    if '\r' in code:
+        # Normalize line endings like Pygments, so that line N of the output
+        # is line N of `code` when switching to raw output
+        code = code.replace('\r\n', '\n').replace('\r', '\n')
+
+    if os.environ.get('RICHLESS_ENGINE') == 'rich':
+        write_token_lines_rich(iter_token_lines(code, get_lexer(lexer_name)), file)
+    else:
+        jsonl = lexer_name == 'json' and is_jsonl(code)
+        workers = get_worker_count()
+        if workers > 1 and len(code) >= PARALLEL_MIN_CHARS:
+            write_lines_parallel(code, lexer_name, jsonl, workers, file, budget)
+        else:
+            write_lines(iter_within_budget(iter_rendered_lines(code, lexer_name, jsonl), code, budget), file)
+        if budget.stopped_at is not None:
+            debug(f'render budget ({budget.stopped_by}) ran out after {budget.stopped_at} of '
+                  f'{len(code)} characters; writing the rest unhighlighted')
+            write_raw(code, budget.stopped_at, file)
+
+    # Syntax renders a trailing newline in the input as a final blank line
+    if ends_on_nl:
+        file.write('\n')
+        file.flush()
+
+
+def get_lexer(lexer_name: str) -> 'Lexer':
+    """Get a lexer configured the way rich's Syntax configures it."""
+    with timed_stage('lexer'):
+        options = {'stripnl': False, 'ensurenl': True, 'tabsize': TAB_SIZE}
+        index = get_lexer_index()
+        class_name = index['aliases'].get(lexer_name.lower())
+        if class_name:
+            return load_lexer_class(index, class_name)(**options)
+
+        # Lexers from Pygments plugins are not in the index
+        from pygments.lexers import get_lexer_by_name, ClassNotFound
+
         try:
-            get_lexer_by_name(ext)
+            return get_lexer_by_name(lexer_name, **options)
         except ClassNotFound:
-            ext = detect_syntax_from_content(content)
+            return load_lexer_class(index, index['aliases']['text'])(**options)
 
-    # Calculate width needed to avoid truncating long lines.
-    # Clamp width to protect against pathological single-line inputs.
-    width, exceeds_width_cap = get_syntax_width_and_overflow(content)
 
-    # If any line exceeds the safe rendering width, fall back to raw output.
-    # This preserves file visibility without unbounded rendering cost.
-    if exceeds_width_cap:
-        print(content, end='')
-        return
+def write_token_lines_rich(token_lines: Iterable[list[tuple] | str], file: TextIO) -> None:
+    """Render tokenized lines through rich's Text and Console, one batch at a time.
 
-    # Create console with width to accommodate longest line
-    console = Console(force_terminal=True, color_system="truecolor", width=width)
+    rich's output is passed through minimize_sgr(). Raw lines from iter_token_lines() are written as they are.
+    """
+    from rich.console import Console
+    from rich.syntax import Syntax
+    from rich.text import Text
 
-    # Create Syntax object - use default background to avoid padding
-    syntax = Syntax(content, ext or "text", theme="monokai", line_numbers=False,
-                    background_color="default")
-    console.print(syntax)
+    theme = Syntax.get_theme(SYNTAX_THEME)
+    get_style = theme.get_style_for_token
+    base_style = theme.get_background_style()
 
+    for batch in iter_line_batches(token_lines):
+        for raw, lines in groupby(batch, key=lambda tokens: isinstance(tokens, str)):
+            if raw:
+                file.write(''.join(line + '\n' for line in lines))
+                continue
+            text = Text(justify="default", style=base_style, tab_size=TAB_SIZE, no_wrap=True)
+            line_length = 0
+            for i, tokens in enumerate(lines):
+                if i:
+                    text.append('\n')
+                start = len(text)
+                text.append_tokens((value, get_style(token_type)) for token_type, value in tokens)
+                line_length = max(line_length, len(text) - start)
+            text.stylize("on default")
+            # Each line fits, so the width only needs to cover these lines
+            width = max(line_length + 1, MIN_SYNTAX_WIDTH)
+            console = Console(force_terminal=True, color_system="truecolor", width=width)
+            with console.capture() as capture:
+                console.print(text)
+            file.write(minimize_sgr(capture.get()))
+        file.flush()
 
-def main():
-    """Main entry point for richless."""
-    parser = argparse.ArgumentParser(
-        description='LESSOPEN filter for Markdown rendering and syntax highlighting',
-        add_help=True,
-    )
 
-    parser.add_argument('file',
-                       help='File to process (use "-" for stdin)')
-    parser.add_argument('--md', '--markdown',
-                       dest='force_markdown',
-                       action='store_true',
-                       help='Force Markdown rendering even for non-.md files')
+def iter_ansi_lines(token_lines: Iterable[list[tuple] | str]) -> Iterator[str]:
+    """Turn tokenized lines into ANSI lines directly.
 
-    args = parser.parse_args()
+    Tokens get the styles rich gives them, written as the shortest SGR
+    change from the previous token's style, so the output is what
+    minimize_sgr() makes of rich's. Skipping rich's Text, Segment and
+    line-cropping objects makes this several times faster. Raw lines from
+    iter_token_lines() are passed through as they are.
+    """
+    sgr = get_token_sgr_table(SYNTAX_THEME)
+    styles = {}
+    transitions = _sgr_transitions
+    strip_controls = STRIPPED_CONTROL_CODES
+    for tokens in token_lines:
+        if isinstance(tokens, str):
+            yield tokens
+            continue
+        parts = []
+        append = parts.append
+        shown = ()
+        for token_type, value in tokens:
+            value = value.translate(strip_controls)
+            if value:
+                style = styles.get(token_type)
+                if style is None:
+                    style = styles[token_type] = get_sgr_style(sgr[token_type])
+                if style is not shown:
+                    change = transitions[shown, style, value.isspace()]
+                    if change:
+                        append(change)
+                        shown = style
+                append(value)
+        if shown:
+            append(SGR_RESET)
+        yield ''.join(parts)
+
+
+def iter_rendered_lines(code: str, lexer_name: str, jsonl: bool) -> Iterator[str]:
+    """Highlight code into ANSI lines with the JSONL scanner or the named lexer."""
+    if jsonl:
+        return iter_jsonl_lines(split_code_lines(code))
+    return iter_ansi_lines(iter_token_lines(code, get_lexer(lexer_name)))
+
+
+def write_lines(lines: Iterable[str], file: TextIO) -> None:
+    """Write rendered lines in batches, flushing after each batch."""
+    for batch in iter_line_batches(lines):
+        batch.append('')
+        file.write('\n'.join(batch))
+        file.flush()
 
-    # Strip whitespace from filename (less adds leading space via LESSOPEN)
-    filepath = args.file.strip()
 
-    # Handle stdin input
-    input_file = filepath
-    temp_file = None
-    content = None
+def get_worker_count() -> int:
+    """Return the number of highlighting processes from RICHLESS_WORKERS."""
+    try:
+        default = len(os.sched_getaffinity(0))
+    except AttributeError:
+        default = os.cpu_count() or 1
+    try:
+        return max(1, int(os.environ.get('RICHLESS_WORKERS', default)))
+    except ValueError:
+        return default
+
+
+def find_chunk_starts(lines: list[str], line_safe: bool) -> list[int]:
+    """Pick the line indexes where parallel chunks start.
+
+    The first chunk is one screen so less can show it right away. Later
+    chunks are about PARALLEL_CHUNK_LINES long and, unless every line is a
+    safe starting point, begin at a line with no indentation that follows a
+    blank line, where most lexers are back in their initial state.
+    """
+    starts = [0]
+    target = STREAM_FIRST_BATCH_LINES
+    while target < len(lines):
+        i = target
+        if not line_safe:
+            while i < len(lines) and not (lines[i][:1].strip() and not lines[i - 1].strip()):
+                i += 1
+            if i == len(lines):
+                break
+        starts.append(i)
+        target = i + PARALLEL_CHUNK_LINES
+    return starts
+
+
+def highlight_chunk(chunk: str, peek: str, lexer_name: str,
+                    jsonl: bool) -> tuple[str, list[str], list[str]]:
+    """Highlight one chunk of lines in a worker process.
+
+    Returns the rendered chunk, its first PARALLEL_RESYNC_LINES lines, and
+    the rendering of `peek` (the start of the next chunk) as lexed following
+    this chunk.
+    """
+    lines = list(iter_rendered_lines(chunk + peek, lexer_name, jsonl))
+    end = chunk.count('\n')
+    return '\n'.join(lines[:end]) + '\n', lines[:PARALLEL_RESYNC_LINES], lines[end:]
+
+
+def write_lines_parallel(code: str, lexer_name: str, jsonl: bool, workers: int,
+                         file: TextIO, budget: 'RenderBudget') -> None:
+    """Highlight code in chunks across worker processes, writing chunks in order.
+
+    Chunks are lexed independently, each from the lexer's initial state. A
+    chunk is accepted when its first lines render the same as they do lexed
+    on from the previous chunk. If they differ, the chunk started inside a
+    multi-line construct, and the rest of the input is lexed serially from
+    the previous chunk instead.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    lines = split_code_lines(code)
+    starts = find_chunk_starts(lines, jsonl or lexer_name in LINE_SAFE_LEXERS)
+    starts.append(len(lines))
+
+    def submit(i):
+        start, end = starts[i], starts[i + 1]
+        chunk = '\n'.join(lines[start:end]) + '\n'
+        # The JSONL scanner keeps no state between lines, so there is nothing to check
+        peek_end = start if jsonl else min(end + PARALLEL_RESYNC_LINES, starts[-1])
+        peek = ''.join(line + '\n' for line in lines[end:peek_end])
+        return pool.submit(highlight_chunk, chunk, peek, lexer_name, jsonl)
+
+    output_fd = get_output_fd(file)
+    with ProcessPoolExecutor(workers, mp_context=get_pool_context()) as pool:
+        try:
+            # Keep a bounded number of chunks in flight so output held in memory
+            # stays proportional to the worker count, not to the file
+            chunk_count = len(starts) - 1
+            pending = deque(submit(i) for i in range(min(chunk_count, workers * 2)))
+            expected_head = []
+            # Offsets in `code` of the previous and the current chunk
+            previous_offset = offset = 0
+            for i in range(chunk_count):
+                if budget.exhausted(offset):
+                    pool.shutdown(cancel_futures=True)
+                    return
+                rendered, head, tail = wait_for_result(pending.popleft(), output_fd)
+                if head[:len(expected_head)] != expected_head:
+                    pool.shutdown(cancel_futures=True)
+                    rest = iter_rendered_lines(code[previous_offset:], lexer_name, jsonl)
+                    rest = islice(rest, starts[i] - starts[i - 1], None)
+                    write_lines(iter_within_budget(rest, code, budget, offset), file)
+                    return
+                file.write(rendered)
+                file.flush()
+                expected_head = tail
+                previous_offset = offset
+                offset += sum(map(len, lines[starts[i]:starts[i + 1]])) + starts[i + 1] - starts[i]
+                if i + len(pending) + 1 < chunk_count:
+                    pending.append(submit(i + len(pending) + 1))
+        except BaseException:
+            # The output was closed (less quit) or richless was interrupted:
+            # do not wait for the chunks still being highlighted
+            abandon_pool(pool)
+            raise
+
 
+def get_pool_context() -> Any:
+    """Pick how highlighting worker processes are started."""
+    import multiprocessing
+    import threading
+
+    # Forking copies the already imported lexers into the workers, but is only
+    # safe while this process has a single thread (not in the render server)
+    if sys.platform == 'linux':
+        return multiprocessing.get_context('fork' if threading.active_count() == 1 else 'forkserver')
+    return None
+
+
+def get_output_fd(file: TextIO) -> int | None:
+    """Return the file descriptor behind an output file, or None if it has none."""
     try:
-        if filepath == '-' or filepath == '/dev/stdin':
-            # Read from stdin
-            content = sys.stdin.read()
-            input_file = 'stdin.md' if args.force_markdown else 'stdin.txt'
+        return file.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def is_output_closed(fd: int | None) -> bool:
+    """Whether the reader of a pipe or socket has closed its end (less quit)."""
+    import select
+
+    if fd is None or not hasattr(select, 'poll'):
+        return False
+    poller = select.poll()
+    # Errors and hang-ups are reported whatever events are asked for
+    poller.register(fd, 0)
+    return any(event & (select.POLLERR | select.POLLHUP) for _fd, event in poller.poll(0))
+
+
+def closed_output_error() -> BrokenPipeError:
+    return BrokenPipeError(errno.EPIPE, os.strerror(errno.EPIPE))
+
+
+def wait_for_result(future: Any, output_fd: int | None) -> Any:
+    """Wait for a worker's result, raising BrokenPipeError if the output closes first."""
+    from concurrent.futures import TimeoutError as FutureTimeout
+
+    while True:
+        try:
+            return future.result(timeout=OUTPUT_POLL_SECONDS)
+        except FutureTimeout:
+            if is_output_closed(output_fd):
+                raise closed_output_error() from None
+
+
+def abandon_pool(pool: Any) -> None:
+    """Cancel a process pool's queued work and stop the work it is running."""
+    if hasattr(pool, 'terminate_workers'):
+        # Python 3.14+
+        pool.terminate_workers()
+        return
+    # Before 3.14 there is no public way to stop running work. Once its
+    # workers are gone, the pool finds itself broken and shuts down at once.
+    for process in list((getattr(pool, '_processes', None) or {}).values()):
+        process.terminate()
+    pool.shutdown(cancel_futures=True)
+
+
+class RenderBudget:
+    """How long and how much to highlight before writing the rest raw.
+
+    Limits come from RICHLESS_BUDGET_SECONDS and RICHLESS_BUDGET_MB; zero
+    or less means no limit. Once exhausted() returns True, `stopped_at` is
+    the offset where highlighting stopped and `stopped_by` says which limit
+    ran out ('time' or 'size').
+    """
+
+    def __init__(self, seconds: float = 0, max_chars: int = 0):
+        self.deadline = time.monotonic() + seconds if seconds > 0 else None
+        self.max_chars = max_chars if max_chars > 0 else None
+        self.stopped_at = None
+        self.stopped_by = None
+
+    @classmethod
+    def from_env(cls) -> 'RenderBudget':
+        """Build a budget that starts now, from the environment."""
+        try:
+            seconds = float(os.environ.get('RICHLESS_BUDGET_SECONDS', DEFAULT_BUDGET_SECONDS))
+        except ValueError:
+            seconds = DEFAULT_BUDGET_SECONDS
+        try:
+            max_chars = int(float(os.environ.get('RICHLESS_BUDGET_MB', 0)) * 1024 * 1024)
+        except ValueError:
+            max_chars = 0
+        return cls(seconds, max_chars)
+
+    def exhausted(self, offset: int) -> bool:
+        """Check whether highlighting may go on past `offset` characters of input."""
+        if self.max_chars is not None and offset >= self.max_chars:
+            self.stopped_by = 'size'
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            self.stopped_by = 'time'
+        else:
+            return False
+        self.stopped_at = offset
+        return True
+
+    def exclude(self, seconds: float) -> None:
+        """Leave out time not spent rendering, such as waiting for input."""
+        if self.deadline is not None:
+            self.deadline += seconds
+
+
+def iter_uncharged(chunks: Iterable[Any], budget: RenderBudget) -> Iterator[Any]:
+    """Yield from chunks, leaving the time taken to get each one out of the render budget.
+
+    That is time spent reading, waiting for a producer or decompressing.
+    """
+    chunks = iter(chunks)
+    while True:
+        start = time.monotonic()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        budget.exclude(time.monotonic() - start)
+        yield chunk
+
+
+def iter_within_budget(lines: Iterable[str], code: str, budget: RenderBudget,
+                       offset: int = 0) -> Iterator[str]:
+    """Yield the rendered lines of `code`, starting at `offset`, until the budget runs out."""
+    for line in lines:
+        if budget.exhausted(offset):
+            return
+        offset = code.index('\n', offset) + 1
+        yield line
+
+
+def write_raw(code: str, offset: int, file: TextIO) -> None:
+    """Write `code` from `offset` on unhighlighted, in slices."""
+    for start in range(offset, len(code), RAW_WRITE_CHARS):
+        file.write(code[start:start + RAW_WRITE_CHARS])
+        file.flush()
+
+
+def split_code_lines(code: str) -> list[str]:
+    """Split newline-terminated code into lines, normalizing line endings like Pygments."""
+    return code.replace('\r\n', '\n').replace('\r', '\n').split('\n')[:-1]
+
+
+def is_jsonl(code: str) -> bool:
+    """Check whether JSON content has one complete document on its first line."""
+    for line in code.split('\n', 20)[:20]:
+        line = line.strip()
+        if line:
+            return (line[0] == '{' and line[-1] == '}') or (line[0] == '[' and line[-1] == ']')
+    return False
+
+
+# JSON Lines values, classified the way Pygments' JsonLexer classifies them.
+# Keys are strings followed by a colon. Anything between values must be
+# punctuation or whitespace; any other character matches `bad`, which makes
+# the line fall back to plain text. Numbers and constants must end where
+# JsonLexer's would, and a string directly followed by another string is not
+# valid JSON. Raw control characters are not allowed inside strings.
+JSONL_STRING = r'"(?:[^"\\\x00-\x1f]|\\u[0-9a-fA-F]{4}|\\[^u])*"'
+JSONL_VALUE_RE = re.compile(rf"""
+    (?P<key>{JSONL_STRING})(?=[ \t]*:)
+  | (?P<string>{JSONL_STRING})(?![ \t]*")
+  | (?P<float>-?(?:0|[1-9][0-9]*)(?:\.[0-9]+(?:[eE][-+]?[0-9]+)?|[eE][-+]?[0-9]+))(?![-+.eE0-9])
+  | (?P<integer>-?(?:0|[1-9][0-9]*))(?![-+.eE0-9])
+  | (?P<constant>true|false|null)(?![truefalsn])
+  | (?P<bad>[^ \t:,\[\]{{}}])
+""", re.VERBOSE)
+
+
+class JSONLScanError(ValueError):
+    """A JSON Lines line could not be scanned."""
+
+
+def get_jsonl_sgr(theme: str) -> dict[str, str]:
+    """Return the SGR sequence for each JSONL_VALUE_RE group, plus punctuation."""
+    from pygments.token import Keyword, Name, Number, Punctuation, String
+
+    sgr = get_token_sgr_table(theme)
+    return {
+        'key': sgr[Name.Tag],
+        'string': sgr[String.Double],
+        'float': sgr[Number.Float],
+        'integer': sgr[Number.Integer],
+        'constant': sgr[Keyword.Constant],
+        'punctuation': sgr[Punctuation],
+    }
+
+
+def iter_jsonl_lines(lines: Iterable[str]) -> Iterator[str]:
+    """Highlight JSON Lines one line at a time, with no state between lines.
+
+    Keys, strings, numbers and constants get the same colors as with the
+    JSON lexer. Punctuation and whitespace between them share one color
+    span instead of one span per token, left only for the shortest SGR
+    change to each value's color and back, so the output is visually the same
+    while the scan is a single regex pass per line, several times faster
+    than the lexer. A line that does not scan is passed through as plain
+    text.
+    """
+    sgr = get_jsonl_sgr(SYNTAX_THEME)
+    base = sgr.pop('punctuation')
+    # Change from the surrounding punctuation style to the value's and back
+    base_style = get_sgr_style(base)
+    base = _sgr_transitions[(), base_style, False]
+    wrap = {}
+    for kind, code in sgr.items():
+        style = get_sgr_style(code)
+        wrap[kind] = (_sgr_transitions[base_style, style, False],
+                      _sgr_transitions[style, base_style, False])
+    # A line that starts with a value can skip the punctuation color if the
+    # change to the value's color is the same from the default style (true
+    # unless punctuation has attributes that values lack)
+    value_first = all(before == _sgr_transitions[(), get_sgr_style(sgr[kind]), False]
+                      for kind, (before, _after) in wrap.items())
+    afters = {after for _before, after in wrap.values() if after}
+
+    def colorize(match):
+        kind = match.lastgroup
+        if kind == 'bad':
+            raise JSONLScanError(match.start())
+        before, after = wrap[kind]
+        return f'{before}{match.group()}{after}'
+
+    sub = JSONL_VALUE_RE.sub
+    for line in lines:
+        if '\t' in line:
+            line = line.replace('\t', ' ' * TAB_SIZE)
+        # Indentation (in pretty-printed JSON) needs no color
+        body = line.lstrip(' ')
+        if not body:
+            yield line
+            continue
+        indent = line[:len(line) - len(body)]
+        try:
+            rendered = sub(colorize, body)
+        except JSONLScanError:
+            yield line.translate(STRIPPED_CONTROL_CODES)
+            continue
+        if body[0] in '{}[],:' or not value_first:
+            rendered = base + rendered
+        if body[-1] not in '{}[],: ':
+            # Nothing follows the last value to need the punctuation color back
+            for after in afters:
+                if rendered.endswith(after):
+                    rendered = rendered[:-len(after)]
+                    break
+        yield f'{indent}{rendered}{SGR_RESET}'
+
+
+# Minified JSON (a first line too wide to highlight) is pretty-printed
+# before highlighting, JSON_INDENT per level. The tokenizer works through
+# the text a chunk at a time; an unterminated string runs to the end of the
+# chunk, so any token that reaches the end may continue in the next one.
+JSON_INDENT = '  '
+JSON_TOKEN_RE = re.compile(r"""
+    [ \t\r\n]*(?:
+      (?P<open>[{\[])
+    | (?P<close>[}\]])
+    | (?P<comma>,)
+    | (?P<colon>:)
+    | (?P<string>"[^"\\]*(?:\\.[^"\\]*)*(?:"|\\?))
+    | (?P<scalar>[^ \t\r\n{}\[\],:"]+)
+    )""", re.VERBOSE)
+
+
+def is_minified_json(head: str) -> bool:
+    """Check whether JSON starting with `head` opens with a line too wide to highlight as it is.
+
+    A wide first line followed by more records within `head` is JSON
+    Lines, not one minified document.
+    """
+    first_line, _newline, rest = head.partition('\n')
+    return (len(first_line) > MAX_SYNTAX_WIDTH and first_line.lstrip()[:1] in ('{', '[')
+            and not rest.strip())
+
+
+def iter_first_line(texts: Iterable[tuple[str, bool]], rest: list) -> Iterator[str]:
+    """Yield the first line of (text, paused) chunks, putting the chunk that follows its newline in `rest`."""
+    for text, paused in texts:
+        end = text.find('\n')
+        if end == -1:
+            yield text
+            continue
+        yield text[:end]
+        rest.append((text[end + 1:], paused))
+        return
+
+
+def iter_json_tokens(texts: Iterable[str]) -> Iterator[tuple[str, str]]:
+    """Split JSON text, arriving in pieces, into (kind, token) pairs without parsing it.
+
+    Whitespace between tokens is dropped. Anything that is not JSON
+    punctuation or a string comes out as a 'scalar', so invalid input still
+    tokenizes. Memory use is bounded by the longest token, not the document.
+    """
+    pieces = []
+    size = 0
+    # A token cut by the end of a piece is scanned again with more text; with
+    # a long token (a huge string), wait until the text has doubled first
+    rescan_size = 0
+    for text in chain(texts, [None]):
+        final = text is None
+        if not final:
+            pieces.append(text)
+            size += len(text)
+            if size < rescan_size:
+                continue
+        buf = ''.join(pieces)
+        pos = 0
+        for match in JSON_TOKEN_RE.finditer(buf):
+            if not final and match.end() == len(buf):
+                break
+            pos = match.end()
+            kind = match.lastgroup
+            yield kind, match.group(kind)
+        rest = buf[pos:]
+        pieces = [rest]
+        size = len(rest)
+        rescan_size = 2 * size
+
+
+def iter_pretty_json_lines(tokens: Iterable[tuple[str, str]]) -> Iterator[str]:
+    """Lay JSON tokens out one value or member per line, as json.dumps(indent=...) does.
+
+    Empty objects and arrays stay on one line. Values that follow one
+    another without a comma (JSON Lines records, say) start new lines.
+    """
+    depth = 0
+    parts = []
+    opened = False
+    previous = None
+    for kind, token in tokens:
+        if opened:
+            opened = False
+            if kind == 'close':
+                # An empty object or array
+                parts.append(token)
+                previous = kind
+                continue
+            yield JSON_INDENT * depth + ''.join(parts)
+            parts = []
+            depth += 1
+        if kind == 'comma':
+            parts.append(token)
+            yield JSON_INDENT * depth + ''.join(parts)
+            parts = []
+        elif kind == 'colon':
+            parts.append(': ')
+        elif kind == 'close':
+            if parts:
+                yield JSON_INDENT * depth + ''.join(parts)
+            depth = max(depth - 1, 0)
+            parts = [token]
+        else:
+            if parts and previous in ('string', 'scalar', 'close'):
+                yield JSON_INDENT * depth + ''.join(parts)
+                parts = []
+            parts.append(token)
+            opened = kind == 'open'
+        previous = kind
+    if parts:
+        yield JSON_INDENT * depth + ''.join(parts)
+
+
+def render_minified_json(texts: Iterable[str], file: TextIO, budget: 'RenderBudget') -> None:
+    """Pretty-print minified JSON as it is read and highlight the lines with the JSONL scanner.
+
+    Nothing is parsed into objects, so a document of any size starts
+    paging at once. Once the render budget runs out, the rest is still
+    pretty-printed, but not highlighted.
+    """
+    lines = iter_pretty_json_lines(iter_json_tokens(texts))
+    offset = 0
+    rest = []
+
+    def iter_budgeted_lines():
+        nonlocal offset
+        for line in lines:
+            if budget.exhausted(offset):
+                rest.append(line)
+                return
+            offset += len(line) + 1
+            yield line
+
+    write_lines(iter_jsonl_lines(iter_budgeted_lines()), file)
+    if rest:
+        debug(f'render budget ({budget.stopped_by}) ran out after {offset} characters of '
+              'pretty-printed JSON; writing the rest unhighlighted')
+        write_lines(chain(rest, lines), file)
+
+
+# Tables are laid out with TABLE_COLUMN_GAP spaces between columns. Column
+# widths are set from the header and the first TABLE_SAMPLE_ROWS rows, and a
+# wider cell later on widens its column from its row on. A cell wider than
+# TABLE_MAX_CELL_WIDTH terminal columns is cut short, ending in
+# TABLE_ELLIPSIS, so no line is too wide to show.
+TABLE_SAMPLE_ROWS = 1000
+TABLE_MAX_CELL_WIDTH = 80
+TABLE_ELLIPSIS = '…'
+TABLE_COLUMN_GAP = 2
+# Pygments token types whose theme colors the columns take in turn; header
+# cells are bold, and Zeek's unset and empty fields take the comment color
+TABLE_COLUMN_TOKENS = ('Keyword', 'Name.Function', 'Literal.String', 'Literal.Number', 'Name.Tag',
+                       'Name.Variable')
+# Control characters in cells are shown escaped, the way Zeek escapes them
+TABLE_CELL_ESCAPES = {code: f'\\x{code:02x}' for code in [*range(32), 127]}
+ZEEK_ESCAPE_RE = re.compile(r'\\x([0-9a-fA-F]{2})')
+
+
+def get_cell_width(text: str) -> int:
+    """Return how many terminal columns text takes (wide East Asian characters take two)."""
+    if text.isascii():
+        return len(text)
+    import unicodedata
+
+    return sum(0 if unicodedata.combining(char) else 2 if unicodedata.east_asian_width(char) in 'WF' else 1
+               for char in text)
+
+
+def fit_cell(text: str) -> tuple[str, int]:
+    """Escape control characters in a table cell and cut it to TABLE_MAX_CELL_WIDTH columns.
+
+    Returns the text to show and its width in terminal columns.
+    """
+    if not text.isprintable():
+        text = text.translate(TABLE_CELL_ESCAPES)
+    width = get_cell_width(text)
+    if width <= TABLE_MAX_CELL_WIDTH:
+        return text, width
+    if text.isascii():
+        return text[:TABLE_MAX_CELL_WIDTH - 1] + TABLE_ELLIPSIS, TABLE_MAX_CELL_WIDTH
+    width = 0
+    for end, char in enumerate(text):
+        char_width = get_cell_width(char)
+        if width + char_width > TABLE_MAX_CELL_WIDTH - 1:
+            break
+        width += char_width
+    return text[:end] + TABLE_ELLIPSIS, width + 1
+
+
+class TableLayout:
+    """Column widths and colors of a table being rendered, and the rows waiting for widths.
+
+    Rows are held until TABLE_SAMPLE_ROWS have arrived, a Zeek header starts
+    another table or the input pauses, then laid out by the widths of the
+    rows held. Every row becomes one line, and so does every comment
+    (Zeek's # lines other than the field names and types) and every raw
+    line (of a CSV record that does not parse).
+    """
+
+    def __init__(self):
+        from pygments.token import Comment, string_to_tokentype
+
+        sgr = get_token_sgr_table(SYNTAX_THEME)
+        styles = [get_sgr_style(sgr[string_to_tokentype(name)]) for name in TABLE_COLUMN_TOKENS]
+        # Cells are painted in palette styles, by index: the column colors,
+        # the same in bold for headers, the comment color, then the default
+        palette = [*styles, *(apply_sgr(style, '1') for style in styles), get_sgr_style(sgr[Comment]), ()]
+        self.colors = len(styles)
+        self.comment = len(palette) - 2
+        self.default = len(palette) - 1
+        # The SGR to go from one palette style to another
+        self.moves = [[_sgr_transitions[old, new, False] for new in palette] for old in palette]
+        # Palette index of each column, by kind of row
+        self.column_styles = {'header': [], 'types': [], 'row': []}
+        # Set by Zeek's header lines
+        self.separator = '\t'
+        self.dim_values = set()
+        # Whether a CSV or TSV has had its first row, the header
+        self.has_header = False
+        self.widths = None
+        self.held = []
+
+    def add(self, kind: str, cells: list[str] | str) -> list[str]:
+        """Add a 'header', 'types' or 'row' of cells, or a 'comment' or 'raw' line. Returns the lines now laid out."""
+        lines = []
+        if kind == 'header' and (self.widths is not None or self.held):
+            # A new table, with widths of its own
+            lines = self.flush()
+            self.widths = None
+        if kind in ('comment', 'raw'):
+            widths = None
+        elif (max(map(len, cells)) <= TABLE_MAX_CELL_WIDTH and (joined := ''.join(cells)).isascii()
+              and joined.isprintable()):
+            widths = list(map(len, cells))
         else:
-            # Read from file
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            input_file = filepath
+            cells, widths = map(list, zip(*map(fit_cell, cells)))
+        if self.widths is not None:
+            lines.append(self.format(kind, cells, widths))
+            return lines
+        self.held.append((kind, cells, widths))
+        if len(self.held) >= TABLE_SAMPLE_ROWS:
+            lines += self.flush()
+        return lines
+
+    def flush(self) -> list[str]:
+        """Lay out the rows held, setting the column widths from them if they are not set yet."""
+        if self.widths is None:
+            self.widths = []
+        held, self.held = self.held, []
+        for _kind, _cells, widths in held:
+            if widths:
+                self.fit_columns(widths)
+        return [self.format(kind, cells, widths) for kind, cells, widths in held]
+
+    def fit_columns(self, widths: list[int]) -> None:
+        """Widen the columns to fit cells of these widths."""
+        columns = self.widths
+        if len(widths) > len(columns):
+            columns.extend(widths[len(columns):])
+        columns[:len(widths)] = map(max, columns, widths)
 
-        # Determine if we should render as markdown
-        is_markdown = args.force_markdown or is_markdown_file(input_file)
+    def format(self, kind: str, cells: list[str] | str, widths: list[int] | None) -> str:
+        """Format a row of fitted cells, or a comment or raw line, with the current column widths."""
+        if kind == 'raw':
+            return cells
+        moves = self.moves
+        if kind == 'comment':
+            return f'{moves[self.default][self.comment]}{cells}{SGR_RESET}' if cells else ''
+        self.fit_columns(widths)
+        pads = [' ' * (column - width + TABLE_COLUMN_GAP) for column, width in zip(self.widths, widths)]
+        pads[-1] = ''
+        styles = self.column_styles[kind]
+        if len(styles) < len(cells):
+            styles.extend(self.comment if kind == 'types' else i % self.colors + (kind == 'header') * self.colors
+                          for i in range(len(styles), len(cells)))
+        dim = self.dim_values
+        comment = self.comment
+        out = []
+        append = out.append
+        shown = self.default
+        for text, pad, style in zip(cells, pads, styles):
+            if not text:
+                append(pad)
+                continue
+            if text in dim:
+                style = comment
+            if style != shown:
+                append(f'{moves[shown][style]}{text}{pad}')
+                shown = style
+            else:
+                append(f'{text}{pad}')
+        if shown != self.default:
+            append(SGR_RESET)
+        return ''.join(out)
 
-        if is_markdown:
-            render_markdown(content)
+
+def iter_table_rows(lines: Iterable[str], fmt: str, layout: TableLayout) -> Iterator[tuple[str, list[str] | str]]:
+    """Split lines of a Zeek log, CSV or TSV into (kind, cells) pairs for TableLayout.add().
+
+    Lines keep their line endings, and a CSV record quoted across lines
+    must come whole. A CSV record that does not parse (a field over the csv
+    module's size limit, say) comes out as 'raw' lines. The first row of a
+    CSV or TSV is its header. Zeek's header lines set the separator and the
+    unset and empty field markers.
+    """
+    if fmt == 'csv':
+        rows = iter_csv_records(lines)
+    else:
+        rows = (line.rstrip('\r\n') for line in lines)
+    for row in rows:
+        if isinstance(row, tuple):
+            for line in row:
+                yield 'raw', line.rstrip('\r\n')
+            continue
+        if not row:
+            yield 'comment', ''
+        elif fmt == 'zeek' and row[0] == '#':
+            if row.startswith('#separator '):
+                layout.separator = ZEEK_ESCAPE_RE.sub(lambda match: chr(int(match.group(1), 16)),
+                                                      row[len('#separator '):])
+                yield 'comment', row
+                continue
+            name, _, value = row.partition(layout.separator)
+            if name == '#fields':
+                yield 'header', value.split(layout.separator)
+            elif name == '#types':
+                yield 'types', value.split(layout.separator)
+            else:
+                if name in ('#unset_field', '#empty_field'):
+                    layout.dim_values.add(value)
+                yield 'comment', row.replace(layout.separator, ' ').translate(TABLE_CELL_ESCAPES)
         else:
-            # Syntax highlighting for code files
-            render_syntax(input_file, content)
+            if fmt != 'csv':
+                row = row.split(layout.separator)
+            if fmt != 'zeek' and not layout.has_header:
+                layout.has_header = True
+                yield 'header', row
+            else:
+                yield 'row', row
 
-        return 0
 
-    except FileNotFoundError:
-        print(f"richless: File not found: {args.file}", file=sys.stderr)
-        return 1
-    except Exception as e:
-        print(f"richless: Error: {e}", file=sys.stderr)
-        # Fall back to plain output
+def iter_csv_records(lines: Iterable[str]) -> Iterator[list[str] | tuple[str, ...]]:
+    """Parse lines of a CSV into rows, yielding the lines of a record that fails to parse as a tuple instead."""
+    import csv
+
+    lines = iter(lines)
+    consumed = []
+
+    def feed():
+        for line in lines:
+            consumed.append(line)
+            yield line
+
+    reader = csv.reader(feed())
+    while True:
+        consumed.clear()
         try:
-            if content:
-                print(content, end='')
-            elif filepath not in ['-', '/dev/stdin']:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    print(f.read(), end='')
-            return 0
-        except Exception:
-            return 1
+            yield next(reader)
+        except StopIteration:
+            return
+        except csv.Error:
+            # The reader starts afresh after an error; skip it past the rest
+            # of the record, to the line that balances its quotes
+            while sum(line.count('"') for line in consumed) % 2:
+                line = next(lines, None)
+                if line is None:
+                    break
+                consumed.append(line)
+            yield tuple(consumed)
+
+
+def render_table(texts: Iterable[tuple[str, bool]], fmt: str, file: TextIO, budget: 'RenderBudget') -> None:
+    """Render a Zeek TSV log ('zeek'), CSV or TSV as aligned, colored columns while it is read.
+
+    `texts` yields (text, paused) pairs as render_stream() gets them;
+    whatever has arrived is written when the input pauses. Memory is
+    bounded by the sample of rows held for the column widths. Once the
+    render budget runs out, the rest is written as it is.
+    """
+    layout = TableLayout()
+    offset = 0
+    # CSV lines of a quoted record that has not ended yet
+    carried = []
+    for piece, peek in iter_pipe_pieces(texts, True):
+        if budget.stopped_at is None and budget.exhausted(offset):
+            debug(f'render budget ({budget.stopped_by}) ran out after {offset} characters '
+                  'of table; writing the rest unhighlighted')
+            write_lines(layout.flush(), file)
+            file.write(''.join(carried))
+            carried = []
+        if budget.stopped_at is not None:
+            file.write(piece)
+            file.flush()
+            continue
+        offset += len(piece)
+        lines = piece.splitlines(keepends=True)
+        if fmt == 'csv':
+            lines = carried + lines
+            # A record ends on a line that leaves its quotes balanced
+            quotes = 0
+            end = 0
+            for i, line in enumerate(lines):
+                quotes += line.count('"')
+                if not quotes % 2:
+                    end = i + 1
+            lines, carried = lines[:end], lines[end:]
+        rendered = []
+        add = layout.add
+        for kind, cells in iter_table_rows(lines, fmt, layout):
+            rendered += add(kind, cells)
+        if not peek:
+            # The input paused (or ended): show what has arrived
+            rendered += layout.flush()
+        if rendered:
+            write_lines(rendered, file)
+    if carried:
+        # An unterminated quote at the end of a CSV
+        write_lines(chain(layout.flush(), (line.rstrip('\r\n') for line in carried)), file)
+
+
+class TokenSGRTable(dict):
+    """SGR sequence for each Pygments token type in a theme.
+
+    Entries are computed on first use with the same rules rich's
+    PygmentsSyntaxTheme uses: token color (black when unset), bold, italic
+    and underline, on the terminal's default background.
+    """
+
+    def __init__(self, style):
+        super().__init__()
+        self.style = style
+
+    def __missing__(self, token_type) -> str:
+        try:
+            token_style = self.style.style_for_token(token_type)
+        except KeyError:
+            # rich gives unknown token types a null style
+            sgr = '\x1b[49m'
+        else:
+            codes = []
+            if token_style['bold']:
+                codes.append('1')
+            if token_style['italic']:
+                codes.append('3')
+            if token_style['underline']:
+                codes.append('4')
+            color = token_style['color'] or '000000'
+            red, green, blue = (int(color[i:i + 2], 16) for i in (0, 2, 4))
+            codes.append(f'38;2;{red};{green};{blue}')
+            codes.append('49')
+            sgr = f'\x1b[{";".join(codes)}m'
+        self[token_type] = sgr
+        return sgr
+
+
+_token_sgr_tables: dict[str, TokenSGRTable] = {}
+
+
+def get_token_sgr_table(theme: str) -> TokenSGRTable:
+    """Return the (shared) token-to-SGR table for a Pygments theme."""
+    table = _token_sgr_tables.get(theme)
+    if table is None:
+        from pygments.styles import get_style_by_name
+        table = _token_sgr_tables[theme] = TokenSGRTable(get_style_by_name(theme))
+    return table
+
+
+# SGR attributes, by the code that sets them, and the code that clears each.
+# Colors are kept whole ('38;2;r;g;b', '31', ...) under 'fg' and 'bg'.
+SGR_ATTRIBUTE_OFF = {
+    '1': '22', '2': '22', '3': '23', '4': '24', '21': '24', '5': '25', '6': '25',
+    '7': '27', '8': '28', '9': '29', '51': '54', '52': '54', '53': '55', 'fg': '39', 'bg': '49',
+}
+# Attributes that show on blank text; a change of anything else (such as the
+# foreground color) is invisible on spaces and need not be written
+SGR_BLANK_VISIBLE = {'bg', '4', '21', '7', '9', '51', '52', '53'}
+# Matches SGR sequences, the other escape sequences rich writes (OSC 8
+# hyperlinks, other CSI sequences), newlines, and runs of text between them
+ANSI_TOKEN_RE = re.compile(
+    r'\x1b\[([0-9;]*)m|(\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b\[[0-9;?]*[A-Za-ln-z]|\x1b)|(\n)|([^\x1b\n]+)')
+
+SGRStyle = tuple[tuple[str, str], ...]
+
+
+def apply_sgr(style: SGRStyle, params: str) -> SGRStyle:
+    """Return the style in effect after an SGR sequence with these parameters."""
+    attrs = dict(style)
+    codes = params.split(';')
+    i = 0
+    while i < len(codes):
+        code = codes[i]
+        i += 1
+        if code in ('', '0'):
+            attrs.clear()
+        elif code in ('38', '48'):
+            # Extended colors: 38;5;n or 38;2;r;g;b
+            length = 2 if codes[i:i + 1] == ['5'] else 4
+            attrs['fg' if code == '38' else 'bg'] = ';'.join(codes[i - 1:i + length])
+            i += length
+        elif code in ('39', '49'):
+            attrs.pop('fg' if code == '39' else 'bg', None)
+        elif code in ('22', '23', '24', '25', '27', '28', '29', '54', '55'):
+            for attr, off in SGR_ATTRIBUTE_OFF.items():
+                if off == code:
+                    attrs.pop(attr, None)
+        elif len(code) == 2 and code[0] in '39' and code[1] in '01234567':
+            attrs['fg'] = code
+        elif (len(code) == 2 and code[0] == '4' or len(code) == 3 and code[:2] == '10') and code[-1] in '01234567':
+            attrs['bg'] = code
+        else:
+            attrs[code] = code
+    return tuple(sorted(attrs.items()))
+
+
+def sgr_codes(style: SGRStyle) -> list[str]:
+    """List the codes that set a style from the default, attributes before colors."""
+    attrs = dict(style)
+    colors = [attrs.pop(attr) for attr in ('fg', 'bg') if attr in attrs]
+    return sorted(attrs.values(), key=lambda code: (len(code), code)) + colors
+
+
+class SGRTransitions(dict):
+    """Shortest SGR sequence from one style to another, by (old, new, blank).
+
+    The sequence either changes just the attributes that differ or resets
+    and sets the new style, whichever is shorter. For blank text (spaces)
+    only attributes that show on blanks count, so a foreground-only change
+    ahead of spaces writes nothing. Entries are computed on first use.
+    """
+
+    def __missing__(self, key: tuple[SGRStyle, SGRStyle, bool]) -> str:
+        old, new, blank = key
+        if blank:
+            visible_old = [item for item in old if item[0] in SGR_BLANK_VISIBLE]
+            visible_new = [item for item in new if item[0] in SGR_BLANK_VISIBLE]
+            if visible_old == visible_new:
+                self[key] = ''
+                return ''
+        if old == new:
+            sgr = ''
+        elif not new:
+            sgr = SGR_RESET
+        else:
+            old_attrs, new_attrs = dict(old), dict(new)
+            changes = []
+            for attr in old_attrs:
+                if attr not in new_attrs and SGR_ATTRIBUTE_OFF.get(attr) not in changes:
+                    changes.append(SGR_ATTRIBUTE_OFF.get(attr, '0'))
+            if '0' in changes:
+                # An attribute with no code to clear it alone
+                changes = ['0'] + sgr_codes(new)
+            else:
+                cleared = set(changes)
+                changes += sgr_codes(tuple(
+                    (attr, value) for attr, value in new
+                    if old_attrs.get(attr) != value or SGR_ATTRIBUTE_OFF.get(attr) in cleared))
+            full = ['0'] + sgr_codes(new)
+            if len(';'.join(full)) <= len(';'.join(changes)):
+                changes = full
+            sgr = f'\x1b[{";".join(changes)}m'
+        self[key] = sgr
+        return sgr
+
+
+_sgr_transitions = SGRTransitions()
+_sgr_styles: dict[str, SGRStyle] = {}
+# Style after an SGR sequence, by (style before, parameters)
+_sgr_applied: dict[tuple[SGRStyle, str], SGRStyle] = {}
+
+
+def get_sgr_style(sgr: str) -> SGRStyle:
+    """Return the style an SGR sequence sets, starting from the default style."""
+    style = _sgr_styles.get(sgr)
+    if style is None:
+        style = _sgr_styles[sgr] = apply_sgr((), sgr[2:-1])
+    return style
+
+
+def minimize_sgr(text: str) -> str:
+    """Rewrite ANSI text with the fewest SGR bytes that paint the same screen.
+
+    Styles are tracked as the text is read, and a change is written only
+    just before text that shows it, as the shortest transition from the
+    style already in effect. Each line ends in the default style, so less
+    can show any line on its own. Other escape sequences (hyperlinks) are
+    kept as they are.
+    """
+    transitions = _sgr_transitions
+    applied = _sgr_applied
+    out = []
+    append = out.append
+    shown = wanted = ()
+    for params, escape, newline, run in ANSI_TOKEN_RE.findall(text):
+        if run:
+            if wanted != shown:
+                sgr = transitions[shown, wanted, run.isspace()]
+                if sgr:
+                    append(sgr)
+                    shown = wanted
+            append(run)
+        elif escape:
+            append(escape)
+        elif newline:
+            if shown:
+                append(SGR_RESET)
+                shown = ()
+            wanted = ()
+            append('\n')
+        else:
+            key = (wanted, params)
+            style = applied.get(key)
+            if style is None:
+                style = applied[key] = apply_sgr(wanted, params)
+            wanted = style
+    if shown:
+        append(SGR_RESET)
+    return ''.join(out)
+
+
+def get_version() -> str:
+    """Return the installed richless version."""
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        return version("richless")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def get_cache_dir() -> Path | None:
+    """Return the rendered-output cache directory, or None if caching is off."""
+    if os.environ.get('RICHLESS_CACHE', '') in ('', '0'):
+        return None
+    cache_dir = os.environ.get('RICHLESS_CACHE_DIR')
+    if cache_dir:
+        return Path(cache_dir)
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'richless'
+
+
+def get_cache_max_bytes() -> int:
+    """Return the cache size bound from RICHLESS_CACHE_MAX_MB."""
+    try:
+        return int(float(os.environ.get('RICHLESS_CACHE_MAX_MB', DEFAULT_CACHE_MAX_MB)) * 1024 * 1024)
+    except ValueError:
+        return DEFAULT_CACHE_MAX_MB * 1024 * 1024
+
+
+def cache_key(filepath: str, is_markdown: bool, width: int) -> str:
+    """Build the cache key for a file's rendered output.
+
+    The key changes whenever the file (path, mtime, size), the terminal
+    width, the theme, the render mode or the richless version changes.
+    """
+    import hashlib
+
+    st = os.stat(filepath)
+    identity = [
+        os.path.abspath(filepath),
+        st.st_mtime_ns,
+        st.st_size,
+        width,
+        SYNTAX_THEME,
+        'markdown' if is_markdown else 'syntax',
+        get_version(),
+    ]
+    return hashlib.sha256(json.dumps(identity).encode()).hexdigest()
+
+
+def copy_cached_output(cache_path: Path, out: TextIO | None = None) -> bool:
+    """Copy a cached render to stdout in one bulk copy. Returns False on a miss."""
+    out = out or sys.stdout
+    try:
+        cached = open(cache_path, 'rb')
+    except OSError:
+        return False
+    with cached:
+        # Mark as recently used for LRU eviction
+        try:
+            os.utime(cached.fileno())
+        except OSError:
+            pass
+        if isinstance(out, GutterWriter):
+            # Every line needs its marker, so the output goes through write()
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            for data in iter(lambda: cached.read(RAW_WRITE_CHARS), b''):
+                out.write(decoder.decode(data))
+            out.write(decoder.decode(b'', final=True))
+            return True
+        out.flush()
+        out_fd = out.fileno()
+        size = os.fstat(cached.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                sent = os.sendfile(out_fd, cached.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError:
+            # sendfile needs a socket destination on some platforms
+            if offset:
+                raise
+            shutil.copyfileobj(cached, out.buffer, 1024 * 1024)
+    return True
+
+
+def evict_cache(cache_dir: Path, max_bytes: int) -> int:
+    """Delete least recently used entries until the cache fits in max_bytes. Returns the size left.
+
+    The bound covers the whole tree: whole renders, and the Markdown block,
+    git diff and lexer index entries in its subdirectories.
+    """
+    entries = []
+    total = 0
+    now = time.time()
+    for dirpath, _dirnames, filenames in os.walk(cache_dir):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            if name.startswith('.tmp-'):
+                if now - st.st_mtime > STALE_CACHE_TEMP_SECONDS:
+                    _unlink_quietly(path)
+                continue
+            if name == CACHE_SIZE_FILE:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    entries.sort()
+    for _mtime, size, path in entries:
+        if total <= max_bytes:
+            break
+        _unlink_quietly(path)
+        total -= size
+    return total
+
+
+def add_cache_size(cache_dir: Path, added: int, max_bytes: int) -> None:
+    """Count `added` bytes of new entries toward the cache's size, evicting entries once it is over max_bytes.
+
+    The running total is kept in CACHE_SIZE_FILE. Writers racing each
+    other can lose an update, so the total is an estimate, made exact again
+    by each eviction.
+    """
+    size_path = cache_dir / CACHE_SIZE_FILE
+    try:
+        total = int(size_path.read_text()) + added
+    except (OSError, ValueError):
+        # No total yet: count the entries there are
+        total = None
+    if total is None or total > max_bytes:
+        total = evict_cache(cache_dir, max_bytes)
+    write_cache_entry(size_path, str(total))
+
+
+def read_cache_entry(cache_path: Path) -> str | None:
+    """Read a small cache entry, marking it as recently used. Returns None on a miss."""
+    try:
+        with open(cache_path, encoding='utf-8', newline='') as f:
+            os.utime(f.fileno())
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def write_cache_entry(cache_path: Path, data: str) -> None:
+    """Write a small cache entry through a temp file, so readers never see part of it.
+
+    Failing to store an entry only costs a re-render later, so errors are ignored.
+    """
+    import tempfile
+
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=cache_path.parent)
+    except OSError:
+        return
+    try:
+        with open(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(data)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        _unlink_quietly(temp_path)
+
+
+def _unlink_quietly(path: str) -> None:
+    """Remove a file that another richless process may already have removed."""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class CacheWriter:
+    """Pass output through to a stream while saving a copy into the cache.
+
+    The copy is written to a temp file in the cache directory and renamed
+    into place by commit(), so concurrent readers never see a partial entry.
+    Output larger than the cache bound is not cached.
+    """
+
+    def __init__(self, cache_path: Path, out: TextIO, max_bytes: int):
+        import tempfile
+
+        self.cache_path = cache_path
+        self.out = out
+        self.max_bytes = max_bytes
+        self.written = 0
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(prefix='.tmp-', dir=cache_path.parent)
+        self.temp = open(fd, 'w', encoding='utf-8', newline='')
+
+    def write(self, data: str) -> int:
+        self.out.write(data)
+        if self.temp is not None:
+            self.written += len(data)
+            if self.written > self.max_bytes:
+                self.discard()
+            else:
+                self.temp.write(data)
+        return len(data)
+
+    def flush(self) -> None:
+        self.out.flush()
+
+    def isatty(self) -> bool:
+        return False
+
+    def commit(self, other_bytes: int = 0) -> None:
+        """Move the finished render into the cache and enforce the size bound.
+
+        `other_bytes` counts other entries the render added, such as
+        Markdown blocks, which stay even if the render was too large to keep.
+        """
+        added = other_bytes
+        if self.temp is not None:
+            self.temp.close()
+            self.temp = None
+            os.replace(self.temp_path, self.cache_path)
+            added += os.path.getsize(self.cache_path)
+        if added:
+            add_cache_size(self.cache_path.parent, added, self.max_bytes)
+
+    def discard(self) -> None:
+        """Drop the partial copy, e.g. after a render error."""
+        if self.temp is None:
+            return
+        self.temp.close()
+        self.temp = None
+        _unlink_quietly(self.temp_path)
+
+
+def render_file(filepath: str, force_markdown: bool, file: TextIO, width: int,
+                git_gutter: bool | None = None) -> None:
+    """Render a file to `file`, going through the rendered-output cache when enabled.
+
+    With git_gutter (default: RICHLESS_GIT_GUTTER), highlighted source gets
+    git change markers in front of its lines. They are not part of what is
+    cached, since they change with the index.
+    """
+    is_markdown = force_markdown or is_markdown_file(filepath)
+    if git_gutter is None:
+        git_gutter = is_git_gutter_enabled()
+    if git_gutter and not is_markdown and not detect_file_compression(filepath) and can_mark_lines(filepath):
+        file = GutterWriter(file, GitGutter(filepath))
+
+    # Serve unchanged files straight from the cache
+    cache_path = None
+    cache_dir = get_cache_dir()
+    if cache_dir is not None:
+        with timed_stage('cache'):
+            cache_path = cache_dir / cache_key(filepath, is_markdown, width)
+            if copy_cached_output(cache_path, file):
+                return
+
+    budget = RenderBudget.from_env()
+    with timed_stage('read'):
+        compression = detect_file_compression(filepath)
+        content = read_text_file(filepath) if is_markdown and not compression else None
+    if is_markdown and content is None and not compression:
+        # Binary or not UTF-8: no output, so less shows the file itself
+        return
+
+    out = CacheWriter(cache_path, file, get_cache_max_bytes()) if cache_path else file
+    block_bytes = 0
+    try:
+        with timed_stage('render'):
+            if compression:
+                render_compressed(filepath, compression, force_markdown, out, width, budget)
+            elif is_markdown:
+                # An edited document misses the cache above, but most of its
+                # blocks are unchanged
+                block_bytes = render_markdown(content, file=out, width=width,
+                                              block_cache_dir=cache_dir / 'blocks' if cache_dir else None)
+            else:
+                # Syntax highlighting for code files
+                render_text_file(filepath, out, width, budget)
+    except BaseException:
+        if isinstance(out, CacheWriter):
+            out.discard()
+        raise
+    if isinstance(out, CacheWriter):
+        # A render cut short by the budget depends on machine load and
+        # settings, so it is not worth keeping
+        if budget.stopped_at is None:
+            out.commit(block_bytes)
+        else:
+            out.discard()
+
+
+def render_text_file(filepath: str, file: TextIO, width: int | None = None,
+                     budget: 'RenderBudget | None' = None) -> None:
+    """Render a source or text file a piece at a time, as piped input is.
+
+    Memory is bounded by the piece size, not by the file size. The leading
+    bytes are sniffed first, so a binary file (or one that does not start
+    as UTF-8) gets no output, and less shows the file itself. Invalid UTF-8
+    further on is shown as replacement characters.
+    """
+    with open(filepath, 'rb') as f:
+        with timed_stage('read'):
+            sample, chunks = read_stream_sample(iter_file_bytes(f))
+        if is_binary(sample[:BINARY_SNIFF_BYTES]):
+            return
+        size = os.fstat(f.fileno()).st_size
+        head = sample[:DETECT_WINDOW_CHARS].decode('utf-8', errors='replace')
+        # A file that is one over-wide line (a minified bundle, say) is shown
+        # raw without loading Pygments, unless it is minified JSON, which is
+        # pretty-printed. Over-wide lines in other files are passed through
+        # raw one by one while the rest is highlighted.
+        newline = sample.find(b'\n')
+        if newline == -1:
+            newline = find_newline(f.fileno(), len(sample))
+        one_line = newline in (-1, size - 1)
+        if one_line and get_syntax_width_and_overflow(head)[1] and not (
+                is_minified_json(head) and get_lexer_name(filepath, head) == 'json'):
+            for text, _paused in iter_stream_text(chunks):
+                file.write(text)
+            file.flush()
+            return
+        fmt = get_lexer_name(filepath, head)
+        workers = get_worker_count() if size >= PARALLEL_MIN_CHARS else 1
+        render_stream(sample, chunks, fmt, filepath, file, width, budget, workers)
+
+
+def find_newline(fd: int, offset: int) -> int:
+    """Return the offset of the first newline in a file at or after `offset`, or -1 if there is none.
+
+    The file is read a block at a time without moving its position.
+    """
+    while data := os.pread(fd, PIPE_READ_BYTES, offset):
+        found = data.find(b'\n')
+        if found != -1:
+            return offset + found
+        offset += len(data)
+    return -1
+
+
+def detect_file_compression(filepath: str) -> str | None:
+    """Return the compression format of a file from its magic bytes, if any."""
+    with open(filepath, 'rb') as f:
+        return detect_compression(f.read(16))
+
+
+def print_plain(filepath: str, file: TextIO | None = None) -> None:
+    """Print a file unformatted, as a fallback when rendering fails."""
+    content = read_text_file(filepath)
+    if content is not None:
+        print(content, end='', file=file)
+
+
+def read_text_file(filepath: str) -> str | None:
+    """Read a UTF-8 file through a memory map. Returns None for binary or non-UTF-8 files.
+
+    The leading bytes are sniffed first, so a large binary file is rejected
+    after one page instead of after reading it all. Text is decoded straight
+    from the mapping, without first copying the file into a bytes object.
+    """
+    import mmap
+
+    with open(filepath, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Empty files, pipes and special files cannot be mapped
+            data = f.read()
+        try:
+            if is_binary(data[:BINARY_SNIFF_BYTES]):
+                return None
+            return str(data, 'utf-8')
+        except UnicodeDecodeError:
+            return None
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+def is_binary(head: bytes) -> bool:
+    """Check the leading bytes of a file for NUL bytes, invalid UTF-8 or a binary format signature."""
+    if b'\0' in head:
+        return True
+    for _name, signature in MAGIC_SIGNATURES:
+        if signature.match(head):
+            return True
+    try:
+        # Incremental, so a character cut off at the end of `head` is not an error
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def render_pipe(fd: int, force_markdown: bool, file: TextIO) -> None:
+    """Render piped input (richless -) as it arrives, without a temp file.
+
+    The format is decided once, from a bounded sample at the start of the
+    pipe (after decompressing it, for gzip, bzip2 or xz input). Binary
+    input is copied through for less to show natively, and source and
+    plain text are highlighted piece by piece, so unbounded producers such
+    as ``tail -f`` are shown as they write. Markdown is read to the end
+    first, since link references can be defined anywhere.
+    """
+    with timed_stage('read'):
+        sample, ended = read_pipe_sample(fd)
+    chunks = iter_pipe_bytes(sample, fd, ended, get_output_fd(file))
+    compression = detect_compression(sample)
+    if compression:
+        with timed_stage('read'):
+            sample, chunks = read_stream_sample(iter_decompressed(chunks, compression))
+    with timed_stage('detect'):
+        fmt = detect_format(sample)
+    if fmt == 'binary':
+        copy_raw(chunks, file)
+        return
+    render_stream(sample, chunks, 'markdown' if force_markdown else fmt, 'stdin.txt', file)
+
+
+def render_compressed(filepath: str, compression: str, force_markdown: bool, file: TextIO,
+                      width: int | None = None, budget: 'RenderBudget | None' = None) -> None:
+    """Render a gzip, bzip2 or xz file while decompressing it.
+
+    The format comes from the name inside (`data.json.xz` is JSON,
+    `conn.log.gz` goes to content detection) and the start of the
+    decompressed data. Source and text are highlighted a piece at a time,
+    so memory is bounded by the piece size, not by the decompressed size.
+    A compressed binary (such as a tarball) gets no output, so less shows
+    the file itself.
+    """
+    inner = os.path.splitext(filepath)[0]
+    with open(filepath, 'rb') as f:
+        with timed_stage('read'):
+            sample, chunks = read_stream_sample(iter_decompressed(iter_file_bytes(f), compression))
+        if is_binary(sample[:BINARY_SNIFF_BYTES]):
+            return
+        if force_markdown or is_markdown_file(inner):
+            fmt = 'markdown'
+        else:
+            fmt = get_lexer_name(inner, sample[:DETECT_WINDOW_CHARS].decode('utf-8', errors='replace'))
+        render_stream(sample, chunks, fmt, inner, file, width, budget)
+
+
+def render_stream(sample: bytes, chunks: Iterable[tuple[bytes, bool]], fmt: str, name: str,
+                  file: TextIO, width: int | None = None,
+                  budget: 'RenderBudget | None' = None, workers: int = 1) -> None:
+    """Render streamed text in the format detected from its first bytes (`sample`).
+
+    `chunks` yields (data, paused) pairs, starting with the sample, where
+    paused says no more input is ready yet. `name` is the file name the
+    rich engine picks a lexer by, once it has read the whole input. Only
+    rendering counts against the time budget, not waiting for input. With
+    more than one worker, source is highlighted across processes.
+    """
+    budget = budget or RenderBudget.from_env()
+    texts = iter_stream_text(iter_uncharged(chunks, budget))
+    if fmt == 'markdown' or os.environ.get('RICHLESS_ENGINE') == 'rich':
+        with timed_stage('read'):
+            content = ''.join(text for text, _paused in texts)
+        if fmt == 'markdown':
+            render_markdown(content, file=file, width=width)
+        else:
+            render_syntax(name, content, file=file, budget=budget)
+        return
+    if fmt in TABLE_FORMATS:
+        render_table(texts, fmt, file, budget)
+        return
+    head = sample[:DETECT_WINDOW_CHARS].decode('utf-8', errors='replace')
+    jsonl = fmt == 'json' and is_jsonl(head)
+    if fmt == 'json' and is_minified_json(head):
+        # The first line may go on past the sample: anything after it is
+        # taken as JSON Lines
+        rest = []
+        render_minified_json(iter_first_line(texts, rest), file, budget)
+        blank = []
+        for text, paused in chain(rest, texts):
+            blank.append((text, paused))
+            if text.strip():
+                break
+        else:
+            return
+        texts = chain(blank, texts)
+        jsonl = True
+    pieces = iter_pipe_pieces(texts, jsonl or fmt in LINE_SAFE_LEXERS or fmt == 'text')
+    if fmt == 'text':
+        for piece, _peek in pieces:
+            file.write(format_plain_lines(
+                normalize_code(piece).translate(STRIPPED_CONTROL_CODES)[:-1].split('\n')))
+            file.flush()
+    else:
+        write_pipe_pieces(pieces, fmt, jsonl, file, budget, workers)
+
+
+def read_pipe_sample(fd: int) -> tuple[bytes, bool]:
+    """Read the start of piped input to decide its format.
+
+    Stops at PIPE_SNIFF_BYTES, at the end of input, or when the producer
+    pauses after writing something. Returns the bytes and whether input ended.
+    """
+    import select
+
+    sample = b''
+    while len(sample) < PIPE_SNIFF_BYTES:
+        if sample and not select.select([fd], [], [], PIPE_SNIFF_WAIT)[0]:
+            return sample, False
+        data = os.read(fd, PIPE_SNIFF_BYTES - len(sample))
+        if not data:
+            return sample, True
+        sample += data
+    return sample, False
+
+
+def read_stream_sample(chunks: Iterator[tuple[bytes, bool]]) -> tuple[bytes, Iterator[tuple[bytes, bool]]]:
+    """Collect the start of a stream of (data, paused) chunks, as read_pipe_sample() does for a pipe.
+
+    Returns the sample and the chunks again, starting with the sample.
+    """
+    sample = b''
+    for data, paused in chunks:
+        sample += data
+        if len(sample) >= PIPE_SNIFF_BYTES or (paused and sample):
+            return sample, chain([(sample, paused)], chunks)
+    return sample, iter([(sample, False)])
+
+
+def iter_pipe_bytes(sample: bytes, fd: int, ended: bool,
+                    output_fd: int | None = None) -> Iterator[tuple[bytes, bool]]:
+    """Yield the sample and then the rest of the pipe as it arrives.
+
+    Yields (data, paused) pairs, where paused says no more input is ready yet.
+    With an output_fd, waiting for input stops with BrokenPipeError when
+    that output is closed, so a quiet producer (``tail -f``) does not keep
+    richless running after less quits.
+    """
+    import select
+
+    data = sample
+    while True:
+        paused = not ended and not select.select([fd], [], [], 0)[0]
+        yield data, paused
+        if ended:
+            return
+        with timed_stage('read'):
+            if paused:
+                wait_for_input(fd, output_fd)
+            data = os.read(fd, PIPE_READ_BYTES)
+        ended = not data
+
+
+def wait_for_input(fd: int, output_fd: int | None) -> None:
+    """Block until fd has input (or ends), raising BrokenPipeError if output_fd closes first."""
+    import select
+
+    if output_fd is None or not hasattr(select, 'poll'):
+        return
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    # Errors and hang-ups are reported whatever events are asked for
+    poller.register(output_fd, 0)
+    while True:
+        events = dict(poller.poll())
+        if events.get(output_fd, 0) & (select.POLLERR | select.POLLHUP):
+            raise closed_output_error()
+        if fd in events:
+            return
+
+
+def iter_file_bytes(f: BinaryIO) -> Iterator[tuple[bytes, bool]]:
+    """Yield a file's bytes as (data, paused) chunks, never paused."""
+    while data := f.read(PIPE_READ_BYTES):
+        yield data, False
+
+
+def iter_stream_text(chunks: Iterable[tuple[bytes, bool]]) -> Iterator[tuple[str, bool]]:
+    """Decode (data, paused) chunks as UTF-8.
+
+    Invalid UTF-8 is replaced, since the sample the format was chosen from
+    has already been checked and earlier output may already be in less.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for data, paused in chunks:
+        yield decoder.decode(data), paused
+    yield decoder.decode(b'', final=True), False
+
+
+def iter_pipe_pieces(chunks: Iterable[tuple[str, bool]], line_safe: bool) -> Iterator[tuple[str, str]]:
+    """Group piped text into pieces of whole lines, each with a peek at the lines after it.
+
+    Once a batch of lines has arrived, a piece ends where lexing is likely
+    to start afresh (see find_chunk_starts()), with the next few lines as
+    its peek. Whatever has arrived is also emitted, without a peek, when the
+    producer pauses. The last piece ends with an empty line if the input
+    ended with a newline, as Syntax renders a final blank line for it.
+    """
+    pending = []
+    partial = ''
+    limit = STREAM_FIRST_BATCH_LINES
+    for text, paused in chunks:
+        lines = (partial + text).split('\n')
+        partial = lines.pop()
+        pending.extend(lines)
+        while len(pending) >= limit + PARALLEL_RESYNC_LINES:
+            end = len(pending) - PARALLEL_RESYNC_LINES
+            cut = limit
+            if not line_safe:
+                while cut < end and not (pending[cut][:1].strip() and not pending[cut - 1].strip()):
+                    cut += 1
+                if cut == end and len(pending) < limit * 2:
+                    # No likely starting point yet; wait for more lines
+                    break
+            yield (''.join(line + '\n' for line in pending[:cut]),
+                   ''.join(line + '\n' for line in pending[cut:cut + PARALLEL_RESYNC_LINES]))
+            del pending[:cut]
+            limit = STREAM_BATCH_LINES
+        if paused and pending:
+            yield ''.join(line + '\n' for line in pending), ''
+            pending = []
+    pending.append(partial)
+    yield ''.join(line + '\n' for line in pending), ''
+
+
+def write_pipe_pieces(pieces: Iterable[tuple[str, str]], lexer_name: str, jsonl: bool,
+                      file: TextIO, budget: 'RenderBudget', workers: int = 1) -> None:
+    """Highlight pieces of piped input in order, writing each as it is done.
+
+    Each piece is lexed from the lexer's initial state. As in
+    write_lines_parallel(), a piece is accepted when its first lines render
+    the same as they did lexed on from the piece before. Otherwise, or when
+    that could not be checked, it is lexed again following the text before
+    it (see PIPE_RELEX_MAX_CHARS). Pieces of JSONL and line-safe formats
+    need no checking. With more than one worker, pieces are lexed ahead in
+    worker processes, and only lexed again here. Once the render budget
+    runs out, pieces are written raw.
+    """
+    line_safe = jsonl or lexer_name in LINE_SAFE_LEXERS
+    pieces = ((normalize_code(piece), '' if line_safe else normalize_code(peek)) for piece, peek in pieces)
+    pieces = split_at_size_budget(pieces, budget)
+    if workers == 1:
+        write_lexed_pieces(((piece, peek, None) for piece, peek in pieces), lexer_name, jsonl, file, budget)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(workers, mp_context=get_pool_context()) as pool:
+        try:
+            write_lexed_pieces(iter_lexed_ahead(pieces, pool, workers * 2, lexer_name, jsonl, budget),
+                               lexer_name, jsonl, file, budget)
+        except BaseException:
+            # The output was closed (less quit) or richless was interrupted:
+            # do not wait for the pieces still being highlighted
+            abandon_pool(pool)
+            raise
+
+
+def split_at_size_budget(pieces: Iterable[tuple[str, str]], budget: 'RenderBudget') -> Iterator[tuple[str, str]]:
+    """Split the piece the size budget runs out in after the last line that starts within the budget."""
+    offset = 0
+    for piece, peek in pieces:
+        if budget.max_chars is not None and offset < budget.max_chars < offset + len(piece):
+            cut = piece.find('\n', budget.max_chars - offset - 1) + 1
+            if 0 < cut < len(piece):
+                yield piece[:cut], ''
+                piece = piece[cut:]
+                offset += cut
+        yield piece, peek
+        offset += len(piece)
+
+
+def iter_lexed_ahead(pieces: Iterable[tuple[str, str]], pool: Any, ahead: int, lexer_name: str,
+                     jsonl: bool, budget: 'RenderBudget') -> Iterator[tuple[str, str, Any]]:
+    """Have a process pool lex up to `ahead` pieces ahead of the one being written.
+
+    Yields (piece, peek, future), where the future holds highlight_chunk()
+    of the piece, or is None once the render budget has run out.
+    """
+    pending = deque()
+    for piece, peek in pieces:
+        future = None
+        if budget.stopped_at is None:
+            future = pool.submit(highlight_chunk, piece, peek, lexer_name, jsonl)
+        pending.append((piece, peek, future))
+        if len(pending) >= ahead:
+            yield pending.popleft()
+    yield from pending
+
+
+def write_lexed_pieces(pieces: Iterable[tuple[str, str, Any]], lexer_name: str, jsonl: bool,
+                       file: TextIO, budget: 'RenderBudget') -> None:
+    """Write (piece, peek, future) pieces for write_pipe_pieces(), lexing them here when the future is None."""
+    line_safe = jsonl or lexer_name in LINE_SAFE_LEXERS
+    output_fd = get_output_fd(file)
+
+    def lex(piece, peek, future):
+        if future is not None:
+            return wait_for_result(future, output_fd)
+        return highlight_chunk(piece, peek, lexer_name, jsonl)
+
+    # The text since the last likely lexing start, and how much may still
+    # be lexed again
+    context = ''
+    relex_allowance = PIPE_RELEX_MAX_CHARS
+    expected_head = []
+    offset = 0
+    for piece, peek, future in pieces:
+        if budget.stopped_at is None and budget.exhausted(offset):
+            debug(f'render budget ({budget.stopped_by}) ran out after {offset} characters '
+                  'of piped input; writing the rest unhighlighted')
+        if budget.stopped_at is not None:
+            if future is not None:
+                future.cancel()
+            file.write(piece)
+            file.flush()
+            continue
+        offset += len(piece)
+        if line_safe:
+            file.write(lex(piece, peek, future)[0])
+            file.flush()
+            continue
+        relex_allowance += len(piece) * PIPE_RELEX_FACTOR
+        accepted = False
+        if expected_head is not None:
+            rendered, head, tail = lex(piece, peek, future)
+            accepted = head[:len(expected_head)] == expected_head
+        if not accepted:
+            if context and len(context) <= relex_allowance:
+                if future is not None:
+                    future.cancel()
+                relex_allowance -= len(context)
+                rendered, _head, tail = highlight_chunk(context + piece, peek, lexer_name, jsonl)
+                rendered = rendered.split('\n', context.count('\n'))[-1]
+            elif expected_head is None:
+                rendered, _head, tail = lex(piece, peek, future)
+        file.write(rendered)
+        file.flush()
+        # Without a peek there is nothing to check the next piece against
+        expected_head = tail if peek else None
+
+        text = context + piece
+        # A lexing start in the piece may follow a blank last line of the context
+        search_from = max(0, text.rfind('\n', 0, len(context) - 1)) if context else 0
+        start = 0
+        for match in PIPE_LEXING_START_RE.finditer(text, search_from):
+            start = match.end()
+        if start:
+            # Lexing may only start afresh there if its first lines render
+            # as they were written
+            line = piece.count('\n', 0, start - len(context))
+            head = highlight_chunk(''.join(text[start:].splitlines(True)[:PARALLEL_RESYNC_LINES]), '',
+                                   lexer_name, jsonl)[1]
+            if head != rendered.split('\n')[line:line + len(head)]:
+                start = 0
+        context = text[start:]
+        if len(context) > PIPE_RELEX_MAX_CHARS:
+            context = ''
+
+
+def detect_compression(head: bytes) -> str | None:
+    """Return the compression format ('gzip', 'bzip2' or 'xz') of data starting with `head`, if any."""
+    for name, signature in MAGIC_SIGNATURES:
+        if name in COMPRESSED_FORMATS and signature.match(head):
+            return name
+    return None
+
+
+def new_decompressor(compression: str) -> Any:
+    """Create a stdlib decompressor object for one gzip, bzip2 or xz stream."""
+    if compression == 'gzip':
+        import zlib
+        return zlib.decompressobj(zlib.MAX_WBITS | 16)
+    if compression == 'bzip2':
+        import bz2
+        return bz2.BZ2Decompressor()
+    import lzma
+    return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+
+
+def iter_decompressed(chunks: Iterable[tuple[bytes, bool]], compression: str) -> Iterator[tuple[bytes, bool]]:
+    """Decompress (data, paused) chunks incrementally, PIPE_READ_BYTES of output at a time.
+
+    Output is limited per step, so a chunk that expands a thousandfold
+    still yields bounded pieces. Concatenated streams (as from
+    ``cat a.gz b.gz``) are decompressed one after the other.
+    """
+    decompressor = new_decompressor(compression)
+    for data, paused in chunks:
+        while True:
+            with timed_stage('read'):
+                out = decompressor.decompress(data, PIPE_READ_BYTES)
+            if compression == 'gzip':
+                # zlib hands back input it has not used yet; output may
+                # also be left if this step filled up
+                data = decompressor.unconsumed_tail
+                more = bool(data) or len(out) == PIPE_READ_BYTES
+            else:
+                data = b''
+                more = not decompressor.needs_input
+            if decompressor.eof:
+                data = decompressor.unused_data
+                more = bool(data)
+                if more:
+                    decompressor = new_decompressor(compression)
+            yield out, paused and not more
+            if not more:
+                break
+
+
+def copy_raw(chunks: Iterable[tuple[bytes, bool]], file: TextIO) -> None:
+    """Copy (data, paused) chunks through unchanged."""
+    file.flush()
+    out_fd = file.fileno()
+    for data, _paused in chunks:
+        while data:
+            data = data[os.write(out_fd, data):]
+
+
+def get_server_socket_path() -> Path:
+    """Return the Unix socket path of the render server."""
+    path = os.environ.get('RICHLESS_SOCKET')
+    if path:
+        return Path(path)
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return Path(runtime_dir) / 'richless.sock'
+    import tempfile
+
+    return Path(tempfile.gettempdir()) / f'richless-{os.getuid()}' / 'server.sock'
+
+
+def is_server_enabled() -> bool:
+    return os.environ.get('RICHLESS_SERVER', '') not in ('', '0')
+
+
+def check_socket_dir(socket_path: Path) -> str | None:
+    """Return why the directory of the server socket cannot be trusted, or None if it can.
+
+    It must be a real directory (not a symlink) owned by us with mode 0700,
+    so no other user can put a socket of their own in its place.
+    """
+    try:
+        st = os.lstat(socket_path.parent)
+    except OSError as e:
+        return f'{socket_path.parent}: {e.strerror}'
+    if not stat.S_ISDIR(st.st_mode):
+        return f'{socket_path.parent} is not a directory'
+    if st.st_uid != os.getuid():
+        return f'{socket_path.parent} is owned by another user'
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        return f'{socket_path.parent} must have mode 0700, not {stat.S_IMODE(st.st_mode):04o}'
+    return None
+
+
+def get_peer_uid(sock: 'socket.socket') -> int | None:
+    """Return the user id of the process at the other end of a Unix socket, or None if unknown."""
+    import socket
+    import struct
+
+    if not hasattr(socket, 'SO_PEERCRED'):
+        # Not Linux: the socket directory check has to do
+        return None
+    # struct ucred: pid, uid, gid
+    _pid, uid, _gid = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                                           struct.calcsize('3i')))
+    return uid
+
+
+def render_via_server(filepath: str, force_markdown: bool) -> int | None:
+    """Have a running render server render filepath to stdout.
+
+    Only tried with RICHLESS_SERVER set. Returns the exit code, or None if
+    no trusted server is available, in which case the caller renders
+    in-process.
+    """
+    if not is_server_enabled():
+        return None
+    import socket
+
+    socket_path = get_server_socket_path()
+    if not socket_path.exists():
+        return None
+    problem = check_socket_dir(socket_path)
+    if problem:
+        debug(f'Not using the render server: {problem}')
+        return None
+    request = {
+        'path': os.path.abspath(filepath),
+        'markdown': force_markdown,
+        'width': get_terminal_width(),
+        'git_gutter': is_git_gutter_enabled(),
+    }
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(SERVER_CONNECT_TIMEOUT)
+        sock.connect(str(socket_path))
+        peer_uid = get_peer_uid(sock)
+        if peer_uid not in (None, os.getuid()):
+            debug(f'Not using the render server: {socket_path} belongs to user {peer_uid}')
+            sock.close()
+            return None
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        reply = sock.makefile('rb')
+        header = json.loads(reply.readline())
+    except (OSError, ValueError):
+        return None
+
+    with sock, reply:
+        if header.get('error'):
+            print(f"richless: {header['error']}", file=sys.stderr)
+        sock.settimeout(None)
+        sys.stdout.flush()
+        out = sys.stdout.buffer
+        while chunk := reply.read1(65536):
+            out.write(chunk)
+        out.flush()
+    return header.get('exit', 0)
+
+
+class RenderRequestHandler:
+    """Render one file for a client and stream the output back.
+
+    The client sends one JSON line with the path, the --md flag, its
+    terminal width and whether it wants git change markers. The reply is one JSON header line followed by the
+    rendered output. serve() mixes this into socketserver's
+    StreamRequestHandler, so socketserver is only imported by a server.
+    """
+
+    def handle(self) -> None:
+        if get_peer_uid(self.connection) not in (None, os.getuid()):
+            return
+        self.server.begin_request()
+        try:
+            self.render()
+        except Exception:
+            # The client went away (e.g. less quit early) or the file
+            # could not be read even as plain text
+            pass
+        finally:
+            self.server.end_request()
+
+    def render(self) -> None:
+        request = json.loads(self.rfile.readline())
+        filepath = request['path']
+        out = self.connection.makefile('w', encoding='utf-8', newline='')
+        with out:
+            if not os.path.isfile(filepath):
+                out.write(json.dumps({'exit': 1, 'error': f'File not found: {filepath}'}) + '\n')
+                return
+            out.write(json.dumps({'exit': 0}) + '\n')
+            rendered = StartedWriter(out)
+            try:
+                render_file(filepath, request.get('markdown', False), rendered,
+                            request.get('width') or MIN_SYNTAX_WIDTH, request.get('git_gutter', False))
+            except (BrokenPipeError, ConnectionResetError):
+                # The client went away (less quit early): stop rendering
+                return
+            except Exception:
+                # Fall back to plain output, as in-process rendering does
+                if not rendered.started:
+                    print_plain(filepath, file=out)
+
+
+class RenderServer:
+    """Unix socket server that keeps renderers, lexers and themes loaded.
+
+    serve() mixes this into socketserver's threading Unix stream server,
+    with a handler that mixes in RenderRequestHandler.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, handler: type):
+        import threading
+
+        super().__init__(str(socket_path), handler)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.last_activity = time.monotonic()
+
+    def begin_request(self) -> None:
+        with self.lock:
+            self.active += 1
+
+    def end_request(self) -> None:
+        with self.lock:
+            self.active -= 1
+            self.last_activity = time.monotonic()
+
+    def idle_for(self) -> float:
+        with self.lock:
+            if self.active:
+                return 0.0
+            return time.monotonic() - self.last_activity
+
+
+def warm_up() -> None:
+    """Load the Markdown renderer and common lexers before the first request."""
+    import io
+    sink = io.StringIO()
+    render_markdown("# richless\n\n- item\n\n```python\npass\n```\n", file=sink, width=MIN_SYNTAX_WIDTH)
+    for lexer_name in ("json", "yaml", "python", "bash", "toml", "xml"):
+        stream_syntax("x\n", lexer_name, file=sink)
+
+
+def serve(idle_timeout: float) -> int:
+    """Run the render server until it has been idle for idle_timeout seconds."""
+    import socket
+    import socketserver
+
+    class Handler(RenderRequestHandler, socketserver.StreamRequestHandler):
+        pass
+
+    class Server(RenderServer, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        pass
+
+    socket_path = get_server_socket_path()
+    socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    problem = check_socket_dir(socket_path)
+    if problem:
+        print(f"richless: Cannot serve on {socket_path}: {problem}", file=sys.stderr)
+        return 1
+    if socket_path.exists():
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(socket_path))
+        except OSError:
+            # Stale socket left by a server that did not shut down cleanly
+            socket_path.unlink()
+        else:
+            probe.close()
+            print(f"richless: A server is already running on {socket_path}", file=sys.stderr)
+            return 1
+
+    warm_up()
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(socket_path, Handler)
+    finally:
+        os.umask(old_umask)
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    server.timeout = min(1.0, idle_timeout)
+    try:
+        while server.idle_for() < idle_timeout:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            socket_path.unlink()
+        except OSError:
+            pass
+    return 0
+
+
+def start_batch(filepaths: list[str], force_markdown: bool) -> int:
+    """Render files into a private directory in the background, and print its path.
+
+    The manifest is written and the path printed before this returns; the
+    renders carry on in a detached process, in order, across a pool of
+    RICHLESS_WORKERS processes. A richless run with RICHLESS_BATCH_DIR set
+    to the directory copies a file's output from there instead of
+    rendering it, so one less can open every file while the later ones
+    are still rendering.
+    """
+    import tempfile
+
+    batch_dir = Path(tempfile.mkdtemp(prefix='richless-batch-'))
+    width = get_terminal_width()
+    files = {}
+    for i, filepath in enumerate(filepaths):
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            # Left to the richless run for it, which reports the error
+            continue
+        files[os.path.abspath(filepath)] = {'output': str(i), 'stat': [st.st_mtime_ns, st.st_size]}
+
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid == 0:
+        # Detach, so the caller's $(...) returns and less cannot be
+        # written over
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        try:
+            render_batch(files, force_markdown, width, batch_dir)
+        finally:
+            os._exit(0)
+
+    manifest = {'pid': pid, 'markdown': force_markdown, 'width': width, 'files': files}
+    write_cache_entry(batch_dir / 'manifest.json', json.dumps(manifest))
+    print(batch_dir)
+    return 0
+
+
+def render_batch(files: dict[str, dict[str, Any]], force_markdown: bool, width: int,
+                 batch_dir: Path) -> None:
+    """Render every file of a batch into batch_dir, first files first."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    jobs = [(filepath, force_markdown, width, batch_dir / entry['output'])
+            for filepath, entry in files.items()]
+    # Without a way to start workers (off Linux), files are rendered one by one
+    pool_context = get_pool_context()
+    workers = min(get_worker_count(), len(jobs)) if pool_context else 1
+    if workers <= 1:
+        for job in jobs:
+            render_file_atomically(*job)
+        return
+    # The pool runs files side by side, so each file is highlighted serially
+    os.environ['RICHLESS_WORKERS'] = '1'
+    with ProcessPoolExecutor(workers, mp_context=pool_context) as pool:
+        for future in [pool.submit(render_file_atomically, *job) for job in jobs]:
+            future.result()
+
+
+def render_file_atomically(filepath: str, force_markdown: bool, width: int, output_path: Path) -> None:
+    """Render a file to output_path, renaming the output into place once complete."""
+    import tempfile
+
+    try:
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=output_path.parent)
+    except OSError:
+        # The output directory is gone (a batch whose less has exited)
+        return
+    try:
+        with open(fd, 'w', encoding='utf-8', newline='') as out:
+            try:
+                # Git markers depend on the index and on timing, not on the
+                # file, so they are never part of saved output
+                render_file(filepath, force_markdown, out, width, git_gutter=False)
+            except Exception:
+                # Fall back to plain output, as in-process rendering does
+                out.seek(0)
+                out.truncate()
+                print_plain(filepath, file=out)
+        os.replace(temp_path, output_path)
+    except Exception:
+        _unlink_quietly(temp_path)
+
+
+def copy_batch_output(batch_dir: Path, filepath: str, force_markdown: bool, width: int,
+                      out: TextIO) -> bool:
+    """Copy a file's output from a richless --batch directory, waiting while it renders.
+
+    Returns False if the batch cannot supply it (the file is not in the
+    batch or has changed since, the flags or width differ, or the batch
+    stopped before rendering it); the caller then renders the file itself.
+    """
+    try:
+        manifest = json.loads((batch_dir / 'manifest.json').read_text(encoding='utf-8'))
+        entry = manifest['files'].get(os.path.abspath(filepath))
+        if entry is None or (manifest['markdown'], manifest['width']) != (force_markdown, width):
+            return False
+        st = os.stat(filepath)
+    except (OSError, ValueError, KeyError):
+        return False
+    if [st.st_mtime_ns, st.st_size] != entry['stat']:
+        return False
+
+    output_path = batch_dir / entry['output']
+    while not output_path.exists():
+        try:
+            os.kill(manifest['pid'], 0)
+        except ProcessLookupError:
+            # The renderer is gone; it may have finished this file just before
+            break
+        except PermissionError:
+            pass
+        time.sleep(BATCH_POLL_SECONDS)
+    return copy_cached_output(output_path, out)
+
+
+def render_tree(src: str, dest: str, force_markdown: bool) -> int:
+    """Render every text file under src to dest/<path>.ansi, across a process pool.
+
+    Hidden directories, files git ignores and binary files are skipped, and
+    so are files whose output is up to date: the manifest in dest records
+    the cache key (path, mtime, size, width, theme, mode, version) each
+    output was rendered from. Prints a throughput summary.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    src_dir = Path(src)
+    dest_dir = Path(dest)
+    if not src_dir.is_dir():
+        print(f"richless: Not a directory: {src}", file=sys.stderr)
+        return 1
+    started = time.monotonic()
+    width = get_terminal_width()
+    manifest_path = dest_dir / TREE_MANIFEST
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        manifest = {}
+
+    jobs = []
+    skipped = up_to_date = 0
+    for relpath in iter_tree_files(src_dir, dest_dir):
+        filepath = src_dir / relpath
+        try:
+            with open(filepath, 'rb') as f:
+                head = f.read(BINARY_SNIFF_BYTES)
+                if is_binary(head) and not detect_compression(head):
+                    skipped += 1
+                    continue
+            is_markdown = force_markdown or is_markdown_file(relpath)
+            key = cache_key(str(filepath), is_markdown, width)
+        except OSError:
+            skipped += 1
+            continue
+        output_path = dest_dir / (relpath + TREE_OUTPUT_SUFFIX)
+        if manifest.get(relpath) == key and output_path.exists():
+            up_to_date += 1
+            continue
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        jobs.append((relpath, key, (str(filepath), force_markdown, width, output_path)))
+
+    # Without a way to start workers (off Linux), files are rendered one by one
+    pool_context = get_pool_context()
+    workers = min(get_worker_count(), len(jobs)) if pool_context else 1
+    total_bytes = 0
+    # Output counts as fresh until its file changes, so it is highlighted in
+    # full, however long that takes, rather than cut short by the budget
+    overrides = {'RICHLESS_BUDGET_SECONDS': '0', 'RICHLESS_BUDGET_MB': '0'}
+    if workers > 1:
+        # The pool renders files side by side, so each file is highlighted serially
+        overrides['RICHLESS_WORKERS'] = '1'
+    with overridden_environ(overrides):
+        if workers > 1:
+            with ProcessPoolExecutor(workers, mp_context=pool_context) as pool:
+                futures = [pool.submit(render_file_atomically, *args) for _, _, args in jobs]
+                for (relpath, key, args), future in zip(jobs, futures):
+                    future.result()
+                    manifest[relpath] = key
+                    total_bytes += os.path.getsize(args[0])
+        else:
+            for relpath, key, args in jobs:
+                render_file_atomically(*args)
+                manifest[relpath] = key
+                total_bytes += os.path.getsize(args[0])
+    if jobs or not manifest_path.exists():
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        write_cache_entry(manifest_path, json.dumps(manifest, indent=0, sort_keys=True))
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    megabytes = total_bytes / (1024 * 1024)
+    print(f"Rendered {len(jobs)} files ({megabytes:.1f} MB) in {elapsed:.2f}s: "
+          f"{len(jobs) / elapsed:.1f} files/s, {megabytes / elapsed:.1f} MB/s; "
+          f"{up_to_date} up to date, {skipped} binary or unreadable")
+    return 0
+
+
+@contextmanager
+def overridden_environ(values: dict[str, str]) -> Iterator[None]:
+    """Set environment variables for the duration of a block, then put back what was there."""
+    saved = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+def iter_tree_files(src_dir: Path, dest_dir: Path) -> Iterator[str]:
+    """Yield the paths, relative to src_dir, of the files render_tree() considers.
+
+    Hidden directories and dest_dir (when it lies inside src_dir) are not
+    entered, and inside a git work tree, paths git ignores are left out.
+    """
+    dest_real = os.path.realpath(dest_dir)
+    relpaths = []
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        dirnames[:] = sorted(
+            name for name in dirnames
+            if not name.startswith('.') and os.path.realpath(os.path.join(dirpath, name)) != dest_real)
+        reldir = os.path.relpath(dirpath, src_dir)
+        for name in sorted(filenames):
+            relpaths.append(name if reldir == '.' else os.path.join(reldir, name))
+    ignored = find_git_ignored(src_dir, relpaths)
+    return (relpath for relpath in relpaths if relpath not in ignored)
+
+
+def find_git_ignored(directory: Path, relpaths: list[str]) -> set[str]:
+    """Return the paths (relative to directory) that git ignores; none outside a work tree."""
+    import subprocess
+
+    if not relpaths:
+        return set()
+    try:
+        result = subprocess.run(['git', '-C', str(directory), 'check-ignore', '--stdin', '-z'],
+                                input='\0'.join(relpaths).encode(), capture_output=True)
+    except OSError:
+        # git is not installed
+        return set()
+    # Exit status 1 means nothing is ignored, 128 that this is not a work tree
+    if result.returncode != 0:
+        return set()
+    return set(os.fsdecode(path) for path in result.stdout.split(b'\0') if path)
+
+
+def is_git_gutter_enabled() -> bool:
+    return os.environ.get('RICHLESS_GIT_GUTTER', '') not in ('', '0')
+
+
+def git_blob_id(data: bytes, length: int) -> str:
+    """Return git's object id for a blob with this content (SHA-1, or SHA-256 by id length)."""
+    import hashlib
+
+    digest = hashlib.sha1 if length == 40 else hashlib.sha256
+    return digest(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+def can_mark_lines(filepath: str) -> bool:
+    """Check whether a file is rendered line for line, small enough to get git change markers.
+
+    Markers are keyed to source lines, so tables (whose quoted records can
+    span lines) and pretty-printed minified JSON get none.
+    """
+    try:
+        if os.path.getsize(filepath) > GIT_GUTTER_MAX_BYTES:
+            return False
+        with open(filepath, 'rb') as f:
+            head = f.read(DETECT_WINDOW_CHARS).decode('utf-8', errors='replace')
+    except OSError:
+        return False
+    fmt = get_lexer_name(filepath, head)
+    return fmt not in TABLE_FORMATS and not (fmt == 'json' and is_minified_json(head))
+
+
+def find_git_changes(filepath: str) -> dict[int, str]:
+    """Return the lines of a file that differ from its blob in git's index.
+
+    Maps 0-based line numbers to 'added', 'modified', 'removed-above' or
+    'removed-below'. A file that is not tracked, or not in a work tree, has
+    no changes. With caching on, the result is kept by the index blob's
+    id and a hash of the file, so an unchanged pair is diffed once.
+    """
+    import hashlib
+    import subprocess
+
+    path = Path(filepath).resolve()
+    data = path.read_bytes()
+    try:
+        result = subprocess.run(['git', '-C', str(path.parent), 'ls-files', '--stage', '-z', '--', path.name],
+                                capture_output=True)
+    except OSError:
+        # git is not installed
+        return {}
+    # "<mode> <blob id> <stage>\t<path>\0"; a conflicted file has several stages
+    entries = result.stdout.split(b'\0')
+    if result.returncode != 0 or len(entries) != 2:
+        return {}
+    blob = entries[0].split()[1].decode()
+    if blob == git_blob_id(data, len(blob)):
+        return {}
+
+    cache_dir = get_cache_dir()
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = cache_dir / 'gutter' / hashlib.sha256(blob.encode() + data).hexdigest()
+        entry = read_cache_entry(cache_path)
+        if entry is not None:
+            return {int(line): kind for line, kind in json.loads(entry).items()}
+    result = subprocess.run(['git', '-C', str(path.parent), 'cat-file', 'blob', blob], capture_output=True)
+    if result.returncode != 0:
+        return {}
+    changes = diff_line_changes(result.stdout.decode('utf-8', errors='replace').splitlines(),
+                                data.decode('utf-8', errors='replace').splitlines())
+    if cache_path is not None:
+        entry = json.dumps(changes)
+        write_cache_entry(cache_path, entry)
+        add_cache_size(cache_dir, len(entry), get_cache_max_bytes())
+    return changes
+
+
+def diff_line_changes(old: list[str], new: list[str]) -> dict[int, str]:
+    """Mark the lines of `new` that were added or modified, or that lines were removed next to."""
+    import difflib
+
+    changes = {}
+    for tag, _i1, _i2, j1, j2 in difflib.SequenceMatcher(None, old, new).get_opcodes():
+        if tag == 'insert':
+            changes.update(dict.fromkeys(range(j1, j2), 'added'))
+        elif tag == 'replace':
+            changes.update(dict.fromkeys(range(j1, j2), 'modified'))
+        elif tag == 'delete' and new:
+            if j1 < len(new):
+                changes.setdefault(j1, 'removed-above')
+            else:
+                changes.setdefault(j1 - 1, 'removed-below')
+    return changes
+
+
+class GitGutter:
+    """Git change markers for a file, worked out in a background thread.
+
+    Starting git and diffing take a while on a large repository, so this
+    runs alongside highlighting instead of ahead of it.
+    """
+
+    def __init__(self, filepath: str):
+        import threading
+
+        self.changes: dict[int, str] = {}
+        self.done = threading.Event()
+        threading.Thread(target=self.run, args=(filepath,), daemon=True).start()
+
+    def run(self, filepath: str) -> None:
+        try:
+            self.changes = find_git_changes(filepath)
+        except Exception:
+            # No markers is better than no output
+            pass
+        finally:
+            self.done.set()
+
+    def get_changes(self, wait: bool) -> dict[int, str] | None:
+        """Return the changes, or None while they are not known yet (after waiting, if asked to)."""
+        if wait:
+            self.done.wait(GIT_GUTTER_WAIT_SECONDS)
+        return self.changes if self.done.is_set() else None
+
+
+class GutterWriter:
+    """Pass output through to a stream with a git change marker in front of every line.
+
+    The first write (the first screen) never waits for the diff: if it is
+    not done, those lines get a blank gutter. Later writes wait for it.
+    """
+
+    def __init__(self, file: TextIO, gutter: GitGutter):
+        self.file = file
+        self.gutter = gutter
+        self.line = 0
+        self.at_line_start = True
+        self.written = False
+
+    def write(self, data: str) -> int:
+        if not data:
+            return 0
+        changes = self.gutter.get_changes(wait=self.written)
+        self.written = True
+        parts = []
+        lines = data.split('\n')
+        last = len(lines) - 1
+        for i, line in enumerate(lines):
+            if i:
+                parts.append('\n')
+                self.line += 1
+                self.at_line_start = True
+            if self.at_line_start and (line or i < last):
+                parts.append(GIT_GUTTER_MARKERS[changes[self.line]]
+                             if changes and self.line in changes else GIT_GUTTER_BLANK)
+                self.at_line_start = False
+            parts.append(line)
+        self.file.write(''.join(parts))
+        return len(data)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+
+# The stage timer of the invocation being diagnosed, if any. A context
+# variable, so render server threads never see each other's timers.
+_stage_timer: ContextVar['StageTimer | None'] = ContextVar('_stage_timer', default=None)
+
+
+def is_debug_enabled() -> bool:
+    return os.environ.get('RICHLESS_DEBUG', '') not in ('', '0')
+
+
+def is_profile_enabled() -> bool:
+    return os.environ.get('RICHLESS_PROFILE', '') not in ('', '0')
+
+
+def get_debug_dir() -> Path:
+    """Return where the debug log and profiles go. less hides stderr, so they go to files."""
+    return Path.home() / '.richless'
+
+
+def write_debug_record(record: dict[str, Any]) -> None:
+    """Append a JSON record to ~/.richless/debug.log, ignoring write failures."""
+    record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'pid': os.getpid(), **record}
+    try:
+        debug_dir = get_debug_dir()
+        debug_dir.mkdir(parents=True, exist_ok=True)
+        with open(debug_dir / 'debug.log', 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+    except OSError:
+        pass
+
+
+def debug(message: str) -> None:
+    """Report a diagnostic on stderr and in the debug log when RICHLESS_DEBUG is set."""
+    if is_debug_enabled():
+        print(f'richless: {message}', file=sys.stderr)
+        write_debug_record({'message': message})
+
+
+class StageTimer:
+    """Wall time spent in each stage of one invocation.
+
+    Stages nest. Each stage is charged only its own time, not that of the
+    stages inside it, so the stages add up to the time measured.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages: dict[str, float] = {}
+        self._nested: list[float] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def record(self) -> dict[str, Any]:
+        """Return the timings in milliseconds."""
+        stages = {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+        return {'total_ms': round((time.monotonic() - self.started) * 1000, 2), 'stages_ms': stages}
+
+
+@contextmanager
+def timed_stage(name: str) -> Iterator[None]:
+    """Time a stage when the current invocation is being diagnosed."""
+    timer = _stage_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+@contextmanager
+def timing_imports(timer: StageTimer) -> Iterator[None]:
+    """Charge the time spent loading modules (rich, Pygments, lexers) to an 'imports' stage."""
+    original_import = builtins.__import__
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        with timer.stage('imports'):
+            return original_import(name, globals, locals, fromlist, level)
+
+    builtins.__import__ = timed_import
+    try:
+        yield
+    finally:
+        builtins.__import__ = original_import
+
+
+class TimedWriter:
+    """Wraps an output stream, charging time spent writing to it to a 'write' stage.
+
+    Writes block while less is not reading, so this is also time spent
+    waiting on the pager.
+    """
+
+    def __init__(self, file: TextIO, timer: StageTimer):
+        self.file = file
+        self.timer = timer
+
+    def write(self, data: str) -> int:
+        with self.timer.stage('write'):
+            return self.file.write(data)
+
+    def flush(self) -> None:
+        with self.timer.stage('write'):
+            self.file.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.file, name)
+
+
+class StartedWriter:
+    """Wraps an output stream, noting whether anything has been written to it.
+
+    Output copied straight to the file descriptor (cache hits, binary
+    input) is not seen.
+    """
+
+    def __init__(self, file: TextIO):
+        self.file = file
+        self.started = False
+
+    def write(self, data: str) -> int:
+        if data:
+            self.started = True
+        return self.file.write(data)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.file, name)
+
+
+def get_process_age() -> float | None:
+    """Return seconds since this process started, or None where unknown (non-Linux)."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22 (starttime), counting fields after the ")" closing field 2
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def render_main_diagnosed(file_arg: str, force_markdown: bool) -> int:
+    """Run render_main() with stage timing, and with cProfile under RICHLESS_PROFILE.
+
+    The timing record (and profile path) is appended to ~/.richless/debug.log.
+    """
+    timer = StageTimer()
+    _stage_timer.set(timer)
+    profiler = None
+    if is_profile_enabled():
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    exit_code = None
+    try:
+        with timing_imports(timer):
+            exit_code = render_main(file_arg, force_markdown, TimedWriter(sys.stdout, timer))
+        return exit_code
+    finally:
+        record = {'file': file_arg.strip(), 'exit': exit_code, **timer.record()}
+        startup = get_process_age()
+        if startup is not None:
+            # Interpreter start-up and importing richless, before main() ran
+            record['startup_ms'] = round((startup - (time.monotonic() - timer.started)) * 1000, 2)
+        if profiler is not None:
+            profiler.disable()
+            profile_dir = get_debug_dir() / 'profiles'
+            try:
+                profile_dir.mkdir(parents=True, exist_ok=True)
+                profile_path = profile_dir / f"richless-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof"
+                profiler.dump_stats(profile_path)
+                record['profile'] = str(profile_path)
+            except OSError:
+                pass
+        write_debug_record(record)
+
+
+def render_main(file_arg: str, force_markdown: bool, out: TextIO) -> int:
+    """Render a file argument (or "-" for stdin) to `out`; return the exit code."""
+    # Strip whitespace from filename (less adds leading space via LESSOPEN)
+    filepath = file_arg.strip()
+    is_stdin = filepath in ('-', '/dev/stdin')
+    out = StartedWriter(out)
+
+    try:
+        if is_stdin:
+            with timed_stage('render'):
+                render_pipe(sys.stdin.fileno(), force_markdown, out)
+        else:
+            batch_dir = os.environ.get('RICHLESS_BATCH_DIR')
+            if batch_dir:
+                with timed_stage('cache'):
+                    if copy_batch_output(Path(batch_dir), filepath, force_markdown,
+                                         get_terminal_width(), out):
+                        return 0
+            with timed_stage('server'):
+                exit_code = render_via_server(filepath, force_markdown)
+            if exit_code is not None:
+                return exit_code
+            render_file(filepath, force_markdown, out, get_terminal_width())
+
+        return 0
+
+    except FileNotFoundError:
+        print(f"richless: File not found: {file_arg}", file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        # less quit before reading everything: what is left is not wanted
+        discard_stdout()
+        return 0
+    except Exception as e:
+        print(f"richless: Error: {e}", file=sys.stderr)
+        if is_debug_enabled():
+            write_debug_record({'file': filepath, 'error': repr(e)})
+        # Fall back to plain output; from a pipe, only what is left to read,
+        # and from a file only if none of it was shown yet
+        try:
+            if is_stdin:
+                copy_raw(iter_pipe_bytes(b'', sys.stdin.fileno(), False), out)
+            elif out.started:
+                return 1
+            else:
+                print_plain(filepath, out)
+            return 0
+        except Exception:
+            return 1
+
+
+def discard_stdout() -> None:
+    """Point stdout at /dev/null once its reader has gone away.
+
+    Otherwise output still buffered in sys.stdout fails to flush again, and
+    Python reports it on stderr, as richless exits.
+    """
+    try:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        os.close(devnull)
+    except (OSError, ValueError):
+        # stdout is not a file descriptor (tests capture it)
+        pass
+
+
+def main():
+    """Main entry point for richless."""
+    parser = argparse.ArgumentParser(
+        description='LESSOPEN filter for Markdown rendering and syntax highlighting',
+        add_help=True,
+    )
+
+    parser.add_argument('files', nargs='*', metavar='file',
+                       help='File to process (use "-" for stdin); several with --batch')
+    parser.add_argument('--md', '--markdown',
+                       dest='force_markdown',
+                       action='store_true',
+                       help='Force Markdown rendering even for non-.md files')
+    parser.add_argument('--detect',
+                       action='store_true',
+                       help='Print the detected format (markdown, binary, text or a Pygments '
+                            'lexer name) instead of rendering')
+    parser.add_argument('--batch',
+                       action='store_true',
+                       help='Render the files in the background into a new directory and '
+                            'print its path, for richless runs with RICHLESS_BATCH_DIR to use')
+    parser.add_argument('--render-tree',
+                       action='store_true',
+                       help='Render every file under the directory SRC (the first file argument) '
+                            'to DEST/<path>.ansi (the second), skipping files already up to date')
+    parser.add_argument('--server',
+                       action='store_true',
+                       help='Run a render server that later richless calls with RICHLESS_SERVER=1 hand their files to')
+    parser.add_argument('--idle-timeout',
+                       type=float,
+                       default=DEFAULT_SERVER_IDLE_TIMEOUT,
+                       help='Seconds without requests before the server exits '
+                            f'(default: {DEFAULT_SERVER_IDLE_TIMEOUT})')
+
+    args = parser.parse_args()
+
+    if args.server:
+        return serve(args.idle_timeout)
+    if not args.files:
+        parser.error('the following arguments are required: file')
+    if args.batch:
+        return start_batch(args.files, args.force_markdown)
+    if args.render_tree:
+        if len(args.files) != 2:
+            parser.error('--render-tree takes a source and a destination directory')
+        return render_tree(args.files[0], args.files[1], args.force_markdown)
+    if len(args.files) > 1:
+        parser.error('only one file can be given without --batch')
+    file_arg = args.files[0]
+    if args.detect:
+        try:
+            print(detect_file(file_arg, args.force_markdown))
+        except OSError as e:
+            print(f"richless: {e}", file=sys.stderr)
+            return 1
+        return 0
+
+    if not (is_debug_enabled() or is_profile_enabled()):
+        return render_main(file_arg, args.force_markdown, sys.stdout)
+    return render_main_diagnosed(file_arg, args.force_markdown)
 
 
 if __name__ == "__main__":
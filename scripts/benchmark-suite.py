@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""Performance benchmark suite for richless, with JSON baselines.
+
+Generates synthetic corpora (pretty-printed and minified JSON, JSON Lines, a
+Zeek TSV log, Markdown with many tables and code fences, long-line source, an extensionless temp file as
+written by the piped-input wrapper, and a source file just under the PRD's
+10,000-line target) and measures, for each:
+
+- ``main``: the ``richless`` command end to end (cold start included)
+- ``render_syntax`` / ``render_markdown``: the render function alone, in a
+  fresh interpreter with the file already read
+- ``render_markdown_edit``: ``render_markdown`` on a 10,000-line document
+  after a one-paragraph edit, with its block cache already filled
+
+Each measurement records time to first byte, total wall time, output bytes,
+output bytes per input byte (the ANSI overhead less has to read through) and
+peak RSS. ``cold-start`` times the command on a one-line file.
+
+Usage:
+    python scripts/benchmark-suite.py run [--size small|full] [--runs N]
+                                          [--corpus NAME ...] [--output FILE]
+                                          [--baseline FILE] [--tolerance F]
+    python scripts/benchmark-suite.py compare BASELINE CURRENT [--tolerance F]
+
+``run --output`` stores the results as a JSON baseline. ``compare`` (or
+``run --baseline``) flags metrics that got worse by more than the tolerance,
+changed output sizes and newly missed targets (the PRD's 300 ms for files
+under 10,000 lines), and exits with status 1 if there are any. The ``full``
+size includes a 2 GB JSON Lines file; generated corpora are kept in
+``--corpus-dir`` between runs.
+
+No third-party dependencies required — uses only the standard library.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmark import conn_record, generate_pretty_json
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# PRD performance target: files under 10,000 lines render in under 300 ms
+TARGET_LINES = 10_000
+TARGET_MS = 300
+
+# Differences smaller than these are noise, whatever the relative change
+MIN_TIME_DELTA_MS = 20
+MIN_RSS_DELTA_MB = 5
+
+# Runs the render function in a fresh interpreter and reports its timings
+# as JSON on stderr. argv: project dir, function name, file path.
+DRIVER = r"""
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+import richless
+
+class Sink:
+    first = None
+    size = 0
+
+    def write(self, data):
+        if self.first is None:
+            self.first = time.perf_counter()
+        self.size += len(data.encode())
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+func, path = sys.argv[2], sys.argv[3]
+content = richless.read_text_file(path)
+width = richless.get_terminal_width()
+if func == "render_markdown_edit":
+    # Fill a block cache, then edit one paragraph in the middle of the document
+    import tempfile
+    from pathlib import Path
+    block_cache_dir = Path(tempfile.mkdtemp())
+    richless.render_markdown(content, file=Sink(), width=width, block_cache_dir=block_cache_dir)
+    middle = content.index("\n\n", len(content) // 2) + 2
+    content = content[:middle] + "An edited paragraph.\n\n" + content[middle:]
+sink = Sink()
+start = time.perf_counter()
+if func == "render_markdown":
+    richless.render_markdown(content, file=sink, width=width)
+elif func == "render_markdown_edit":
+    richless.render_markdown(content, file=sink, width=width, block_cache_dir=block_cache_dir)
+else:
+    richless.render_syntax(path, content, file=sink)
+end = time.perf_counter()
+print(json.dumps({"ttfb": (sink.first or end) - start, "total": end - start, "bytes": sink.size}),
+      file=sys.stderr)
+"""
+
+
+def generate_jsonl(path: Path, megabytes: int) -> None:
+    """Write about `megabytes` MB of Zeek-style conn records as JSON Lines."""
+    block = "".join(json.dumps(conn_record(i)) + "\n" for i in range(4000)).encode()
+    with open(path, "wb") as f:
+        for _ in range(max(1, megabytes * 1024 * 1024 // len(block))):
+            f.write(block)
+
+
+def generate_minified_json(path: Path, records: int) -> None:
+    """Write `records` Zeek-style conn records as one minified JSON array."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i in range(records):
+            f.write(("," if i else "") + json.dumps(conn_record(i), separators=(",", ":")))
+        f.write("]")
+
+
+def generate_zeek_tsv(path: Path, records: int) -> None:
+    """Write `records` Zeek-style conn records as a Zeek TSV log, with its header."""
+    fields = list(conn_record(0))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("#separator \\x09\n#set_separator\t,\n#empty_field\t(empty)\n#unset_field\t-\n#path\tconn\n")
+        f.write("#fields\t" + "\t".join(fields) + "\n")
+        for i in range(records):
+            values = conn_record(i).values()
+            f.write("\t".join("-" if value is None else "TF"[not value] if isinstance(value, bool) else str(value)
+                              for value in values) + "\n")
+        f.write("#close\t2015-04-01-00-00-30\n")
+
+
+def generate_markdown(path: Path, sections: int) -> None:
+    """Write a Markdown document with a table and a code fence in every section."""
+    # No links: rich gives each hyperlink a random id, so output size would vary
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("# Benchmark notes\n\n")
+        for i in range(sections):
+            f.write(f"## Section {i}\n\nSome *emphasis*, **bold** and `inline code` for item {i}.\n\n")
+            f.write("| Host | Port | Proto | Bytes |\n|---|---:|---|---:|\n")
+            for row in range(10):
+                f.write(f"| 192.168.{i % 256}.{row} | {1024 + row} | tcp | {row * 1337} |\n")
+            f.write("\n```python\n")
+            for line in range(15):
+                f.write(f"def handler_{i}_{line}(event):\n    return event.get('id', {line})\n")
+            f.write("```\n\n- first item\n- second item\n\n")
+
+
+def generate_long_lines(path: Path, lines: int) -> None:
+    """Write Python source mixing short lines, wide lines and over-wide (16K+) lines."""
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(lines):
+            if i % 50 == 49:
+                f.write(f"BLOB_{i} = [{', '.join(str(n) for n in range(4000))}]\n")
+            elif i % 5 == 4:
+                f.write(f"WIDE_{i} = '{'w' * 2000}'\n")
+            else:
+                f.write(f"value_{i} = compute({i}, key='k{i}')\n")
+
+
+def generate_source(path: Path, lines: int) -> None:
+    """Write a Python module of exactly `lines` lines."""
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(lines // 4):
+            f.write(f"def function_{i}(x):\n    \"\"\"Docstring {i}.\"\"\"\n    return x * {i}  # comment\n\n")
+        f.write("\n" * (lines % 4))
+
+
+def generate_tiny(path: Path) -> None:
+    path.write_text("hello\n", encoding="utf-8")
+
+
+# name: (file name, generator, small size, full size, render function)
+CORPORA = {
+    "cold-start": ("tiny.txt", lambda p, n: generate_tiny(p), 0, 0, None),
+    "pretty-json": ("conn.json", generate_pretty_json, 16_600, 166_000, "render_syntax"),
+    # The same records as pretty-json, on one line
+    "minified-json": ("conn.min.json", generate_minified_json, 1_300, 13_000, "render_syntax"),
+    "jsonl": ("conn.log", generate_jsonl, 16, 2048, "render_syntax"),
+    "zeek-tsv": ("conn.log", generate_zeek_tsv, 20_000, 1_000_000, "render_syntax"),
+    "markdown": ("notes.md", generate_markdown, 100, 2000, "render_markdown"),
+    # A 10K-line document re-rendered after a one-paragraph edit, with the
+    # Markdown block cache filled by the unedited version
+    "markdown-edit": ("design.md", generate_markdown, 188, 188, "render_markdown_edit"),
+    "long-lines": ("longlines.py", generate_long_lines, 200, 2000, "render_syntax"),
+    # Named like the wrapper's mktemp files, so richless detects the format from content
+    "piped-temp": ("richless.Ab12Cd", generate_pretty_json, 2_000, 20_000, "render_syntax"),
+    "source-10k": ("module.py", generate_source, TARGET_LINES - 1, TARGET_LINES - 1, "render_syntax"),
+}
+
+
+def ensure_corpus(corpus_dir: Path, name: str, size: str) -> Path:
+    """Generate a corpus unless a file of this size is already in corpus_dir."""
+    filename, generate, small, full, _func = CORPORA[name]
+    amount = small if size == "small" else full
+    path = corpus_dir / size / name / filename
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        print(f"generating {name} ({size})...", file=sys.stderr)
+        tmp = path.with_name(filename + ".tmp")
+        generate(tmp, amount)
+        tmp.replace(path)
+    return path
+
+
+def measure(cmd: list[str]) -> dict:
+    """Run cmd; return time to first byte, total time, stdout bytes, peak RSS and stderr."""
+    env = {**os.environ, "RICHLESS_DEBUG": "1",
+           # Measure rendering, not the cache or a running render server
+           "RICHLESS_CACHE": "0", "RICHLESS_SOCKET": os.devnull}
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, env=env)
+        assert proc.stdout is not None
+        first = proc.stdout.read1(65536)
+        ttfb = time.perf_counter() - start
+        size = len(first)
+        while chunk := proc.stdout.read1(65536):
+            size += len(chunk)
+        _pid, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        total = time.perf_counter() - start
+        stderr.seek(0)
+        errors = stderr.read().decode(errors="replace")
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return {"ttfb": ttfb, "total": total, "bytes": size, "peak_rss_mb": rss_mb,
+            "exit": proc.returncode, "stderr": errors}
+
+
+def benchmark(cmd: list[str], runs: int, from_stderr: bool) -> dict:
+    """Measure cmd `runs` times; keep the best times and the highest peak RSS."""
+    samples = []
+    for _ in range(runs):
+        sample = measure(cmd)
+        if sample["exit"] != 0:
+            raise RuntimeError(f"{' '.join(cmd)} exited with {sample['exit']}:\n{sample['stderr']}")
+        if from_stderr:
+            # The driver times the function itself, excluding interpreter startup
+            sample.update(json.loads(sample["stderr"].strip().splitlines()[-1]))
+        samples.append(sample)
+    return {
+        "ttfb_ms": round(min(s["ttfb"] for s in samples) * 1000, 1),
+        "total_ms": round(min(s["total"] for s in samples) * 1000, 1),
+        "bytes": samples[0]["bytes"],
+        "peak_rss_mb": round(max(s["peak_rss_mb"] for s in samples), 1),
+        "budget_cut": "render budget" in samples[0]["stderr"],
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args: argparse.Namespace) -> dict:
+    corpus_dir = Path(args.corpus_dir) if args.corpus_dir else Path(tempfile.gettempdir()) / "richless-bench"
+    results = {}
+    for name in args.corpus or CORPORA:
+        path = ensure_corpus(corpus_dir, name, args.size)
+        func = CORPORA[name][4]
+        results[f"{name}/main"] = benchmark(
+            [sys.executable, str(PROJECT_DIR / "richless.py"), str(path)], args.runs, from_stderr=False)
+        if func:
+            results[f"{name}/{func}"] = benchmark(
+                [sys.executable, "-c", DRIVER, str(PROJECT_DIR), func, str(path)], args.runs, from_stderr=True)
+        input_size = path.stat().st_size
+        for key in [k for k in results if k.startswith(f"{name}/")]:
+            results[key]["bytes_per_input_byte"] = round(results[key]["bytes"] / input_size, 2)
+            print_result(key, results[key])
+
+    targets = {}
+    if "source-10k/main" in results:
+        total = results["source-10k/main"]["total_ms"]
+        targets[f"main under {TARGET_MS} ms for < {TARGET_LINES} lines"] = {
+            "value_ms": total, "passed": total < TARGET_MS}
+    return {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "size": args.size,
+            "runs": args.runs,
+        },
+        "results": results,
+        "targets": targets,
+    }
+
+
+def print_result(key: str, result: dict) -> None:
+    note = "  (render budget ran out)" if result["budget_cut"] else ""
+    print(f"{key:<36} ttfb {result['ttfb_ms']:>9.1f} ms  total {result['total_ms']:>9.1f} ms  "
+          f"{result['bytes']:>12} B ({result['bytes_per_input_byte']:>5.2f} B/B)  "
+          f"rss {result['peak_rss_mb']:>7.1f} MB{note}")
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list[str]:
+    """Return a description of every regression from baseline to current."""
+    regressions = []
+    for key, base in baseline["results"].items():
+        cur = current["results"].get(key)
+        if cur is None:
+            continue
+        for metric, min_delta in (("ttfb_ms", MIN_TIME_DELTA_MS), ("total_ms", MIN_TIME_DELTA_MS),
+                                  ("peak_rss_mb", MIN_RSS_DELTA_MB)):
+            if cur[metric] > base[metric] * (1 + tolerance) and cur[metric] - base[metric] >= min_delta:
+                regressions.append(f"{key} {metric}: {base[metric]} -> {cur[metric]} "
+                                   f"(+{(cur[metric] / base[metric] - 1) * 100:.0f}%)")
+        if cur["bytes"] != base["bytes"]:
+            regressions.append(f"{key} output bytes changed: {base['bytes']} -> {cur['bytes']}")
+    for name, target in current.get("targets", {}).items():
+        base_target = baseline.get("targets", {}).get(name)
+        if base_target and base_target["passed"] and not target["passed"]:
+            regressions.append(f"target now missed: {name} ({target['value_ms']} ms)")
+    return regressions
+
+
+def report(regressions: list[str]) -> int:
+    if not regressions:
+        print("no regressions")
+        return 0
+    print("regressions:")
+    for regression in regressions:
+        print(f"  {regression}")
+    return 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="richless performance benchmark suite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Generate corpora and measure")
+    run.add_argument("--size", choices=["small", "full"], default="small",
+                     help="Corpus sizes (default: small; full is 166K-line JSON, 2 GB JSONL, ...)")
+    run.add_argument("--runs", type=int, default=3, help="Runs per measurement (default: 3)")
+    run.add_argument("--corpus", choices=list(CORPORA), action="append",
+                     help="Corpus to measure (default: all)")
+    run.add_argument("--corpus-dir", help="Where generated corpora are kept (default: $TMPDIR/richless-bench)")
+    run.add_argument("--output", help="Write the results to this JSON file")
+    run.add_argument("--baseline", help="Compare the results with this JSON baseline")
+    run.add_argument("--tolerance", type=float, default=0.10,
+                     help="Allowed slowdown before flagging a regression (default: 0.10)")
+
+    cmp = sub.add_parser("compare", help="Compare two result files")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    cmp.add_argument("--tolerance", type=float, default=0.10,
+                     help="Allowed slowdown before flagging a regression (default: 0.10)")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        baseline = json.loads(Path(args.baseline).read_text())
+        current = json.loads(Path(args.current).read_text())
+        return report(compare(baseline, current, args.tolerance))
+
+    results = run_suite(args)
+    for name, target in results["targets"].items():
+        print(f"{name}: {target['value_ms']} ms, {'passed' if target['passed'] else 'MISSED'}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+    if args.baseline:
+        return report(compare(json.loads(Path(args.baseline).read_text()), results, args.tolerance))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Benchmark richless on large generated inputs.
+
+Generates a large pretty-printed JSON file (the ``cat conn.log | jq | less``
+case) and measures how long ``richless`` takes to produce its first byte of
+output and to finish, with the direct ANSI highlighting engine and with the
+rich rendering pipeline (RICHLESS_ENGINE=rich), both in a single process.
+Then measures how the ANSI engine scales with the number of highlighting
+worker processes (RICHLESS_WORKERS).
+
+Also compares the throughput of the line-oriented JSON Lines highlighter
+with the Pygments JSON lexer on generated Zeek-style JSONL.
+
+Usage:
+    python scripts/benchmark.py [--lines N] [--jsonl-lines N] [--runs N] [--engine ansi|rich]
+                                [--workers N ...]
+
+No third-party dependencies required — uses only the standard library.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def conn_record(i: int) -> dict:
+    """Return a Zeek conn.log-style record."""
+    return {
+        "ts": 1427846411.876987 + i,
+        "uid": f"C{i:017d}",
+        "id.orig_h": f"192.168.{i % 256}.{(i * 7) % 256}",
+        "id.orig_p": 1024 + i % 60000,
+        "id.resp_h": "10.0.0.1",
+        "id.resp_p": 443,
+        "proto": "tcp",
+        "service": None,
+        "duration": (i % 1000) / 7.0,
+        "local_orig": True,
+        "history": "ShADadFf",
+    }
+
+
+def generate_pretty_json(path: Path, lines: int) -> None:
+    """Write Zeek-style conn records as pretty-printed JSON, about `lines` lines long."""
+    with open(path, "w", encoding="utf-8") as f:
+        written = 0
+        i = 0
+        while written < lines:
+            text = json.dumps(conn_record(i), indent=2) + "\n"
+            f.write(text)
+            written += text.count("\n")
+            i += 1
+
+
+def generate_jsonl(path: Path, lines: int) -> None:
+    """Write `lines` Zeek-style conn records as JSON Lines."""
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(lines):
+            f.write(json.dumps(conn_record(i)) + "\n")
+
+
+def jsonl_throughput(path: Path) -> dict[str, float]:
+    """Highlight a JSONL file in-process with the JSON lexer and the JSONL scanner; return MB/s."""
+    sys.path.insert(0, str(PROJECT_DIR))
+    import richless
+
+    code = path.read_text(encoding="utf-8")
+    megabytes = len(code.encode()) / 1e6
+    results = {}
+
+    start = time.perf_counter()
+    for _line in richless.iter_ansi_lines(richless.iter_token_lines(code, richless.get_lexer("json"))):
+        pass
+    results["json lexer"] = megabytes / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _line in richless.iter_jsonl_lines(richless.split_code_lines(code)):
+        pass
+    results["jsonl scanner"] = megabytes / (time.perf_counter() - start)
+    return results
+
+
+def measure(cmd: list[str], env: dict[str, str] | None = None) -> dict[str, float | int]:
+    """Run cmd and return time to first byte, total wall time and output size."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            env={**os.environ, **(env or {})})
+    assert proc.stdout is not None
+    first = proc.stdout.read1(65536)
+    ttfb = time.perf_counter() - start
+    size = len(first)
+    while chunk := proc.stdout.read1(65536):
+        size += len(chunk)
+    proc.wait()
+    total = time.perf_counter() - start
+    return {"ttfb": ttfb, "total": total, "bytes": size}
+
+
+def default_worker_counts() -> list[int]:
+    """Return 1, 2, 4, ... up to the CPU count, plus the CPU count itself."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 < cpus:
+        counts.append(counts[-1] * 2)
+    if cpus > 1:
+        counts.append(cpus)
+    return counts
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark richless on large inputs")
+    parser.add_argument("--lines", type=int, default=166_000,
+                        help="Approximate line count of the generated JSON (default: 166000)")
+    parser.add_argument("--jsonl-lines", type=int, default=200_000,
+                        help="Line count of the generated JSONL (default: 200000)")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per measurement (default: 3)")
+    parser.add_argument("--engine", choices=["ansi", "rich"], action="append",
+                        help="Highlighting engine to measure (default: both)")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        help="Worker counts to measure scaling with (default: 1, 2, 4, ... CPU count)")
+    args = parser.parse_args()
+
+    cmd = [sys.executable, str(PROJECT_DIR / "richless.py")]
+    totals = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = Path(tmp) / "conn.json"
+        generate_pretty_json(corpus, args.lines)
+        print(f"corpus: {corpus.name}, {os.path.getsize(corpus) / 1e6:.1f} MB, ~{args.lines} lines")
+        for engine in args.engine or ["ansi", "rich"]:
+            env = {"RICHLESS_ENGINE": engine, "RICHLESS_WORKERS": "1"}
+            results = [measure([*cmd, str(corpus)], env) for _ in range(args.runs)]
+            totals[engine] = min(r["total"] for r in results)
+            print(f"\n[{engine} engine]")
+            print(f"time to first byte: {min(r['ttfb'] for r in results) * 1000:.0f} ms")
+            print(f"total wall time:    {totals[engine] * 1000:.0f} ms")
+            print(f"output bytes:       {results[0]['bytes']}")
+
+        if len(totals) == 2:
+            print(f"\nansi engine speedup: {totals['rich'] / totals['ansi']:.1f}x")
+
+        print("\n[parallel scaling, ansi engine]")
+        serial = None
+        for workers in args.workers or default_worker_counts():
+            env = {"RICHLESS_ENGINE": "ansi", "RICHLESS_WORKERS": str(workers)}
+            total = min(measure([*cmd, str(corpus)], env)["total"] for _ in range(args.runs))
+            serial = serial or total
+            print(f"{workers:>3} workers: {total * 1000:6.0f} ms  ({serial / total:.1f}x)")
+
+        jsonl = Path(tmp) / "conn.log"
+        generate_jsonl(jsonl, args.jsonl_lines)
+        print(f"\ncorpus: {jsonl.name} (JSONL), {os.path.getsize(jsonl) / 1e6:.1f} MB, {args.jsonl_lines} lines")
+        throughput = jsonl_throughput(jsonl)
+        for name, mb_per_s in throughput.items():
+            print(f"{name + ':':<20}{mb_per_s:.1f} MB/s")
+        print(f"jsonl scanner speedup: {throughput['jsonl scanner'] / throughput['json lexer']:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
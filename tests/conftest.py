@@ -22,3 +22,44 @@ def has_markdown_formatting(output: str) -> bool:
     """Check if output contains Rich markdown formatting."""
     indicators = ["\u2503", "\u250f", "\u2517", "\u2501", "\u2513", "\u251b", "\u2500", "\u2022", " \u2022 "]
     return any(ind in output for ind in indicators)
+
+
+SGR_RE = re.compile(r'\x1b\[([\d;]*)m')
+
+
+def styled_chars(output: str) -> list[tuple[str, tuple[tuple[str, str], ...]]]:
+    """Pair each visible character with the style in effect for it.
+
+    SGR parameters are interpreted (colors replace colors, ``39``/``49`` and
+    ``2x`` codes clear what they clear, ``0`` resets everything), so two
+    outputs that paint the screen the same way compare equal even when they
+    spell their escape sequences differently.
+    """
+    chars = []
+    style: dict[str, str] = {}
+    pos = 0
+    for match in SGR_RE.finditer(output + '\x1b[0m'):
+        frozen = tuple(sorted(style.items()))
+        chars.extend((ch, frozen) for ch in output[pos:match.start()])
+        pos = match.end()
+        params = match.group(1).split(';')
+        while params:
+            param = params.pop(0)
+            if param in ('', '0'):
+                style.clear()
+            elif param in ('38', '48'):
+                count = 2 if params[0] == '5' else 4
+                style['fg' if param == '38' else 'bg'] = ';'.join(params[:count])
+                del params[:count]
+            elif param in ('39', '49'):
+                style.pop('fg' if param == '39' else 'bg', None)
+            elif param == '22':
+                style.pop('1', None)
+                style.pop('2', None)
+            elif param in ('23', '24', '25', '27', '28', '29'):
+                style.pop(param[1], None)
+            elif param[0] in '34' and len(param) == 2:
+                style['fg' if param[0] == '3' else 'bg'] = param
+            else:
+                style[param] = param
+    return chars
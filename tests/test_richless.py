@@ -4,23 +4,58 @@ Unit tests for richless.
 Run with: uv run pytest tests/test_richless.py -v
 """
 
+import bz2
+import gzip
+import io
+import json
+import lzma
 import os
 import pytest
+import re
+import select
+import shutil
+import socket
 import subprocess
 import sys
+import threading
+import time
 from pathlib import Path
 
 # Add parent directory to path so we can import richless
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import richless
 from richless import (
+    PIPE_READ_BYTES,
     MAX_SYNTAX_WIDTH,
     MIN_SYNTAX_WIDTH,
+    RenderBudget,
+    detect_format,
+    detect_table,
     detect_syntax_from_content,
+    evict_cache,
+    find_chunk_starts,
+    find_lexer_for_filename,
+    get_lexer_index,
     get_syntax_width_and_overflow,
+    get_worker_count,
     is_markdown_file,
+    is_jsonl,
+    is_minified_json,
+    iter_jsonl_lines,
+    iter_line_batches,
+    iter_decompressed,
+    iter_json_tokens,
+    iter_pretty_json_lines,
+    iter_markdown_chunks,
+    minimize_sgr,
+    iter_pipe_pieces,
+    render_markdown,
+    render_table,
+    stream_syntax,
+    write_pipe_pieces,
 )
-from conftest import has_ansi_colors, has_multiple_colors, has_markdown_formatting
+from conftest import has_ansi_colors, has_multiple_colors, has_markdown_formatting, styled_chars
 
 
 def ansi_test_env(extra: dict[str, str] | None = None) -> dict[str, str]:
@@ -33,6 +68,11 @@ def ansi_test_env(extra: dict[str, str] | None = None) -> dict[str, str]:
     return env
 
 
+def strip_link_ids(output: str) -> str:
+    """Drop the random ids rich gives hyperlinks, so two renders can be compared."""
+    return re.sub(r"\x1b\]8;id=[0-9]+;", "\x1b]8;;", output)
+
+
 class TestIsMarkdownFile:
     """Tests for is_markdown_file() function."""
 
@@ -172,6 +212,108 @@ port = 8080
     def test_whitespace_only(self):
         assert detect_syntax_from_content("   \n\n   ") == "text"
 
+    def test_markdown_only_when_requested(self):
+        content = "# Title\n\nSome **bold** text.\n"
+        assert detect_format(content) == "markdown"
+        assert detect_syntax_from_content(content) == "text"
+
+    @pytest.mark.parametrize("head", [
+        b"\x89PNG\r\n\x1a\n", b"%PDF-1.7\n", b"BZh91AY&SY", b"\x7fELF\x02\x01", b"PK\x03\x04",
+    ])
+    def test_magic_bytes_are_binary(self, head):
+        assert detect_format(head + b"text") == "binary"
+
+    def test_detection_cost_does_not_grow_with_size(self):
+        small = "# Config\n" + "name = 1\n" * 100
+        large = small * 20_000  # about 18 MB
+
+        def best_time(content):
+            times = []
+            for _ in range(5):
+                start = time.perf_counter()
+                detect_syntax_from_content(content)
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        assert detect_syntax_from_content(large) == "toml"
+        # Copying even a few MB of the input would take milliseconds
+        assert best_time(large) < best_time(small) * 10 + 0.001
+
+    def test_detect_mode_reads_only_the_start(self, tmp_path):
+        path = tmp_path / "huge"
+        with open(path, "wb") as f:
+            f.write(b'{"key": "value"}\n' * 10_000)
+            f.truncate(8 * 1024 ** 3)  # sparse: reading it all would take many seconds
+        start = time.perf_counter()
+        result = subprocess.run(["richless", "--detect", str(path)], capture_output=True, text=True)
+        assert result.stdout == "json\n"
+        assert time.perf_counter() - start < 5
+
+    @pytest.mark.parametrize("args,expected", [
+        (["test.md"], "markdown"), (["test.py"], "python"), (["test.txt"], "text"),
+        (["test.log"], "json"), (["--md", "test.txt"], "markdown"),
+    ])
+    def test_detect_mode(self, args, expected):
+        fixtures = Path(__file__).parent / "fixtures"
+        args = [str(fixtures / arg) if arg.startswith("test") else arg for arg in args]
+        result = subprocess.run(["richless", "--detect", *args], capture_output=True, text=True)
+        assert result.returncode == 0
+        assert result.stdout == f"{expected}\n"
+
+    def test_detect_mode_on_stdin(self):
+        result = subprocess.run(["richless", "--detect", "-"], input="key: value\n",
+                                capture_output=True, text=True)
+        assert result.stdout == "yaml\n"
+
+
+class TestLexerIndex:
+    """Tests for the extension-to-lexer index."""
+
+    @pytest.mark.parametrize("filename, expected", [
+        ("main.py", "python"), ("config.yml", "yaml"), ("events.jsonl", "json"),
+        ("Makefile", "make"), ("Dockerfile", "docker"), ("notes.txt", "text"),
+        ("server.log", None), ("README", None),
+    ])
+    def test_lexer_for_filename(self, filename, expected):
+        assert find_lexer_for_filename(filename, "") == expected
+
+    @pytest.mark.parametrize("content", ["Note: call Bob\n", "name = Bob\n", "{\"a\": 1}\n"])
+    def test_plain_text_extension_skips_content_detection(self, tmp_path, content):
+        path = tmp_path / "notes.txt"
+        path.write_text(content)
+        result = subprocess.run(["richless", "--detect", str(path)], capture_output=True, text=True)
+        assert result.stdout == "text\n"
+
+    def test_ambiguous_extension_uses_content(self):
+        assert find_lexer_for_filename("x.h", "@interface Foo : NSObject\n@end\n") == "objective-c"
+        assert find_lexer_for_filename("x.h", "int main(void);\n") == "c"
+
+    def test_index_is_kept_per_pygments_version(self, tmp_path, monkeypatch):
+        import pygments
+
+        monkeypatch.setenv("RICHLESS_CACHE", "1")
+        monkeypatch.setenv("RICHLESS_CACHE_DIR", str(tmp_path))
+        monkeypatch.setattr(richless, "_lexer_indexes", {})
+        index = get_lexer_index()
+        assert [p.name for p in (tmp_path / "lexers").iterdir()] == [f"{pygments.__version__}.json"]
+
+        monkeypatch.setattr(pygments, "__version__", "0.0")
+        assert get_lexer_index() is not index
+        assert get_lexer_index()["pygments"] == "0.0"
+        assert [p.name for p in (tmp_path / "lexers").iterdir()] == ["0.0.json"]
+
+    def test_loading_imports_no_lexer_modules(self, tmp_path):
+        env = ansi_test_env({"RICHLESS_CACHE": "1", "RICHLESS_CACHE_DIR": str(tmp_path)})
+        code = ("import sys, richless; richless.get_lexer_index(); "
+                "print(sorted(m for m in sys.modules if m.startswith('pygments.lexers')))")
+        for _ in range(2):
+            result = subprocess.run([sys.executable, "-c", code], env=env,
+                                    capture_output=True, text=True, check=True)
+            loaded = eval(result.stdout)
+            assert not [m for m in loaded if m not in ("pygments.lexers", "pygments.lexers._mapping")]
+        # The second run loaded the stored index without Pygments' mapping
+        assert loaded == []
+
 
 class TestSyntaxWidthSafety:
     """Tests for syntax width clamp and overflow behavior."""
@@ -199,6 +341,778 @@ class TestSyntaxWidthSafety:
         assert width == MAX_SYNTAX_WIDTH
         assert exceeds_cap is True
 
+    def test_width_counts_carriage_return_line_breaks(self):
+        content = "short\r" + "x" * 200 + "\rshort"
+        assert get_syntax_width_and_overflow(content) == (201, False)
+
+    @pytest.mark.parametrize("width", [MAX_SYNTAX_WIDTH + 1000, richless.PIPE_SNIFF_BYTES + 1000])
+    def test_only_the_wide_line_of_a_longer_file_is_raw(self, tmp_path, width):
+        wide = "x = '" + "a" * width + "'"
+        path = tmp_path / "mixed.py"
+        path.write_text(wide + "\ndef f():\n    return 1\n")
+        result = subprocess.run(["richless", str(path)], capture_output=True, text=True, env=ansi_test_env())
+        lines = result.stdout.split("\n")
+        assert lines[0] == wide
+        assert has_multiple_colors(lines[2])
+
+
+class TestStartupImports:
+    """Import-time regression tests: passthrough paths must not load rich or Pygments."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+    # Generous upper bound for `import richless` itself, so CI noise does not
+    # fail the test but an accidental heavy top-level import does.
+    IMPORT_BUDGET_MS = 150
+
+    def imported_modules(self, *args, stdin: str | None = None) -> dict[str, int]:
+        """Run richless under -X importtime and return {module: cumulative microseconds}."""
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-m", "richless", *args],
+            input=stdin,
+            capture_output=True,
+            text=True,
+            env=ansi_test_env(),
+            cwd=Path(__file__).parent.parent,
+        )
+        modules = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _self, cumulative, name = line.split(":", 1)[1].split("|")
+            modules[name.strip()] = int(cumulative)
+        return modules
+
+    def heavy_modules(self, modules: dict[str, int]) -> list[str]:
+        return [m for m in modules if m.split(".")[0] in ("rich", "pygments")]
+
+    def test_plain_text_file_uses_only_stdlib(self):
+        modules = self.imported_modules(str(self.FIXTURES_DIR / "test.txt"))
+        assert modules, "expected -X importtime output"
+        assert self.heavy_modules(modules) == []
+
+    def test_oversized_line_fallback_uses_only_stdlib(self, tmp_path):
+        long_line_file = tmp_path / "longline.py"
+        long_line_file.write_text("x" * (MAX_SYNTAX_WIDTH + 1) + "\n")
+        assert self.heavy_modules(self.imported_modules(str(long_line_file))) == []
+
+    def test_plain_stdin_uses_only_stdlib(self):
+        modules = self.imported_modules("-", stdin="just some words\n")
+        assert self.heavy_modules(modules) == []
+
+    def test_syntax_file_loads_pygments_but_not_rich(self):
+        modules = self.imported_modules(str(self.FIXTURES_DIR / "test.py"))
+        assert "pygments.lexers" in modules
+        assert not [m for m in modules if m.split(".")[0] == "rich"]
+
+    @pytest.mark.parametrize("name", ["test.txt", "test.py"])
+    def test_rendering_skips_stdlib_modules_of_other_paths(self, name):
+        modules = self.imported_modules(str(self.FIXTURES_DIR / name))
+        lazy = {"csv", "hashlib", "mmap", "socket", "socketserver", "struct", "tempfile", "threading",
+                "unicodedata"}
+        assert lazy.isdisjoint(modules)
+
+    def test_module_import_within_budget(self):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import richless"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent.parent,
+        )
+        richless_line = [line for line in result.stderr.splitlines() if line.endswith("| richless")]
+        cumulative_us = int(richless_line[-1].split("|")[1])
+        assert cumulative_us / 1000 < self.IMPORT_BUDGET_MS
+
+
+class TestStreamingSyntax:
+    """Tests for batch-by-batch syntax rendering."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+    def render_single_pass(self, content: str, lexer: str) -> str:
+        """Render content the pre-streaming way: one Syntax object, one print.
+
+        rich's SGR sequences are minimized, as richless does with its output.
+        """
+        from rich.console import Console
+        from rich.syntax import Syntax
+
+        out = io.StringIO()
+        width, _ = get_syntax_width_and_overflow(content)
+        console = Console(file=out, force_terminal=True, color_system="truecolor", width=width)
+        console.print(Syntax(content, lexer, theme="monokai", line_numbers=False,
+                             background_color="default"))
+        return minimize_sgr(out.getvalue())
+
+    @pytest.fixture(params=["ansi", "rich"], autouse=True)
+    def engine(self, request, monkeypatch):
+        """Run every test against both highlighting engines."""
+        monkeypatch.setenv("RICHLESS_ENGINE", request.param)
+        return request.param
+
+    def render_streaming(self, content: str, lexer: str) -> str:
+        out = io.StringIO()
+        stream_syntax(content, lexer, file=out)
+        return out.getvalue()
+
+    @pytest.mark.parametrize("name,lexer", [
+        ("test.json", "json"),
+        ("test.py", "python"),
+        ("test.yaml", "yaml"),
+        ("test.html", "html"),
+        ("test.sh", "bash"),
+    ])
+    def test_matches_single_pass_output(self, name, lexer):
+        content = (self.FIXTURES_DIR / name).read_text()
+        assert self.render_streaming(content, lexer) == self.render_single_pass(content, lexer)
+
+    @pytest.mark.parametrize("content", [
+        "", "x = 1", "x = 1\n", "a\n\n\n", "\tif x:\n\t\tpass\n",
+        "x = 1\r\ny = 2\r\n", "s = '\x07bell'\n", "@decorator\nclass A: ...\n",
+    ])
+    def test_matches_single_pass_edge_cases(self, content):
+        assert self.render_streaming(content, "python") == self.render_single_pass(content, "python")
+
+    def test_oversized_lines_pass_through_raw(self):
+        blob = "[" + ", ".join(["1"] * (MAX_SYNTAX_WIDTH // 2)) + "]"
+        content = "x = 1\n" + f"y = {blob}\n" + "def f():\n    return 'done'\n"
+        output = self.render_streaming(content, "python")
+        lines = output.split("\n")
+        assert lines[1] == f"y = {blob}"
+        assert has_multiple_colors(lines[0])
+        assert has_multiple_colors(lines[2] + lines[3])
+        assert len(lines) == content.count("\n") + 2
+
+    def test_lexing_restarts_after_oversized_line(self):
+        content = "a = 1\n" + "#" * MAX_SYNTAX_WIDTH + "\nb = 2\n"
+        output = self.render_streaming(content, "python")
+        expected = self.render_streaming("a = 1\n", "python")[:-1] + "#" * MAX_SYNTAX_WIDTH + "\n"
+        assert output.startswith(expected)
+        assert output.endswith(self.render_streaming("b = 2\n", "python"))
+
+    def test_mixed_width_corpus_renders_in_bounded_time(self):
+        normal = (self.FIXTURES_DIR / "test.py").read_text()
+        oversized = "s = '" + "ab\\" * 300_000 + "'\n"
+        content = (normal + oversized) * 5
+        start = time.perf_counter()
+        output = self.render_streaming(content, "python")
+        elapsed = time.perf_counter() - start
+        assert output.count(oversized) == 5
+        # The five 900K-character lines are copied, not lexed
+        assert elapsed < 2.0, f"mixed-width render took {elapsed:.2f}s"
+
+    def test_lexer_state_carries_across_batches(self):
+        # A docstring that spans the first batch boundary must stay a string
+        content = 'x = """\n' + "word\n" * 150 + '"""\ny = 1\n'
+        assert self.render_streaming(content, "python") == self.render_single_pass(content, "python")
+
+    def test_large_input_is_flushed_in_batches(self):
+        class FlushCounter(io.StringIO):
+            flushes = 0
+
+            def flush(self):
+                self.flushes += 1
+
+        out = FlushCounter()
+        stream_syntax('{"key": "value"}\n' * 5000, "json", file=out)
+        assert out.flushes > 2
+
+    def test_line_batches_start_small(self):
+        batches = list(iter_line_batches(range(25), first_size=5, size=10))
+        assert [len(b) for b in batches] == [5, 10, 10]
+
+
+class TestJSONLHighlighting:
+    """Tests for the line-oriented JSON Lines highlighter."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+    def lexer_styles(self, line: str) -> list:
+        """Style each character of a line the way the Pygments JSON lexer does."""
+        from richless import get_lexer, iter_ansi_lines, iter_token_lines
+
+        return styled_chars(next(iter_ansi_lines(iter_token_lines(line + "\n", get_lexer("json")))))
+
+    def scanner_styles(self, line: str) -> list:
+        return styled_chars(next(iter_jsonl_lines([line])))
+
+    def assert_same_colors(self, line: str):
+        # The scanner paints whitespace with the punctuation color, which is invisible
+        lexer = [c for c in self.lexer_styles(line) if not c[0].isspace()]
+        scanner = [c for c in self.scanner_styles(line) if not c[0].isspace()]
+        assert scanner == lexer
+
+    @pytest.mark.parametrize("name", ["test.jsonl", "test.log"])
+    def test_matches_lexer_colors_on_fixtures(self, name):
+        for line in (self.FIXTURES_DIR / name).read_text().splitlines():
+            self.assert_same_colors(line)
+
+    @pytest.mark.parametrize("line", [
+        '{"a": -1.5e+3, "b": 0, "c": true, "d": false, "e": null}',
+        '{"escaped": "quote \\" and \\\\ and \\u00e9", "list": [1, "two", [3.0]]}',
+        '[1, 2, {"nested": {"deep": []}}]',
+        '{ "spaced" :\t"value" }',
+        '{}',
+    ])
+    def test_matches_lexer_colors_on_values(self, line):
+        self.assert_same_colors(line)
+
+    @pytest.mark.parametrize("line", [
+        '{"a": undefined}',
+        '{"a": 01}',
+        '{"a": "unterminated}',
+        '{"a": "b" "c"}',
+        'not json at all',
+    ])
+    def test_invalid_line_is_plain(self, line):
+        assert next(iter_jsonl_lines([line])) == line
+
+    def test_oversized_record_is_scanned(self):
+        big = '{"blob": [' + ", ".join(['"x"'] * MAX_SYNTAX_WIDTH) + "]}"
+        lines = ['{"a": 1}', big, '{"b": 2}']
+        start = time.perf_counter()
+        output = list(iter_jsonl_lines(lines))
+        assert time.perf_counter() - start < 1.0
+        assert "".join(char for char, _ in styled_chars(output[1])) == big
+        assert has_multiple_colors(output[1])
+
+    def test_blank_lines_stay_blank(self):
+        assert list(iter_jsonl_lines(["", '{"a": 1}', ""]))[::2] == ["", ""]
+
+    def test_detects_jsonl(self):
+        assert is_jsonl('\n{"a": 1}\n{"a": 2}\n')
+        assert is_jsonl('[1, 2]\n')
+        assert not is_jsonl('{\n  "a": 1\n}\n')
+
+    def test_jsonl_uses_scanner(self, monkeypatch):
+        monkeypatch.delenv("RICHLESS_ENGINE", raising=False)
+        content = (self.FIXTURES_DIR / "test.jsonl").read_text()
+        out = io.StringIO()
+        stream_syntax(content, "json", file=out)
+        expected = "".join(line + "\n" for line in iter_jsonl_lines(content.splitlines()))
+        # Like the lexer path, a final newline renders as a trailing blank line
+        assert out.getvalue() == expected + "\n"
+
+
+class TestMinifiedJSON:
+    """Tests for pretty-printing minified JSON before highlighting."""
+
+    DOCUMENT = {
+        "name": "caf\u00e9 \"quoted\" \\ [not, a: list]",
+        "numbers": [0, -1.5e+3, 12345678901234567890, True, False, None],
+        "empty": {"object": {}, "array": []},
+        "nested": [{"a": [[1, 2], {"b": {}}]}, []],
+    }
+
+    def minified(self, padding: int = MAX_SYNTAX_WIDTH) -> str:
+        return json.dumps(dict(self.DOCUMENT, padding=["x" * 10] * (padding // 12 + 1)),
+                          separators=(",", ":"))
+
+    def pretty(self, text: str, chunk_size: int) -> list[str]:
+        chunks = (text[i:i + chunk_size] for i in range(0, len(text), chunk_size))
+        return list(iter_pretty_json_lines(iter_json_tokens(chunks)))
+
+    @pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1000])
+    def test_matches_json_dumps_across_chunks(self, chunk_size):
+        text = self.minified(padding=100)
+        expected = json.dumps(json.loads(text), indent=2).splitlines()
+        assert self.pretty(text, chunk_size) == expected
+
+    def test_whitespace_between_tokens_is_ignored(self):
+        text = ' {\n"a" :\t[ 1 , 2 ] ,"b":{ } }\n'
+        assert self.pretty(text, 3) == json.dumps({"a": [1, 2], "b": {}}, indent=2).splitlines()
+
+    def test_concatenated_values_start_new_lines(self):
+        assert self.pretty('{"a":1}{"b":2}[]3', 4) == ["{", '  "a": 1', "}", "{", '  "b": 2', "}", "[]", "3"]
+
+    def test_invalid_input_still_tokenizes(self):
+        assert self.pretty('{"a":undefined,"b":"unterminated', 5) == ["{", '  "a": undefined,', '  "b": "unterminated']
+        assert self.pretty("]]}", 1) == ["]", "]", "}"]
+
+    def test_huge_string_is_scanned_in_linear_time(self):
+        text = '["' + "x" * 20_000_000 + '"]'
+        start = time.perf_counter()
+        lines = self.pretty(text, PIPE_READ_BYTES)
+        assert time.perf_counter() - start < 5.0
+        assert [len(line) for line in lines] == [1, len(text), 1]
+
+    def test_detects_minified_json(self):
+        assert is_minified_json(self.minified())
+        assert is_minified_json("  [" + "1," * MAX_SYNTAX_WIDTH)
+        assert not is_minified_json(self.minified(padding=100))
+        assert not is_minified_json('{\n  "a": "' + "x" * MAX_SYNTAX_WIDTH + '"\n}')
+        assert not is_minified_json('"' + "x" * MAX_SYNTAX_WIDTH + '"')
+        assert not is_minified_json(self.minified() + '\n{"a": 1}\n')
+        assert is_minified_json(self.minified() + "\n\n")
+
+    def assert_pretty_printed(self, output: str, text: str):
+        expected = json.dumps(json.loads(text), indent=2)
+        assert "".join(char for char, _ in styled_chars(output)).rstrip("\n") == expected
+        assert has_multiple_colors(output)
+
+    @pytest.mark.parametrize("name", ["data.json", "data"])
+    def test_file_is_pretty_printed(self, tmp_path, name):
+        text = self.minified()
+        path = tmp_path / name
+        path.write_text(text)
+        result = subprocess.run(["richless", str(path)], capture_output=True, text=True, env=ansi_test_env())
+        assert result.returncode == 0
+        self.assert_pretty_printed(result.stdout, text)
+
+    @pytest.mark.parametrize("suffix", [".json.gz", ""])
+    def test_stream_is_pretty_printed(self, tmp_path, suffix):
+        text = self.minified()
+        path = tmp_path / f"data{suffix}"
+        if suffix:
+            path.write_bytes(gzip.compress(text.encode()))
+            args, stdin = ["richless", str(path)], None
+        else:
+            args, stdin = ["richless", "-"], text
+        result = subprocess.run(args, input=stdin, capture_output=True, text=True, env=ansi_test_env())
+        assert result.returncode == 0
+        self.assert_pretty_printed(result.stdout, text)
+
+    @pytest.mark.parametrize("padding", [MAX_SYNTAX_WIDTH, richless.PIPE_SNIFF_BYTES])
+    @pytest.mark.parametrize("piped", [False, True])
+    def test_wide_first_record_of_json_lines_is_not_expanded(self, tmp_path, padding, piped):
+        first = self.minified(padding)
+        text = first + "\n" + "".join(json.dumps({"n": i}) + "\n" for i in range(5))
+        path = tmp_path / "events.jsonl"
+        path.write_text(text)
+        args, stdin = (["richless", "-"], text) if piped else (["richless", str(path)], None)
+        result = subprocess.run(args, input=stdin, capture_output=True, text=True, env=ansi_test_env())
+        assert result.returncode == 0
+        lines = result.stdout.split("\n")
+        # The records after the first stay one per line
+        plain = ["".join(char for char, _ in styled_chars(line)) for line in lines[-7:]]
+        assert plain == [json.dumps({"n": i}) for i in range(5)] + ["", ""]
+        if padding < richless.PIPE_SNIFF_BYTES:
+            # A first line that ends within the sample shows it is JSON Lines
+            assert len(lines) == 8
+        else:
+            # One that does not is pretty-printed on its own
+            assert "".join(char for char, _ in styled_chars("\n".join(lines[:-7]))).rstrip("\n") \
+                == json.dumps(json.loads(first), indent=2)
+
+    def test_other_wide_lines_stay_raw(self, tmp_path):
+        path = tmp_path / "bundle.js"
+        path.write_text("var a=[" + "1," * MAX_SYNTAX_WIDTH + "];")
+        result = subprocess.run(["richless", str(path)], capture_output=True, text=True, env=ansi_test_env())
+        assert result.stdout == path.read_text()
+
+    def test_budget_leaves_rest_unhighlighted(self):
+        from richless import render_minified_json
+
+        text = self.minified(padding=MAX_SYNTAX_WIDTH * 4)
+        out = io.StringIO()
+        budget = RenderBudget(max_chars=1000)
+        render_minified_json([text], out, budget)
+        assert budget.stopped_by == "size"
+        lines = out.getvalue().splitlines()
+        assert "".join(char for char, _ in styled_chars(out.getvalue())).rstrip("\n") == json.dumps(json.loads(text), indent=2)
+        assert has_ansi_colors(lines[0]) and not has_ansi_colors(lines[-2])
+
+
+class TestTableRendering:
+    """Tests for the column-aligned view of Zeek TSV logs, CSV and TSV."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+    def render(self, texts, fmt: str, budget: RenderBudget | None = None) -> str:
+        out = io.StringIO()
+        render_table([(text, paused) for text, paused in texts], fmt, out, budget or RenderBudget())
+        return out.getvalue()
+
+    def cells(self, output: str) -> list[list[tuple[str, tuple, int]]]:
+        """Split each rendered line into (text, style, start column) cells."""
+        rows = []
+        for line in output.splitlines():
+            chars = styled_chars(line)
+            cells = []
+            for match in re.finditer(r"\S+(?: \S+)*", "".join(char for char, _ in chars)):
+                cells.append((match.group(), chars[match.start()][1], match.start()))
+            rows.append(cells)
+        return rows
+
+    @pytest.mark.parametrize("lines,expected", [
+        (["a,b,c", "1,2,3", '4,"5, 6",x'], "csv"),
+        (["a\tb\tc", "1\tx\t2", "", "3\ty\t4"], "tsv"),
+        (["Hello, world", "Goodbye, world"], None),
+        (["a,b,c", "1,2,3,4", "4,5,6"], None),
+        (["def f():", "\treturn 1", "\treturn 2"], None),
+        (["\tx\ty", "\t1\t2", "\t2\t3"], None),
+        # Python logging: the milliseconds follow a comma
+        (["2026-10-17 01:02:03,123 INFO started",
+          "2026-10-17 01:02:04,456 INFO listening on 8080",
+          "2026-10-17 01:02:05,789 WARNING slow request, 2.5s"], None),
+        (["First, we read the file.", "Then, we parse it.", "Finally, we print it."], None),
+        (["Red, green, blue", "One, two, three", "Here, there, everywhere"], None),
+        (["name,city,country", "Alice,Paris,France", "Bob,Lima,Peru"], None),
+        (["1,2,3", "4,5,6", "7,8,9"], None),
+    ])
+    def test_detects_tables(self, lines, expected):
+        assert detect_table(lines) == expected
+
+    def test_detect_format_finds_tables(self):
+        zeek = (self.FIXTURES_DIR / "test-zeek.log").read_text()
+        assert detect_format(zeek) == "zeek"
+        assert detect_format((self.FIXTURES_DIR / "test.csv").read_text()) == "csv"
+        assert detect_format("a\tb\tc\n1\t2\t3\n4\t5\t6\n") == "tsv"
+        # A last line that may be cut short is not counted
+        assert detect_format("a,b,c\n1,2,3\n4,5,6") == "text"
+
+    def test_table_extensions(self):
+        assert find_lexer_for_filename("hosts.csv", "") == "csv"
+        assert find_lexer_for_filename("HOSTS.TSV", "") == "tsv"
+
+    def test_zeek_log_columns_line_up(self):
+        content = (self.FIXTURES_DIR / "test-zeek.log").read_text()
+        output = self.render([(content, False)], "zeek")
+        rows = self.cells(output)
+        assert len(rows) == content.count("\n") + 1
+        fields = content.splitlines()[6].split("\t")[1:]
+        header, types, *data = rows[6:-2]
+        assert [text for text, _, _ in header] == fields
+        assert all(style and ("1", "1") in style for _, style, _ in header)
+        starts = [start for _, _, start in header]
+        for row in [types, *data]:
+            assert [start for _, _, start in row] == starts
+        # Each column has a color of its own, the next column another
+        assert data[0][0][1] == data[1][0][1] != data[0][1][1]
+        # Header and types lines become table rows; the other # lines stay
+        assert [text for text, _, _ in rows[0]] == ["#separator \\x09"]
+        assert [text for text, _, _ in rows[-2]] == ["#close 2015-04-01-00-00-30"]
+
+    def test_concatenated_zeek_logs_get_their_own_widths(self):
+        content = (self.FIXTURES_DIR / "test-zeek.log").read_text()
+        rows = self.cells(self.render([(content + "#fields\tx\ty\nlongvalue\t1\n", False)], "zeek"))
+        assert [start for _, _, start in rows[-3]] == [0, 11]
+        assert [start for _, _, start in rows[-2]] == [0, 11]
+
+    def test_zeek_unset_and_empty_fields_are_dim(self):
+        content = (self.FIXTURES_DIR / "test-zeek.log").read_text()
+        rows = self.cells(self.render([(content, False)], "zeek"))
+        comment = rows[0][0][1]
+        dim = [style for row in rows[8:-2] for text, style, _ in row if text in ("-", "(empty)")]
+        assert dim and all(style == comment for style in dim)
+
+    def test_csv_quoting(self):
+        content = (self.FIXTURES_DIR / "test.csv").read_text()
+        rows = self.cells(self.render([(content, False)], "csv"))
+        assert [text for text, _, _ in rows[1]][-1] == "TLS 1.2, SNI www.google.com"
+        assert [text for text, _, _ in rows[4]][-1] == 'broadcast, "name" query'
+
+    def test_csv_record_across_pieces(self):
+        output = self.render([("a,b\n1,\"x\n", True), ("y\",2\n3,4\n", False)], "csv")
+        lines = ["".join(char for char, _ in styled_chars(line)).rstrip() for line in output.splitlines()]
+        # The pause lays out the header alone; the quoted newline is shown escaped
+        assert lines == ["a  b", "1  x\\x0ay  2", "3  4", ""]
+
+    def test_output_is_minimal_sgr(self):
+        content = (self.FIXTURES_DIR / "test-zeek.log").read_text()
+        output = self.render([(content, False)], "zeek")
+        assert minimize_sgr(output) == output
+
+    def test_over_wide_cells_are_cut(self):
+        content = "id,blob,after\n1," + "x" * (MAX_SYNTAX_WIDTH * 2) + ",end\n2,short,end\n"
+        rows = self.cells(self.render([(content, False)], "csv"))
+        blob = rows[1][1][0]
+        assert len(blob) == richless.TABLE_MAX_CELL_WIDTH and blob.endswith(richless.TABLE_ELLIPSIS)
+        assert rows[1][2][0] == "end" and rows[1][2][2] == rows[2][2][2]
+
+    def test_unparsable_csv_record_is_raw(self, tmp_path):
+        # A field over the csv module's 131072-character limit
+        blob = "x" * 200_000
+        content = "id,blob,after\n1,short,end\n2," + blob + ",end\n3,short,end\n"
+        lines = self.render([(content, False)], "csv").splitlines()
+        assert len(lines) == content.count("\n") + 1
+        assert lines[2] == "2," + blob + ",end"
+        rows = self.cells("\n".join(lines[:2] + lines[3:]))
+        assert [text for text, _, _ in rows[2]] == ["3", "short", "end"]
+
+        path = tmp_path / "wide.csv"
+        path.write_text(content)
+        result = subprocess.run(["richless", str(path)], capture_output=True, text=True, env=ansi_test_env())
+        assert result.returncode == 0 and not result.stderr
+        assert result.stdout.count("\n") == content.count("\n") + 1
+
+    def test_wide_characters_line_up(self):
+        content = "name,n\n日本語,1\nabc,2\n"
+        output = self.render([(content, False)], "csv")
+        lines = ["".join(char for char, _ in styled_chars(line)) for line in output.splitlines()]
+        # 日本語 takes six terminal columns
+        assert lines[1].index("1") + 3 == lines[2].index("2")
+
+    def test_later_wider_cells_widen_their_column(self, monkeypatch):
+        monkeypatch.setattr(richless, "TABLE_SAMPLE_ROWS", 3)
+        content = "a\tb\n1\t2\n3\t4\nlonger\t5\n6\t7\n"
+        rows = self.cells(self.render([(content, False)], "tsv"))
+        # Rows in the sample keep their widths; from the wide cell on, the column is wider
+        assert [row[1][2] for row in rows[:4]] == [3, 3, 3, 8]
+        assert rows[4][1][2] == 8
+
+    def test_pause_writes_rows_so_far(self):
+        out = io.StringIO()
+        texts = iter([("a,b\n1,2\n", True), ("3,4\n", False)])
+        render_table(texts, "csv", out, RenderBudget())
+        assert out.getvalue().count("\n") == 4
+
+    def test_budget_writes_the_rest_as_it_is(self):
+        rows = "".join(f"{i}\t{i * 2}\n" for i in range(20000))
+        output = self.render([(rows, False)], "tsv", RenderBudget(max_chars=1000))
+        lines = output.splitlines()
+        assert "\x1b" in lines[0] and lines[-2] == "19999\t39998"
+        assert len(lines) == 20001
+        # A quoted record waiting for its end is written once, raw
+        output = self.render([("a,b\n1,2\n3,\"multi\n", True), ("line\"\n4,5\n", False)], "csv",
+                             RenderBudget(max_chars=5))
+        assert output.endswith('3,"multi\nline"\n4,5\n\n')
+
+    @pytest.mark.parametrize("name", ["test-zeek.log", "test.csv"])
+    def test_file_and_pipe_render_alike(self, name):
+        path = self.FIXTURES_DIR / name
+        direct = subprocess.run(["richless", str(path)], capture_output=True, text=True,
+                                env=ansi_test_env({"RICHLESS_CACHE": "0"}))
+        piped = subprocess.run(["richless", "-"], input=path.read_text(), capture_output=True, text=True,
+                               env=ansi_test_env())
+        assert has_multiple_colors(direct.stdout)
+        assert piped.stdout == direct.stdout
+
+    def test_compressed_zeek_log(self, tmp_path):
+        path = tmp_path / "conn.log.gz"
+        path.write_bytes(gzip.compress((self.FIXTURES_DIR / "test-zeek.log").read_bytes()))
+        compressed = subprocess.run(["richless", str(path)], capture_output=True, text=True, env=ansi_test_env())
+        direct = subprocess.run(["richless", str(self.FIXTURES_DIR / "test-zeek.log")], capture_output=True,
+                                text=True, env=ansi_test_env({"RICHLESS_CACHE": "0"}))
+        assert compressed.stdout == direct.stdout
+
+
+class TestMinimalSGR:
+    """Tests for the minimal SGR encoder."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+    def render_rich(self, name: str, lexer: str) -> str:
+        from rich.console import Console
+        from rich.syntax import Syntax
+
+        content = (self.FIXTURES_DIR / name).read_text()
+        out = io.StringIO()
+        console = Console(file=out, force_terminal=True, color_system="truecolor", width=120)
+        console.print(Syntax(content, lexer, theme="monokai", background_color="default"))
+        return out.getvalue()
+
+    def screen(self, output: str) -> list:
+        """Style each character as it shows: spaces only show some attributes."""
+        return [(char, tuple(item for item in style if item[0] in ("bg", "4", "7", "9")))
+                if char.isspace() else (char, style) for char, style in styled_chars(output)]
+
+    @pytest.mark.parametrize("name,lexer", [("test.json", "json"), ("test.py", "python")])
+    def test_same_screen_in_fewer_bytes(self, name, lexer):
+        output = self.render_rich(name, lexer)
+        minimal = minimize_sgr(output)
+        assert self.screen(minimal) == self.screen(output)
+        assert len(minimal) < len(output) * 0.6
+
+    def test_is_idempotent(self):
+        minimal = minimize_sgr(self.render_rich("test.py", "python"))
+        assert minimize_sgr(minimal) == minimal
+
+    @pytest.mark.parametrize("text,expected", [
+        # Only what changes is written
+        ("\x1b[1;31ma\x1b[0m\x1b[1;32mb\x1b[0m", "\x1b[1;31ma\x1b[32mb\x1b[0m"),
+        # Dropping an attribute may be shorter as a reset
+        ("\x1b[1;3;31ma\x1b[0m\x1b[31mb\x1b[0m", "\x1b[1;3;31ma\x1b[0;31mb\x1b[0m"),
+        # 22 clears both bold and dim
+        ("\x1b[1;2;31ma\x1b[0m\x1b[2;31mb", "\x1b[1;2;31ma\x1b[22;2mb\x1b[0m"),
+        # A foreground change does not show on spaces
+        ("\x1b[31ma\x1b[0m\x1b[32m  \x1b[0m\x1b[31mb\x1b[0m", "\x1b[31ma  b\x1b[0m"),
+        # A background does ("0;41" is shorter than "39;41")
+        ("\x1b[31ma\x1b[0m\x1b[41m  \x1b[0m", "\x1b[31ma\x1b[0;41m  \x1b[0m"),
+        # Styles without text are dropped, default-colour codes are no-ops
+        ("\x1b[1m\x1b[0m\x1b[49mx\x1b[0m", "x"),
+    ])
+    def test_transitions(self, text, expected):
+        assert minimize_sgr(text) == expected
+
+    def test_lines_end_in_default_style(self):
+        minimal = minimize_sgr("\x1b[1;31mone\ntwo\x1b[0m\nthree\n")
+        assert minimal == "\x1b[1;31mone\x1b[0m\ntwo\nthree\n"
+
+    def test_keeps_hyperlinks(self):
+        link = "\x1b]8;id=1;https://example.com\x1b\\"
+        text = f"\x1b[4;34m{link}site\x1b[0m\x1b[4;34m\x1b]8;;\x1b\\\x1b[0m\n"
+        assert minimize_sgr(text) == f"{link}\x1b[4;34msite\x1b]8;;\x1b\\\x1b[0m\n"
+
+
+class TestParallelHighlighting:
+    """Tests for highlighting large inputs across worker processes."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+    @pytest.fixture(autouse=True)
+    def small_chunks(self, monkeypatch):
+        """Split even small inputs into several chunks."""
+        import richless
+
+        monkeypatch.delenv("RICHLESS_ENGINE", raising=False)
+        monkeypatch.setattr(richless, "PARALLEL_MIN_CHARS", 1)
+        monkeypatch.setattr(richless, "PARALLEL_CHUNK_LINES", 40)
+        monkeypatch.setattr(richless, "STREAM_FIRST_BATCH_LINES", 10)
+        monkeypatch.setattr(richless, "STREAM_BATCH_LINES", 40)
+
+    def render(self, content: str, lexer: str, workers: int, monkeypatch) -> str:
+        monkeypatch.setenv("RICHLESS_WORKERS", str(workers))
+        out = io.StringIO()
+        stream_syntax(content, lexer, file=out)
+        return out.getvalue()
+
+    @pytest.mark.parametrize("name,lexer", [
+        ("test.json", "json"),
+        ("test.jsonl", "json"),
+        ("test.py", "python"),
+        ("test.yaml", "yaml"),
+    ])
+    def test_matches_serial_output(self, name, lexer, monkeypatch):
+        content = (self.FIXTURES_DIR / name).read_text() * 20
+        assert self.render(content, lexer, 3, monkeypatch) == self.render(content, lexer, 1, monkeypatch)
+
+    def test_chunk_inside_string_falls_back_to_serial(self, monkeypatch):
+        import richless
+
+        serial_writes = []
+        write_lines = richless.write_lines
+
+        def spy(lines, file):
+            serial_writes.append(file)
+            write_lines(lines, file)
+
+        monkeypatch.setattr(richless, "write_lines", spy)
+        # Blank lines followed by unindented lines inside a docstring look like chunk starts
+        content = "x = 1\n" * 20 + 's = """\n' + "\nword = 'quoted\n" * 60 + '"""\ny = 2\n'
+        parallel = self.render(content, "python", 3, monkeypatch)
+        assert serial_writes
+        assert parallel == self.render(content, "python", 1, monkeypatch)
+
+    @pytest.mark.parametrize("name,content", [
+        ("test.json", None),
+        ("test.jsonl", None),
+        ("test.py", None),
+        ("test.yaml", None),
+        ("strings.py", "x = 1\n" * 20 + 's = """\n' + "\nword = 'quoted\n" * 60 + '"""\ny = 2\n'),
+    ])
+    def test_files_stream_like_serial_output(self, tmp_path, name, content, monkeypatch):
+        import richless
+
+        content = content or (self.FIXTURES_DIR / name).read_text() * 20
+        path = tmp_path / name
+        path.write_text(content)
+        monkeypatch.setenv("RICHLESS_WORKERS", "3")
+        out = io.StringIO()
+        richless.render_text_file(str(path), out, budget=RenderBudget())
+        lexer = richless.get_lexer_name(name, content)
+        assert out.getvalue() == self.render(content, lexer, 1, monkeypatch)
+
+    def test_file_is_read_a_piece_at_a_time(self, tmp_path, monkeypatch):
+        import richless
+
+        path = tmp_path / "big.py"
+        path.write_text("def f(x):\n    return x\n\n" * 20000)
+        monkeypatch.setenv("RICHLESS_WORKERS", "1")
+        monkeypatch.setattr(richless, "read_text_file", None)
+        lexed = []
+        real_highlight_chunk = richless.highlight_chunk
+
+        def spy(chunk, peek, *args):
+            lexed.append(len(chunk))
+            return real_highlight_chunk(chunk, peek, *args)
+
+        monkeypatch.setattr(richless, "highlight_chunk", spy)
+        out = io.StringIO()
+        richless.render_text_file(str(path), out, budget=RenderBudget())
+        assert out.getvalue().count("\n") == 60001
+        assert max(lexed) < 10000
+
+    def test_chunks_start_at_top_level_lines(self):
+        lines = ["a = 1"] * 15 + ["", "    indented", "", "def f():"] + ["    pass"] * 5
+        assert find_chunk_starts(lines, line_safe=False) == [0, 18]
+        assert find_chunk_starts(lines, line_safe=True) == [0, 10]
+
+    @pytest.mark.parametrize("value,expected", [("4", 4), ("0", 1), ("-2", 1)])
+    def test_worker_count_setting(self, value, expected, monkeypatch):
+        monkeypatch.setenv("RICHLESS_WORKERS", value)
+        assert get_worker_count() == expected
+
+    def test_invalid_worker_count_uses_default(self, monkeypatch):
+        monkeypatch.setenv("RICHLESS_WORKERS", "many")
+        assert get_worker_count() >= 1
+
+
+class TestStreamingMarkdown:
+    """Tests for block-by-block Markdown rendering."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+    OSC8_RE = re.compile(r"\x1b\]8;[^\x1b]*\x1b\\")
+
+    def render_single_pass(self, content: str) -> str:
+        """Render content the pre-streaming way: one Markdown object, one print."""
+        from rich.console import Console
+        from rich.markdown import Markdown
+
+        out = io.StringIO()
+        console = Console(file=out, force_terminal=True, color_system="truecolor", width=80)
+        console.print(Markdown(content))
+        return self.OSC8_RE.sub("", minimize_sgr(out.getvalue()))
+
+    def render_streaming(self, content: str) -> str:
+        out = io.StringIO()
+        render_markdown(content, file=out, width=80)
+        return self.OSC8_RE.sub("", out.getvalue())
+
+    @pytest.fixture(autouse=True)
+    def small_batches(self, monkeypatch):
+        """Split after every block so each boundary is exercised."""
+        monkeypatch.setattr(richless, "STREAM_FIRST_BATCH_LINES", 1)
+        monkeypatch.setattr(richless, "MARKDOWN_BATCH_LINES", 1)
+
+    def test_matches_single_pass_output(self):
+        content = (self.FIXTURES_DIR / "test.md").read_text()
+        assert self.render_streaming(content) == self.render_single_pass(content)
+
+    @pytest.mark.parametrize("content", [
+        "", "# Title", "para\n\n---\n\n**after rule**\n",
+        "- a\n\n- b\n\nnot a list\n", "3. three\n\n4. four\n",
+        "```py\nx = 1\n\ny = 2\n```\n\nafter\n", "~~~\n```\n\n~~~\ntext\n",
+        "<!-- note\n\nstill a comment -->\n\ntext\n", "<pre>\n\nkept\n</pre>\n\ntext\n",
+        "| a | b |\n|---|---|\n| 1 | 2 |\n\n| c |\n|---|\n| 3 |\n",
+        "> quote\n>\n> more\n\ntext\n", "text\n---\n\n![img](x.png) after\n\n    code\n",
+        "See [the docs][docs].\n\nMore text.\n\n[docs]: https://example.com\n",
+    ])
+    def test_matches_single_pass_edge_cases(self, content):
+        assert self.render_streaming(content) == self.render_single_pass(content)
+
+    def test_chunks_end_at_top_level_blocks(self):
+        # A list never starts a chunk, so loose items stay together; fences are never split
+        content = "# A\n\ntext\n\n- one\n\n- two\n\n```\nx\n\ny\n```\n"
+        assert list(iter_markdown_chunks(content)) == [
+            "# A\n\n", "text\n\n- one\n\n- two\n\n", "```\nx\n\ny\n```\n"]
+
+    def test_reference_definitions_render_in_one_chunk(self):
+        content = "[a][ref]\n\ntext\n\n[ref]: https://example.com\n"
+        assert list(iter_markdown_chunks(content)) == [content]
+
+    def test_large_document_is_flushed_in_batches(self, monkeypatch):
+        class FlushCounter(io.StringIO):
+            flushes = 0
+
+            def flush(self):
+                self.flushes += 1
+
+        monkeypatch.setattr(richless, "MARKDOWN_BATCH_LINES", 50)
+        out = FlushCounter()
+        render_markdown("## Section\n\nSome *text* here.\n\n" * 100, file=out, width=80)
+        assert out.flushes > 2
+
 
 class TestIntegration:
     """Integration tests that run richless as a subprocess."""
@@ -485,6 +1399,24 @@ class TestErrorHandling:
         assert result.returncode == 1
         assert "File not found" in result.stderr
 
+    @pytest.mark.parametrize("partial,expected_exit", [("", 0), ("line 1\n", 1)])
+    def test_failed_render_is_not_shown_twice(self, tmp_path, monkeypatch, capsys, partial, expected_exit):
+        path = tmp_path / "notes.py"
+        path.write_text("line 1\nline 2\n")
+
+        def failing_render(filepath, force_markdown, out, width, git_gutter=None):
+            out.write(partial)
+            raise ValueError("render failed")
+
+        monkeypatch.setattr(richless, "render_file", failing_render)
+        monkeypatch.delenv("RICHLESS_BATCH_DIR", raising=False)
+        monkeypatch.delenv("RICHLESS_SERVER", raising=False)
+        out = io.StringIO()
+        assert richless.render_main(str(path), False, out) == expected_exit
+        # The file is shown plain only if none of the render was written
+        assert out.getvalue() == (partial or "line 1\nline 2\n")
+        assert "render failed" in capsys.readouterr().err
+
     def test_empty_file_does_not_crash(self, tmp_path):
         empty = tmp_path / "empty.py"
         empty.write_text("")
@@ -508,6 +1440,41 @@ class TestErrorHandling:
         # Should not crash -- either returns 0 (fallback) or 1 (error handled)
         assert result.returncode in (0, 1)
 
+    @pytest.mark.parametrize("data", [
+        b'\x00\x01\x02\xff\xfe\xfd',
+        "café crème\n".encode("latin-1"),
+    ], ids=["nul", "latin-1"])
+    def test_binary_or_non_utf8_file_exits_cleanly_with_no_output(self, tmp_path, data):
+        binfile = tmp_path / "data.py"
+        binfile.write_bytes(data)
+        result = subprocess.run(
+            ["richless", str(binfile)],
+            capture_output=True,
+            env=ansi_test_env(),
+        )
+        assert result.returncode == 0
+        assert result.stdout == b""
+        assert result.stderr == b""
+
+    def test_invalid_utf8_after_sniff_is_replaced(self, tmp_path):
+        # Files are rendered as they are read, so what follows the sniffed
+        # start is not checked before output begins
+        path = tmp_path / "data.py"
+        path.write_bytes(b"x = 1\n" * 5000 + b"y = '\xff'\n")
+        result = subprocess.run(["richless", str(path)], capture_output=True, env=ansi_test_env())
+        assert result.returncode == 0
+        lines = result.stdout.decode().split("\n")
+        assert has_multiple_colors(lines[0])
+        assert "\ufffd" in lines[5000]
+
+    def test_multibyte_character_across_sniff_boundary_is_text(self, tmp_path):
+        from richless import BINARY_SNIFF_BYTES, read_text_file
+
+        text = "x" * (BINARY_SNIFF_BYTES - 1) + "é\n"
+        path = tmp_path / "edge.txt"
+        path.write_text(text, encoding="utf-8")
+        assert read_text_file(str(path)) == text
+
     def test_successful_render_returns_exit_code_0(self):
         result = subprocess.run(
             ["richless", str(self.FIXTURES_DIR / "test.py")],
@@ -534,9 +1501,822 @@ class TestErrorHandling:
         assert not has_ansi_colors(result.stdout), "Fallback output should be raw text without ANSI codes"
 
 
+    def test_oversized_line_in_longer_file_keeps_other_lines_highlighted(self, tmp_path):
+        mixed = tmp_path / "mixed.py"
+        long_line = "x = '" + "y" * (MAX_SYNTAX_WIDTH + 1000) + "'"
+        mixed.write_text("import os\n" + long_line + "\nprint(os.sep)\n")
+
+        result = subprocess.run(
+            ["richless", str(mixed)],
+            capture_output=True,
+            text=True,
+            env=ansi_test_env(),
+        )
+
+        assert result.returncode == 0
+        lines = result.stdout.split("\n")
+        assert lines[1] == long_line
+        assert has_multiple_colors(lines[0])
+        assert has_multiple_colors(lines[2])
+
+class TestEarlyClose:
+    """Tests for stopping when less quits before reading all the output."""
+
+    # Far less than rendering these inputs in full takes
+    CPU_BUDGET_SECONDS = 1.5
+
+    def read_then_close(self, args, env, stdin=None):
+        """Read the first screen of richless's output, close it, and wait for richless.
+
+        Returns the exit code, the CPU seconds richless (and its workers) used,
+        and what it wrote to stderr.
+        """
+        proc = subprocess.Popen(["richless", *args], stdin=stdin, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, env=env)
+        assert proc.stdout.read(4096)
+        proc.stdout.close()
+        _pid, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+        return proc.returncode, usage.ru_utime + usage.ru_stime, stderr
+
+    @pytest.mark.parametrize("workers", ["1", "2"])
+    def test_stops_rendering_when_output_closes(self, tmp_path, workers):
+        source = tmp_path / "big.py"
+        source.write_text("".join(
+            f"def function_{i}(x):\n    \"\"\"Docstring {i}.\"\"\"\n    return x * {i}  # comment\n\n"
+            for i in range(50_000)))
+        env = ansi_test_env({"RICHLESS_CACHE": "0", "RICHLESS_WORKERS": workers,
+                             "RICHLESS_SOCKET": str(tmp_path / "absent.sock")})
+        exit_code, cpu_seconds, stderr = self.read_then_close([str(source)], env)
+        assert exit_code == 0
+        assert stderr == b""
+        assert cpu_seconds < self.CPU_BUDGET_SECONDS, f"richless used {cpu_seconds:.2f}s of CPU"
+
+    def test_stops_waiting_for_piped_input_when_output_closes(self, tmp_path):
+        env = ansi_test_env({"RICHLESS_CACHE": "0"})
+        producer = subprocess.Popen(
+            [sys.executable, "-c", "import time\nprint('log line\\n' * 2000, flush=True)\ntime.sleep(30)"],
+            stdout=subprocess.PIPE)
+        try:
+            start = time.monotonic()
+            exit_code, _cpu_seconds, stderr = self.read_then_close(["-"], env, stdin=producer.stdout)
+            # The producer is still running, but less is gone
+            assert time.monotonic() - start < 5
+            assert exit_code == 0
+            assert stderr == b""
+        finally:
+            producer.kill()
+            producer.wait()
+            producer.stdout.close()
+
+
+class TestRenderBudget:
+    """Tests for switching to raw output when the render budget runs out."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+    @pytest.fixture(autouse=True)
+    def ansi_engine(self, monkeypatch):
+        monkeypatch.delenv("RICHLESS_ENGINE", raising=False)
+        monkeypatch.setenv("RICHLESS_WORKERS", "1")
+
+    def render(self, content: str, budget: RenderBudget, lexer: str = "python") -> str:
+        out = io.StringIO()
+        stream_syntax(content, lexer, file=out, budget=budget)
+        return out.getvalue()
+
+    def test_size_budget_switches_to_raw_mid_stream(self):
+        content = (self.FIXTURES_DIR / "test.py").read_text() * 20
+        budget = RenderBudget(max_chars=len(content) // 2)
+        output = self.render(content, budget)
+        assert budget.stopped_by == "size"
+        raw = content[budget.stopped_at:] + "\n"
+        assert output.endswith(raw)
+        assert has_multiple_colors(output[:-len(raw)])
+
+    def test_time_budget_writes_everything_raw_once_exhausted(self):
+        content = (self.FIXTURES_DIR / "test.py").read_text()
+        budget = RenderBudget(seconds=1e-9)
+        assert self.render(content, budget) == content.expandtabs(4) + "\n"
+        assert budget.stopped_by == "time"
+
+    def test_no_limits_highlights_everything(self):
+        content = (self.FIXTURES_DIR / "test.py").read_text()
+        budget = RenderBudget()
+        output = self.render(content, budget)
+        assert budget.stopped_at is None
+        assert output.count("\n") == content.count("\n") + 1
+        assert has_multiple_colors(output.splitlines()[-2])
+
+    def test_parallel_path_respects_budget(self, monkeypatch):
+        import richless
+
+        monkeypatch.setenv("RICHLESS_WORKERS", "2")
+        monkeypatch.setattr(richless, "PARALLEL_MIN_CHARS", 1)
+        monkeypatch.setattr(richless, "PARALLEL_CHUNK_LINES", 40)
+        content = '{"key": "value"}\n' * 2000
+        budget = RenderBudget(max_chars=len(content) // 2)
+        output = self.render(content, budget, lexer="json")
+        assert budget.stopped_by == "size"
+        raw = content[budget.stopped_at:] + "\n"
+        assert output.endswith(raw)
+        assert has_multiple_colors(output[:-len(raw)])
+
+    def test_waiting_for_a_slow_producer_is_not_charged(self):
+        proc = subprocess.Popen(["richless", "-"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                env=ansi_test_env({"RICHLESS_BUDGET_SECONDS": "1"}))
+        try:
+            # Runs well past the budget, while rendering takes far less
+            for i in range(8):
+                proc.stdin.write(f'{{"tick": {i}}}\n'.encode())
+                proc.stdin.flush()
+                time.sleep(0.3)
+        finally:
+            proc.stdin.close()
+        output = proc.stdout.read().decode()
+        proc.wait(timeout=10)
+        lines = output.split("\n")[:8]
+        assert all(has_multiple_colors(line) for line in lines)
+
+    @pytest.mark.parametrize("debug", ["1", ""])
+    def test_cutover_reported_only_in_debug_mode(self, tmp_path, debug):
+        result = subprocess.run(
+            ["richless", str(self.FIXTURES_DIR / "test.py")],
+            capture_output=True,
+            text=True,
+            env=ansi_test_env({"RICHLESS_BUDGET_MB": "0.0001", "RICHLESS_DEBUG": debug}),
+        )
+        assert result.returncode == 0
+        assert ("render budget" in result.stderr) == bool(debug)
+
+    def test_cut_short_render_is_not_cached(self, tmp_path):
+        cache_dir = tmp_path / "cache"
+        subprocess.run(
+            ["richless", str(self.FIXTURES_DIR / "test.py")],
+            capture_output=True,
+            env=ansi_test_env({"RICHLESS_CACHE": "1", "RICHLESS_CACHE_DIR": str(cache_dir),
+                               "RICHLESS_BUDGET_MB": "0.0001"}),
+        )
+        assert not any(p for p in cache_dir.iterdir() if p.is_file() and not p.name.startswith("."))
+
+
+class TestDiagnostics:
+    """Tests for RICHLESS_DEBUG stage timing and RICHLESS_PROFILE dumps."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+    def run_diagnosed(self, home, *args, extra=None, stdin=None):
+        env = {"HOME": str(home), "RICHLESS_SOCKET": str(home / "no-server.sock")}
+        env.update(extra or {})
+        return subprocess.run(
+            ["richless", *args],
+            input=stdin,
+            capture_output=True,
+            text=True,
+            env=ansi_test_env(env),
+        )
+
+    def read_log(self, home) -> list[dict]:
+        log = home / ".richless" / "debug.log"
+        return [json.loads(line) for line in log.read_text().splitlines()]
+
+    def test_debug_writes_timing_record(self, tmp_path):
+        path = str(self.FIXTURES_DIR / "test.py")
+        result = self.run_diagnosed(tmp_path, path, extra={"RICHLESS_DEBUG": "1"})
+        assert result.returncode == 0
+        [record] = self.read_log(tmp_path)
+        assert record["file"] == path
+        assert record["exit"] == 0
+        assert {"read", "lexer", "render", "write", "imports"} <= set(record["stages_ms"])
+        assert sum(record["stages_ms"].values()) <= record["total_ms"] + 1
+
+    def test_debug_does_not_change_output(self, tmp_path):
+        path = str(self.FIXTURES_DIR / "test.md")
+        plain = self.run_diagnosed(tmp_path / "off", path)
+        debugged = self.run_diagnosed(tmp_path / "on", path, extra={"RICHLESS_DEBUG": "1"})
+        assert debugged.stdout == plain.stdout
+
+    def test_stdin_records_detection(self, tmp_path):
+        self.run_diagnosed(tmp_path, "-", extra={"RICHLESS_DEBUG": "1"}, stdin='{"a": 1}\n')
+        [record] = self.read_log(tmp_path)
+        assert "detect" in record["stages_ms"]
+
+    def test_profile_dumps_pstats(self, tmp_path):
+        import pstats
+
+        self.run_diagnosed(tmp_path, str(self.FIXTURES_DIR / "test.json"), extra={"RICHLESS_PROFILE": "1"})
+        [record] = self.read_log(tmp_path)
+        stats = pstats.Stats(record["profile"])
+        assert any(func[2] == "render_text_file" for func in stats.stats)
+
+    def test_nothing_written_by_default(self, tmp_path):
+        self.run_diagnosed(tmp_path, str(self.FIXTURES_DIR / "test.py"))
+        assert not (tmp_path / ".richless").exists()
+
+    def test_nested_stages_are_charged_their_own_time(self):
+        from richless import StageTimer
+
+        timer = StageTimer()
+        with timer.stage("render"):
+            time.sleep(0.02)
+            with timer.stage("write"):
+                time.sleep(0.05)
+        assert 0.015 < timer.stages["render"] < 0.045
+        assert timer.stages["write"] >= 0.05
+
+
+class TestRenderCache:
+    """Tests for the on-disk rendered-output cache."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+    def run_cached(self, filepath, cache_dir, extra=None):
+        env = {"RICHLESS_CACHE": "1", "RICHLESS_CACHE_DIR": str(cache_dir)}
+        env.update(extra or {})
+        return subprocess.run(
+            ["richless", str(filepath)],
+            capture_output=True,
+            text=True,
+            env=ansi_test_env(env),
+        )
+
+    def entries(self, cache_dir):
+        """List the whole renders in the cache, leaving out its running size."""
+        return [p for p in cache_dir.iterdir() if p.is_file() and p.name != richless.CACHE_SIZE_FILE]
+
+    def test_cache_disabled_by_default(self, tmp_path):
+        env = ansi_test_env({"XDG_CACHE_HOME": str(tmp_path)})
+        env.pop("RICHLESS_CACHE", None)
+        subprocess.run(["richless", str(self.FIXTURES_DIR / "test.py")],
+                       capture_output=True, env=env)
+        assert not (tmp_path / "richless").exists()
+
+    def test_hit_returns_same_output(self, tmp_path):
+        cache_dir = tmp_path / "cache"
+        first = self.run_cached(self.FIXTURES_DIR / "test.json", cache_dir)
+        assert len(self.entries(cache_dir)) == 1
+        second = self.run_cached(self.FIXTURES_DIR / "test.json", cache_dir)
+        assert second.returncode == 0
+        assert second.stdout == first.stdout
+        assert has_multiple_colors(second.stdout)
+
+    def test_modified_file_is_rerendered(self, tmp_path):
+        cache_dir = tmp_path / "cache"
+        source = tmp_path / "data.json"
+        source.write_text('{"before": 1}\n')
+        self.run_cached(source, cache_dir)
+        source.write_text('{"after": 22}\n')
+        result = self.run_cached(source, cache_dir)
+        assert "after" in result.stdout
+        assert len(self.entries(cache_dir)) == 2
+
+    def test_width_is_part_of_key(self, tmp_path):
+        cache_dir = tmp_path / "cache"
+        self.run_cached(self.FIXTURES_DIR / "test.md", cache_dir, {"COLUMNS": "60"})
+        self.run_cached(self.FIXTURES_DIR / "test.md", cache_dir, {"COLUMNS": "100"})
+        assert len(self.entries(cache_dir)) == 2
+
+    def test_no_temp_files_left_behind(self, tmp_path):
+        cache_dir = tmp_path / "cache"
+        self.run_cached(self.FIXTURES_DIR / "test.py", cache_dir)
+        assert not [p for p in cache_dir.iterdir() if p.name.startswith(".tmp-")]
+
+    def test_eviction_removes_least_recently_used(self, tmp_path):
+        for i, name in enumerate(["old", "mid", "new"]):
+            entry = tmp_path / name
+            entry.write_bytes(b"x" * 100)
+            os.utime(entry, (1000 + i, 1000 + i))
+        evict_cache(tmp_path, 250)
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["mid", "new"]
+
+    def test_markdown_edit_rerenders_only_changed_blocks(self, tmp_path, monkeypatch):
+        content = (self.FIXTURES_DIR / "test.md").read_text()
+        render_markdown(content, file=io.StringIO(), width=80, block_cache_dir=tmp_path)
+
+        rendered = []
+        render_run = richless.render_markdown_run
+
+        def spy(console, chunk, *args):
+            rendered.append(chunk)
+            return render_run(console, chunk, *args)
+
+        monkeypatch.setattr(richless, "render_markdown_run", spy)
+        edited = content.replace("## ", "## Edited ", 1)
+        out = io.StringIO()
+        render_markdown(edited, file=out, width=80, block_cache_dir=tmp_path)
+        assert len(rendered) == 1 and rendered[0].startswith("## Edited ")
+
+        expected = io.StringIO()
+        render_markdown(edited, file=expected, width=80)
+        assert out.getvalue() == expected.getvalue()
+
+    def test_whole_cache_tree_is_bounded(self, tmp_path):
+        cache_dir = tmp_path / "cache"
+        for i in range(3):
+            doc = tmp_path / f"doc{i}.md"
+            doc.write_text("".join(f"## Section {i} {j}\n\nParagraph {j}.\n\n" for j in range(100)))
+            self.run_cached(doc, cache_dir, {"RICHLESS_CACHE_MAX_MB": "0.02"})
+        files = [p for p in cache_dir.rglob("*") if p.is_file()]
+        assert any(p.parent.name == "blocks" for p in files)
+        assert sum(p.stat().st_size for p in files) <= 0.02 * 1024 * 1024
+
+    def test_writes_under_the_bound_do_not_walk_the_cache(self, tmp_path, monkeypatch):
+        walks = []
+        real_walk = os.walk
+        monkeypatch.setattr(os, "walk", lambda top: walks.append(top) or real_walk(top))
+        for i in range(3):
+            writer = richless.CacheWriter(tmp_path / f"entry{i}", io.StringIO(), 250)
+            writer.write("x" * 100)
+            writer.commit()
+        # Only the first write, with no running size yet, counts the cache;
+        # the third goes over the bound and evicts the oldest entry
+        assert len(walks) == 2
+        assert sorted(p.name for p in self.entries(tmp_path)) == ["entry1", "entry2"]
+        assert (tmp_path / richless.CACHE_SIZE_FILE).read_text() == "200"
+
+    def test_eviction_counts_subdirectories(self, tmp_path):
+        (tmp_path / "blocks").mkdir()
+        (tmp_path / "gutter").mkdir()
+        for i, path in enumerate(["blocks/old", "entry", "gutter/new"]):
+            (tmp_path / path).write_bytes(b"x" * 100)
+            os.utime(tmp_path / path, (1000 + i, 1000 + i))
+        evict_cache(tmp_path, 250)
+        assert sorted(str(p.relative_to(tmp_path)) for p in tmp_path.rglob("*") if p.is_file()) \
+            == ["entry", "gutter/new"]
+
+
+class TestRenderServer:
+    """Tests for richless --server and the client fallback."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+    @pytest.fixture
+    def server(self, tmp_path):
+        socket_path = tmp_path / "richless.sock"
+        env = ansi_test_env({"RICHLESS_SOCKET": str(socket_path), "RICHLESS_SERVER": "1"})
+        proc = subprocess.Popen(["richless", "--server", "--idle-timeout", "2"], env=env)
+        deadline = time.monotonic() + 10
+        while not socket_path.exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        yield proc, env
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    def run_richless(self, env, *args):
+        return subprocess.run(["richless", *args], capture_output=True, text=True, env=env)
+
+    @pytest.mark.parametrize("name", ["test.md", "test.json", "test.py"])
+    def test_server_output_matches_in_process(self, server, tmp_path, name):
+        _proc, env = server
+        via_server = self.run_richless(env, str(self.FIXTURES_DIR / name))
+        in_process = self.run_richless(
+            ansi_test_env({"RICHLESS_SOCKET": str(tmp_path / "absent.sock")}),
+            str(self.FIXTURES_DIR / name),
+        )
+        assert via_server.returncode == 0
+        assert via_server.stdout == in_process.stdout
+
+    def test_server_reports_missing_file(self, server):
+        _proc, env = server
+        result = self.run_richless(env, "/nonexistent/file.py")
+        assert result.returncode == 1
+        assert "File not found" in result.stderr
+
+    def test_client_falls_back_without_server(self, tmp_path):
+        env = ansi_test_env({"RICHLESS_SOCKET": str(tmp_path / "absent.sock")})
+        result = self.run_richless(env, str(self.FIXTURES_DIR / "test.py"))
+        assert result.returncode == 0
+        assert has_multiple_colors(result.stdout)
+
+    @pytest.fixture
+    def listener(self, tmp_path):
+        """A socket that accepts no requests, to see whether a client connects."""
+        socket_dir = tmp_path / "sockets"
+        socket_dir.mkdir(mode=0o700)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(str(socket_dir / "richless.sock"))
+        sock.listen()
+        sock.setblocking(False)
+        yield socket_dir / "richless.sock", sock
+        sock.close()
+
+    @pytest.mark.parametrize("enabled,mode", [("0", 0o700), ("1", 0o755)])
+    def test_client_skips_disabled_or_untrusted_server(self, listener, enabled, mode):
+        socket_path, sock = listener
+        socket_path.parent.chmod(mode)
+        env = ansi_test_env({"RICHLESS_SOCKET": str(socket_path), "RICHLESS_SERVER": enabled})
+        result = self.run_richless(env, str(self.FIXTURES_DIR / "test.py"))
+        assert result.returncode == 0
+        assert has_multiple_colors(result.stdout)
+        with pytest.raises(BlockingIOError):
+            sock.accept()
+
+    def test_server_refuses_untrusted_socket_dir(self, tmp_path):
+        socket_dir = tmp_path / "shared"
+        socket_dir.mkdir(mode=0o755)
+        socket_dir.chmod(0o755)
+        result = self.run_richless(ansi_test_env({"RICHLESS_SOCKET": str(socket_dir / "richless.sock")}),
+                                   "--server", "--idle-timeout", "1")
+        assert result.returncode == 1
+        assert "mode 0700" in result.stderr
+        assert not (socket_dir / "richless.sock").exists()
+
+    def test_peer_uid(self):
+        left, right = socket.socketpair()
+        with left, right:
+            assert richless.get_peer_uid(left) in (None, os.getuid())
+
+    def test_server_exits_when_idle(self, server, tmp_path):
+        proc, _env = server
+        assert proc.wait(timeout=15) == 0
+        assert not (tmp_path / "richless.sock").exists()
+
+
+class TestGitGutter:
+    """Tests for git change markers (RICHLESS_GIT_GUTTER)."""
+
+    @pytest.fixture
+    def repo(self, tmp_path):
+        if shutil.which("git") is None:
+            pytest.skip("git is not installed")
+        repo = tmp_path / "repo"
+        repo.mkdir()
+        git = ["git", "-C", str(repo), "-c", "user.name=t", "-c", "user.email=t@example.com"]
+        subprocess.run([*git, "init", "-q"], check=True)
+        (repo / "code.py").write_text("a = 1\nb = 2\nc = 3\nd = 4\ne = 5\n")
+        subprocess.run([*git, "add", "code.py"], check=True)
+        subprocess.run([*git, "commit", "-q", "-m", "initial"], check=True)
+        return repo
+
+    def test_diff_line_changes(self):
+        old = ["a", "b", "c", "d", "e"]
+        new = ["a", "B", "c", "e", "f"]
+        assert richless.diff_line_changes(old, new) == {1: "modified", 3: "removed-above", 4: "added"}
+        assert richless.diff_line_changes(["a", "b"], ["a"]) == {0: "removed-below"}
+
+    def test_finds_changes_against_index(self, repo):
+        path = repo / "code.py"
+        assert richless.find_git_changes(str(path)) == {}
+        path.write_text("a = 1\nb = 20\nc = 3\ne = 5\nf = 6\n")
+        assert richless.find_git_changes(str(path)) == {1: "modified", 3: "removed-above", 4: "added"}
+
+    def test_untracked_file_has_no_changes(self, repo, tmp_path):
+        (repo / "new.py").write_text("x = 1\n")
+        (tmp_path / "outside.py").write_text("x = 1\n")
+        assert richless.find_git_changes(str(repo / "new.py")) == {}
+        assert richless.find_git_changes(str(tmp_path / "outside.py")) == {}
+
+    def test_render_tree_output_has_no_markers(self, repo, tmp_path):
+        (repo / "code.py").write_text("a = 1\nb = 20\nc = 3\n")
+        result = subprocess.run(["richless", "--render-tree", str(repo), str(tmp_path / "dest")],
+                                capture_output=True, text=True, env=ansi_test_env({"RICHLESS_GIT_GUTTER": "1"}))
+        assert result.returncode == 0
+        plain = subprocess.run(["richless", str(repo / "code.py")], capture_output=True, text=True,
+                               env=ansi_test_env({"RICHLESS_GIT_GUTTER": "0"}))
+        assert (tmp_path / "dest" / "code.py.ansi").read_text() == plain.stdout
+
+    def test_changes_are_cached_by_blob(self, repo, tmp_path, monkeypatch):
+        monkeypatch.setenv("RICHLESS_CACHE", "1")
+        monkeypatch.setenv("RICHLESS_CACHE_DIR", str(tmp_path / "cache"))
+        path = repo / "code.py"
+        path.write_text("a = 1\nb = 20\n")
+        changes = richless.find_git_changes(str(path))
+        assert len(list((tmp_path / "cache" / "gutter").iterdir())) == 1
+        # A cached diff is used without reading the blob again
+        runs = []
+        real_run = subprocess.run
+        monkeypatch.setattr(subprocess, "run", lambda args, **kw: runs.append(args) or real_run(args, **kw))
+        assert richless.find_git_changes(str(path)) == changes
+        assert [args[3] for args in runs] == ["ls-files"]
+
+    def test_richless_marks_changed_lines(self, repo, tmp_path):
+        path = repo / "code.py"
+        path.write_text("a = 1\nb = 20\nc = 3\nd = 4\ne = 5\nf = 6\n")
+        env = ansi_test_env({"RICHLESS_GIT_GUTTER": "1", "RICHLESS_SOCKET": str(tmp_path / "absent.sock")})
+        result = subprocess.run(["richless", str(path)], capture_output=True, text=True, env=env)
+        lines = result.stdout.split("\n")
+        assert lines[0].startswith(richless.GIT_GUTTER_BLANK + "\x1b[")
+        assert lines[1].startswith(richless.GIT_GUTTER_MARKERS["modified"])
+        assert lines[5].startswith(richless.GIT_GUTTER_MARKERS["added"])
+        plain = subprocess.run(["richless", str(path)], capture_output=True, text=True,
+                               env=ansi_test_env({"RICHLESS_SOCKET": str(tmp_path / "absent.sock")}))
+        gutter = re.compile(r"^(?: {2}|\x1b\[[0-9;]*m.\x1b\[0m )")
+        assert [gutter.sub("", line) for line in lines[:6]] == plain.stdout.split("\n")[:6]
+
+    @pytest.mark.parametrize("name, content, expected", [
+        ("code.py", "a = 1\n", True),
+        ("hosts.csv", "host,port\nexample.com,443\n", False),
+        ("data.json", '{"items": [' + ", ".join(["1"] * MAX_SYNTAX_WIDTH) + "]}\n", False),
+        ("events.json", '{"a": 1}\n{"a": 2}\n', True),
+        ("large.py", "a = 1\n" * 100, False),
+    ], ids=["source", "table", "minified-json", "json-lines", "over-size"])
+    def test_only_files_rendered_line_for_line_get_markers(self, tmp_path, monkeypatch, name, content, expected):
+        monkeypatch.setattr(richless, "GIT_GUTTER_MAX_BYTES", 500)
+        path = tmp_path / name
+        path.write_text(content)
+        assert richless.can_mark_lines(str(path)) == expected
+
+    def test_table_gets_no_gutter(self, repo, tmp_path):
+        path = repo / "hosts.csv"
+        path.write_text('host,note\nexample.com,"two\nlines"\n')
+        env = ansi_test_env({"RICHLESS_SOCKET": str(tmp_path / "absent.sock")})
+        marked = subprocess.run(["richless", str(path)], capture_output=True, text=True,
+                                env={**env, "RICHLESS_GIT_GUTTER": "1"})
+        plain = subprocess.run(["richless", str(path)], capture_output=True, text=True, env=env)
+        assert marked.stdout == plain.stdout
+
+    def test_first_write_does_not_wait_for_diff(self):
+        class SlowGutter(richless.GitGutter):
+            def __init__(self):
+                self.changes = {}
+                self.done = threading.Event()
+
+        gutter = SlowGutter()
+        out = io.StringIO()
+        writer = richless.GutterWriter(out, gutter)
+        start = time.monotonic()
+        writer.write("one\ntwo\nthr")
+        assert time.monotonic() - start < richless.GIT_GUTTER_WAIT_SECONDS / 2
+        gutter.changes = {2: "added", 3: "modified"}
+        gutter.done.set()
+        writer.write("ee\nfour\n")
+        blank, added, modified = (richless.GIT_GUTTER_BLANK, richless.GIT_GUTTER_MARKERS["added"],
+                                  richless.GIT_GUTTER_MARKERS["modified"])
+        # Line 3 started in the first write, before the diff was known
+        assert out.getvalue() == f"{blank}one\n{blank}two\n{blank}three\n{modified}four\n"
+        assert added not in out.getvalue()
+
+
+class TestBatchRendering:
+    """Tests for richless --batch and RICHLESS_BATCH_DIR."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+    @pytest.fixture
+    def batch(self, tmp_path):
+        files = []
+        for name in ("test.md", "test.yaml"):
+            files.append(tmp_path / name)
+            files[-1].write_text((self.FIXTURES_DIR / name).read_text())
+        env = ansi_test_env({"COLUMNS": "90"})
+        result = subprocess.run(["richless", "--batch", "--md", *map(str, files)],
+                                capture_output=True, text=True, env=env, check=True)
+        batch_dir = Path(result.stdout.strip())
+        manifest = json.loads((batch_dir / "manifest.json").read_text())
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                os.kill(manifest["pid"], 0)
+            except ProcessLookupError:
+                break
+            time.sleep(0.05)
+        yield files, batch_dir, {**env, "RICHLESS_BATCH_DIR": str(batch_dir)}
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+    def test_outputs_match_single_renders(self, batch):
+        files, batch_dir, env = batch
+        assert sorted(p.name for p in batch_dir.iterdir()) == ["0", "1", "manifest.json"]
+        for path in files:
+            single = subprocess.run(["richless", "--md", str(path)], capture_output=True,
+                                    text=True, env={**env, "RICHLESS_BATCH_DIR": ""})
+            batched = subprocess.run(["richless", "--md", str(path)], capture_output=True,
+                                     text=True, env=env)
+            assert has_markdown_formatting(batched.stdout)
+            assert strip_link_ids(batched.stdout) == strip_link_ids(single.stdout)
+
+    def test_output_comes_from_batch(self, batch):
+        files, batch_dir, env = batch
+        (batch_dir / "0").write_text("prerendered\n")
+        result = subprocess.run(["richless", "--md", str(files[0])], capture_output=True,
+                                text=True, env=env)
+        assert result.stdout == "prerendered\n"
+
+    def test_changed_file_is_rendered_afresh(self, batch):
+        files, batch_dir, env = batch
+        (batch_dir / "0").write_text("prerendered\n")
+        files[0].write_text("# Changed heading\n")
+        result = subprocess.run(["richless", "--md", str(files[0])], capture_output=True,
+                                text=True, env=env)
+        assert "Changed heading" in result.stdout
+
+    @pytest.mark.parametrize("args, columns", [(["--md"], "120"), ([], "90")])
+    def test_other_width_or_flags_are_rendered_afresh(self, batch, args, columns):
+        files, batch_dir, env = batch
+        (batch_dir / "0").write_text("prerendered\n")
+        result = subprocess.run(["richless", *args, str(files[0])], capture_output=True,
+                                text=True, env={**env, "COLUMNS": columns})
+        assert result.stdout != "prerendered\n"
+        assert has_markdown_formatting(result.stdout)
+
+    def test_one_less_opens_every_file(self, batch):
+        files, _batch_dir, env = batch
+        result = subprocess.run(["less", "-R", *map(str, files)], capture_output=True, text=True,
+                                env={**env, "LESSOPEN": "|richless --md %s"})
+        assert "Test Markdown" in result.stdout
+        assert "second value" in result.stdout
+
+    def test_missing_file_is_left_to_richless(self, tmp_path):
+        result = subprocess.run(["richless", "--batch", str(tmp_path / "absent.md")],
+                                capture_output=True, text=True, check=True)
+        batch_dir = Path(result.stdout.strip())
+        try:
+            assert json.loads((batch_dir / "manifest.json").read_text())["files"] == {}
+            rendered = subprocess.run(["richless", str(tmp_path / "absent.md")], capture_output=True,
+                                      text=True, env={**os.environ, "RICHLESS_BATCH_DIR": str(batch_dir)})
+            assert rendered.returncode == 1
+            assert "File not found" in rendered.stderr
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+    def test_renders_serially_without_a_pool_context(self, tmp_path, monkeypatch):
+        import concurrent.futures
+
+        monkeypatch.setattr(richless, "get_pool_context", lambda: None)
+        monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", None)
+        monkeypatch.setenv("RICHLESS_WORKERS", "4")
+        files = {}
+        for i, name in enumerate(("test.yaml", "test.py")):
+            files[str(self.FIXTURES_DIR / name)] = {"output": str(i)}
+        richless.render_batch(files, False, 90, tmp_path)
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["0", "1"]
+        assert has_multiple_colors((tmp_path / "1").read_text())
+
+    def test_wrapper_stops_renderer_before_removing_batch(self, tmp_path):
+        import pty
+
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        # A less that quits at once, keeping the manifest of the batch it was given
+        fake_less = bin_dir / "less"
+        fake_less.write_text('#!/bin/sh\ncp "$RICHLESS_BATCH_DIR/manifest.json" "$MANIFEST_COPY"\n')
+        fake_less.chmod(0o755)
+        files = [tmp_path / "a.md", tmp_path / "big.py"]
+        files[0].write_text("# Title\n")
+        files[1].write_text("def f(x):\n    return x + 1\n\n" * 200000)
+        init = Path(__file__).parent.parent / "richless-init.sh"
+        env = ansi_test_env({"PATH": f"{bin_dir}:{os.environ['PATH']}", "TMPDIR": str(tmp_path),
+                             "MANIFEST_COPY": str(tmp_path / "manifest.json"), "RICHLESS_WORKERS": "1"})
+        primary, secondary = pty.openpty()
+        try:
+            # The wrapper batches files only when run from a terminal
+            subprocess.run(["sh", "-c", f'. "{init}" && less --md {files[0]} {files[1]}'],
+                           stdin=secondary, capture_output=True, env=env, check=True, timeout=30)
+        finally:
+            os.close(primary)
+            os.close(secondary)
+        pid = json.loads((tmp_path / "manifest.json").read_text())["pid"]
+        try:
+            state = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()[0]
+        except FileNotFoundError:
+            state = None
+        assert state in (None, "Z")
+        assert not list(tmp_path.glob("richless-batch-*"))
+
+    def test_several_files_need_batch(self):
+        result = subprocess.run(["richless", "a.md", "b.md"], capture_output=True, text=True)
+        assert result.returncode == 2
+
+
+class TestRenderTree:
+    """Tests for richless --render-tree."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+    @pytest.fixture
+    def tree(self, tmp_path):
+        src = tmp_path / "src"
+        (src / "docs").mkdir(parents=True)
+        (src / ".hidden").mkdir()
+        (src / "build").mkdir()
+        (src / "docs" / "runbook.md").write_text((self.FIXTURES_DIR / "test.md").read_text())
+        (src / "config.yaml").write_text((self.FIXTURES_DIR / "test.yaml").read_text())
+        (src / ".hidden" / "notes.md").write_text("# Hidden\n")
+        (src / "build" / "out.py").write_text("print('ignored')\n")
+        (src / "logo.png").write_bytes(b"\x89PNG\r\n\x1a\n" + b"\0" * 64)
+        (src / ".gitignore").write_text("build/\n")
+        subprocess.run(["git", "init", "-q", str(src)], check=True)
+        return src, tmp_path / "dest"
+
+    def render_tree(self, src, dest, env=None):
+        return subprocess.run(["richless", "--render-tree", str(src), str(dest)], capture_output=True,
+                              text=True, env=ansi_test_env({"COLUMNS": "90", **(env or {})}))
+
+    def test_renders_text_files_like_richless(self, tree):
+        src, dest = tree
+        result = self.render_tree(src, dest)
+        assert result.returncode == 0
+        outputs = sorted(str(p.relative_to(dest)) for p in dest.rglob("*") if p.is_file())
+        assert outputs == [".gitignore.ansi", ".richless-tree.json", "config.yaml.ansi",
+                           "docs/runbook.md.ansi"]
+        for name in ("docs/runbook.md", "config.yaml"):
+            single = subprocess.run(["richless", str(src / name)], capture_output=True, text=True,
+                                    env=ansi_test_env({"COLUMNS": "90"}))
+            rendered = (dest / f"{name}.ansi").read_text()
+            assert strip_link_ids(rendered) == strip_link_ids(single.stdout)
+        assert has_markdown_formatting((dest / "docs/runbook.md.ansi").read_text())
+        assert "Rendered 3 files" in result.stdout
+        assert "files/s" in result.stdout and "MB/s" in result.stdout
+        assert "1 binary" in result.stdout
+
+    def test_up_to_date_files_are_skipped(self, tree):
+        src, dest = tree
+        self.render_tree(src, dest)
+        result = self.render_tree(src, dest)
+        assert "Rendered 0 files" in result.stdout
+        assert "3 up to date" in result.stdout
+
+        (src / "config.yaml").write_text("changed: true\n")
+        result = self.render_tree(src, dest)
+        assert "Rendered 1 files" in result.stdout
+        assert "2 up to date" in result.stdout
+        assert "changed" in (dest / "config.yaml.ansi").read_text()
+
+    def test_budget_does_not_cut_exported_files_short(self, tree):
+        src, dest = tree
+        # About 100 characters: far less than config.yaml
+        self.render_tree(src, dest, {"RICHLESS_BUDGET_MB": "0.0001", "RICHLESS_BUDGET_SECONDS": "0.001"})
+        full = subprocess.run(["richless", str(src / "config.yaml")], capture_output=True, text=True,
+                              env=ansi_test_env({"COLUMNS": "90", "RICHLESS_BUDGET_MB": "0"}))
+        assert (dest / "config.yaml.ansi").read_text() == full.stdout
+
+    def test_renders_serially_without_a_pool_context(self, tree, monkeypatch, capsys):
+        src, dest = tree
+        import concurrent.futures
+
+        monkeypatch.setattr(richless, "get_pool_context", lambda: None)
+        monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", None)
+        monkeypatch.setenv("RICHLESS_WORKERS", "4")
+        assert richless.render_tree(str(src), str(dest), False) == 0
+        assert "Rendered 3 files" in capsys.readouterr().out
+        assert (dest / "config.yaml.ansi").read_text()
+
+    def test_missing_source_directory(self, tmp_path):
+        result = self.render_tree(tmp_path / "absent", tmp_path / "dest")
+        assert result.returncode == 1
+        assert "Not a directory" in result.stderr
+
+
+class TestCompressedInput:
+    """Tests for gzip, bzip2 and xz input."""
+
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+    COMPRESSORS = {"gz": gzip.compress, "bz2": bz2.compress, "xz": lzma.compress}
+
+    def run_richless(self, *args, **kwargs):
+        return subprocess.run(["richless", *args], capture_output=True,
+                              env=ansi_test_env({"COLUMNS": "90"}), **kwargs)
+
+    @pytest.mark.parametrize("suffix", ["gz", "bz2", "xz"])
+    @pytest.mark.parametrize("name", ["test.py", "test.md", "test.jsonl"])
+    def test_output_matches_uncompressed_file(self, tmp_path, name, suffix):
+        source = self.FIXTURES_DIR / name
+        compressed = tmp_path / f"{name}.{suffix}"
+        compressed.write_bytes(self.COMPRESSORS[suffix](source.read_bytes()))
+        expected = self.run_richless(str(source)).stdout.decode()
+        assert strip_link_ids(self.run_richless(str(compressed)).stdout.decode()) == strip_link_ids(expected)
+        piped = self.run_richless("-", input=compressed.read_bytes()).stdout.decode()
+        assert has_ansi_colors(piped)
+
+    @pytest.mark.parametrize("name, content, expected", [
+        ("conn.log.gz", '{"ts": 1, "uid": "C1"}\n', "json"),
+        ("data.json.xz", '{"key": "value"}\n', "json"),
+        ("notes.md.bz2", "text\n", "markdown"),
+        ("script.gz", "#!/bin/sh\necho hi\n", "bash"),
+    ])
+    def test_format_comes_from_inner_name_and_content(self, tmp_path, name, content, expected):
+        path = tmp_path / name
+        path.write_bytes(self.COMPRESSORS[name.rsplit(".", 1)[1]](content.encode()))
+        assert self.run_richless("--detect", str(path)).stdout.decode() == f"{expected}\n"
+
+    def test_concatenated_streams(self, tmp_path):
+        path = tmp_path / "two.txt.gz"
+        path.write_bytes(gzip.compress(b"first\n") + gzip.compress(b"second\n"))
+        output = self.run_richless(str(path)).stdout.decode()
+        assert "first" in output and "second" in output
+
+    def test_compressed_binary_gets_no_output(self, tmp_path):
+        path = tmp_path / "archive.tar.gz"
+        path.write_bytes(gzip.compress(b"\0" * 1024))
+        result = self.run_richless(str(path))
+        assert result.returncode == 0
+        assert result.stdout == b""
+
+    @pytest.mark.parametrize("suffix", ["gz", "bz2", "xz"])
+    def test_decompressed_pieces_are_bounded(self, suffix):
+        data = b"a" * (20 * 1024 * 1024)
+        pieces = [out for out, _paused in iter_decompressed(
+            iter([(self.COMPRESSORS[suffix](data), False)]), {"gz": "gzip", "bz2": "bzip2"}.get(suffix, suffix))]
+        assert max(map(len, pieces)) <= PIPE_READ_BYTES
+        assert sum(map(len, pieces)) == len(data)
+
+
 class TestStdinInput:
     """Tests for reading from stdin via - or /dev/stdin."""
 
+    FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
     def test_stdin_dash_with_python_content(self):
         result = subprocess.run(
             ["richless", "-"],
@@ -571,3 +2351,89 @@ class TestStdinInput:
         )
         assert result.returncode == 0
         assert has_multiple_colors(result.stdout), "JSON via /dev/stdin should have syntax highlighting"
+
+    @pytest.mark.parametrize("name", ["test.json", "test.yaml", "test.jsonl", "test.toml", "test.txt"])
+    def test_stdin_matches_file_render(self, name):
+        content = (self.FIXTURES_DIR / name).read_text()
+        piped = subprocess.run(["richless", "-"], input=content, capture_output=True, text=True,
+                               env=ansi_test_env())
+        direct = subprocess.run(["richless", str(self.FIXTURES_DIR / name)], capture_output=True,
+                                text=True, env=ansi_test_env({"RICHLESS_CACHE": "0"}))
+        assert piped.stdout == direct.stdout
+
+    def test_stdin_markdown_is_detected(self):
+        content = (self.FIXTURES_DIR / "test.md").read_text()
+        result = subprocess.run(["richless", "-"], input=content, capture_output=True, text=True,
+                                env=ansi_test_env())
+        assert has_markdown_formatting(result.stdout)
+
+    def test_stdin_binary_passes_through(self):
+        data = b"\x00\x01binary\xff\n" * 100
+        result = subprocess.run(["richless", "-"], input=data, capture_output=True, env=ansi_test_env())
+        assert result.returncode == 0
+        assert result.stdout == data
+
+    def test_stdin_is_rendered_while_producer_runs(self):
+        proc = subprocess.Popen(["richless", "-"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                env=ansi_test_env())
+        try:
+            proc.stdin.write(b'{"event": "start"}\n' * 10)
+            proc.stdin.flush()
+            # The producer is still open, yet the first lines arrive
+            assert select.select([proc.stdout], [], [], 10)[0]
+            assert b"event" in os.read(proc.stdout.fileno(), 65536)
+        finally:
+            proc.stdin.close()
+            proc.wait(timeout=10)
+
+    @pytest.mark.parametrize("content,expected", [
+        ("# Title\n\n- item\n", "markdown"),
+        ("# comment\n[section]\nkey = 1\n", "toml"),
+        ("# comment\nkey: value\n- not markdown\n", "yaml"),
+        ('{"# not": "markdown"}\n', "json"),
+        ("just some words\n", "text"),
+    ])
+    def test_piped_format_detection(self, content, expected):
+        assert detect_format(content.encode()) == expected
+
+    @pytest.mark.parametrize("pieces", [
+        [('x = """\n\n', ''), ('unindented\n\n"""\ny = 1\n', ''), ('\n', '')],
+        # A blank line and an unindented one inside a string are no place to start lexing
+        [("def f():\n    return '''\n", ''), ("\nabc\n", ''), ("'''\n\nz = 1\n", '')] * 3 + [('\n', '')],
+    ])
+    def test_pieces_split_inside_strings_render_like_one_pass(self, pieces):
+        content = "".join(piece for piece, _peek in pieces)[:-1]
+        out = io.StringIO()
+        write_pipe_pieces(pieces, "python", False, out, RenderBudget())
+        expected = io.StringIO()
+        stream_syntax(content, "python", file=expected)
+        assert out.getvalue() == expected.getvalue()
+
+    @pytest.mark.parametrize("piece,count,lexer_name,jsonl", [
+        ('{"event": "tick", "n": 1}\n', 4000, "json", True),
+        ("def f():\n    return 1\n\n", 500, "python", False),
+        # No line where lexing starts afresh: the text to lex again keeps growing
+        ("x = [1,\n", 4000, "python", False),
+    ])
+    def test_paused_pieces_are_not_lexed_again_and_again(self, monkeypatch, piece, count, lexer_name, jsonl):
+        lexed = []
+        real_highlight_chunk = richless.highlight_chunk
+
+        def counting(chunk, peek, *args):
+            lexed.append(len(chunk) + len(peek))
+            return real_highlight_chunk(chunk, peek, *args)
+
+        monkeypatch.setattr(richless, "highlight_chunk", counting)
+        out = io.StringIO()
+        write_pipe_pieces([(piece, "")] * count, lexer_name, jsonl, out, RenderBudget())
+        total = len(piece) * count
+        if jsonl:
+            assert sum(lexed) == total
+        else:
+            assert sum(lexed) <= (2 + richless.PIPE_RELEX_FACTOR) * total + richless.PIPE_RELEX_MAX_CHARS
+        assert len(out.getvalue().split("\n")) == piece.count("\n") * count + 1
+
+    def test_pipe_pieces_keep_every_line(self):
+        chunks = [("a\nb", False), ("\nc\n", True), ("d", False)]
+        pieces = list(iter_pipe_pieces(chunks, line_safe=False))
+        assert pieces == [("a\nb\nc\n", ""), ("d\n", "")]